@@ -1,11 +1,28 @@
 #! banker_dom.py
 # a class for managing game state details
+import bisect
 import json
-from typing import Optional, List
+import os
+import sqlite3
+import tempfile
+from typing import Optional, List, Dict, Tuple, Set
 from datetime import datetime
 
+# optional fast paths for game snapshots
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 
 class Player:
+    __slots__ = ("player_id", "player_discord_name", "faction_name", "assets", "tension", "withdraw_limit",
+                 "daily_withdraw_available", "is_faction_boss", "is_incarcerated", "is_dead")
+
     def __init__(self, player_id: int, player_discord_name: str, faction_name: str, assets: int, tension: int, withdraw_limit: int = 2,
                  daily_withdraw_available: bool = True, is_faction_boss: bool = False, is_incarcerated: bool = False, is_dead: bool = False):
         self.player_id = player_id
@@ -22,7 +39,34 @@ class Player:
     def set_assets(self, assets: int):
         self.assets = assets
 
+    def to_dict(self) -> dict:
+        return {"player_id": self.player_id,
+                "player_discord_name": self.player_discord_name,
+                "faction_name": self.faction_name,
+                "assets": self.assets,
+                "tension": self.tension,
+                "withdraw_limit": self.withdraw_limit,
+                "daily_withdraw_available": self.daily_withdraw_available,
+                "is_faction_boss": self.is_faction_boss,
+                "is_incarcerated": self.is_incarcerated,
+                "is_dead": self.is_dead}
+
+    @classmethod
+    def from_dict(cls, player_entry: dict) -> 'Player':
+        return cls(player_id=player_entry.get("player_id"),
+                   player_discord_name=player_entry.get("player_discord_name"),
+                   faction_name=player_entry.get("faction_name"),
+                   assets=player_entry.get("assets"),
+                   tension=player_entry.get("tension"),
+                   withdraw_limit=player_entry.get("withdraw_limit"),
+                   daily_withdraw_available=player_entry.get("daily_withdraw_available"),
+                   is_faction_boss=player_entry.get("is_faction_boss"),
+                   is_incarcerated=player_entry.get("is_incarcerated"),
+                   is_dead=player_entry.get("is_dead"))
+
 class Faction:
+    __slots__ = ("player_ids", "faction_name", "assets")
+
     def __init__(self, player_ids: [int], faction_name: str, assets: int):
         self.player_ids = player_ids
         self.faction_name = faction_name
@@ -34,181 +78,806 @@ class Faction:
     def set_assets(self, assets: int):
         self.assets = assets
 
+    def to_dict(self) -> dict:
+        return {"player_ids": self.player_ids,
+                "faction_name": self.faction_name,
+                "assets": self.assets}
+
+    @classmethod
+    def from_dict(cls, faction_entry: dict) -> 'Faction':
+        return cls(player_ids=list(faction_entry.get("player_ids")),
+                   faction_name=faction_entry.get("faction_name"),
+                   assets=faction_entry.get("assets"))
+
 class Vote:
+    __slots__ = ("player_id", "choice", "timestamp")
+
     def __init__(self, player_id: int, choice: str, timestamp: int):
         self.player_id = player_id
         self.choice = choice
         self.timestamp = timestamp
 
+    def to_dict(self) -> dict:
+        return {"player_id": self.player_id,
+                "choice": self.choice,
+                "timestamp": self.timestamp}
+
+    @classmethod
+    def from_dict(cls, vote_entry: dict) -> 'Vote':
+        return cls(player_id=vote_entry.get("player_id"),
+                   choice=vote_entry.get("choice"),
+                   timestamp=vote_entry.get("timestamp"))
+
+class VoteEvent:
+    __slots__ = ("timestamp", "player_id", "choice")
+
+    def __init__(self, timestamp: int, player_id: int, choice: Optional[str]):
+        self.timestamp = timestamp
+        self.player_id = player_id
+        # None for an unvote
+        self.choice = choice
+
+    def to_list(self) -> list:
+        return [self.timestamp, self.player_id, self.choice]
+
+    @classmethod
+    def from_list(cls, event_entry: list) -> 'VoteEvent':
+        return cls(event_entry[0], event_entry[1], event_entry[2])
+
+def event_timestamp(event: VoteEvent) -> int:
+    return event.timestamp
+
 class Round:
-    def __init__(self, votes: [Vote], round_number: int, is_active_round: bool):
-        self.votes = votes
+    __slots__ = ("round_number", "is_active_round", "votes_by_player", "voters_by_choice", "_standings",
+                 "history", "history_by_player", "unsaved_from")
+
+    def __init__(self, votes: [Vote], round_number: int, is_active_round: bool, history: Optional[List[VoteEvent]] = None):
         self.round_number = round_number
         self.is_active_round = is_active_round
 
+        # every vote, revote and unvote of the round, ordered by time, and the same events split per voter,
+        # so the history and past standings are found by bisecting rather than replaying
+        self.history: List[VoteEvent] = []
+        self.history_by_player: Dict[int, List[VoteEvent]] = {}
+        for event in history or []:
+            self._insert_event(event)
+        # the index of the first event a store has not saved yet, so it can append rather than rewrite
+        self.unsaved_from: Optional[int] = None
+
+        # a player holds at most one vote per round; the tally maps each choice to its voters
+        # (a dict used as an insertion-ordered set) and is kept in step with every change
+        self.votes_by_player: Dict[int, Vote] = {}
+        self.voters_by_choice: Dict[str, Dict[int, None]] = {}
+        self._standings: Optional[List[Tuple[str, List[int]]]] = None
+        for vote in votes:
+            self.add_vote(vote)
+
+        # votes cast before the history was kept have no events, so they are seeded at the time they were cast
+        for vote in self.votes_by_player.values():
+            if vote.player_id not in self.history_by_player and vote.timestamp is not None:
+                self._mark_unsaved(self._insert_event(VoteEvent(vote.timestamp, vote.player_id, vote.choice)))
+
+    @property
+    def votes(self) -> List[Vote]:
+        return list(self.votes_by_player.values())
+
     def get_player_vote(self, player_id: int) -> Optional[Vote]:
-        player_vote = None
-        for vote in self.votes:
-            if vote.player_id == player_id:
-                player_vote = vote
-        return player_vote
+        return self.votes_by_player.get(player_id)
+
+    def _tally_add(self, choice: str, player_id: int):
+        self.voters_by_choice.setdefault(choice, {})[player_id] = None
+        self._standings = None
+
+    def _tally_remove(self, choice: str, player_id: int):
+        voters = self.voters_by_choice.get(choice)
+        if voters is not None:
+            voters.pop(player_id, None)
+            if not voters:
+                del self.voters_by_choice[choice]
+        self._standings = None
 
     def add_vote(self, vote: Vote):
-        self.votes.append(vote)
+        existing_vote = self.votes_by_player.get(vote.player_id)
+        if existing_vote is not None:
+            self.remove_vote(existing_vote)
+        self.votes_by_player[vote.player_id] = vote
+        self._tally_add(vote.choice, vote.player_id)
+
+    def change_vote(self, vote: Vote, choice: str, timestamp: int):
+        self._tally_remove(vote.choice, vote.player_id)
+        vote.choice = choice
+        vote.timestamp = timestamp
+        self._tally_add(choice, vote.player_id)
 
     def remove_vote(self, vote: Vote):
-        self.votes.remove(vote)
+        if self.votes_by_player.get(vote.player_id) is vote:
+            del self.votes_by_player[vote.player_id]
+            self._tally_remove(vote.choice, vote.player_id)
+
+    def _insert_event(self, event: VoteEvent) -> int:
+        index = bisect.bisect_right(self.history, event.timestamp, key=event_timestamp)
+        self.history.insert(index, event)
+        bisect.insort_right(self.history_by_player.setdefault(event.player_id, []), event, key=event_timestamp)
+        return index
+
+    def _mark_unsaved(self, index: int):
+        if self.unsaved_from is None or index < self.unsaved_from:
+            self.unsaved_from = index
+
+    def record_vote_event(self, player_id: int, choice: Optional[str], timestamp: int) -> bool:
+        # only changes are kept, so repeating a vote or unvoting without a vote leaves no event
+        player_events = self.history_by_player.get(player_id)
+        last_choice = player_events[-1].choice if player_events else None
+        if choice == last_choice:
+            return False
+        self._mark_unsaved(self._insert_event(VoteEvent(timestamp, player_id, choice)))
+        return True
+
+    def get_history(self, until: Optional[int] = None) -> List[VoteEvent]:
+        if until is None:
+            return self.history
+        return self.history[:bisect.bisect_right(self.history, until, key=event_timestamp)]
+
+    def get_standings_at(self, timestamp: int) -> List[Tuple[str, List[int]]]:
+        # standings as they were at the given time, in the same form as get_standings
+        latest_votes = []
+        for player_events in self.history_by_player.values():
+            index = bisect.bisect_right(player_events, timestamp, key=event_timestamp)
+            if index and player_events[index - 1].choice is not None:
+                latest_votes.append(player_events[index - 1])
+        latest_votes.sort(key=event_timestamp)
+        voters_by_choice: Dict[str, List[int]] = {}
+        for event in latest_votes:
+            voters_by_choice.setdefault(event.choice, []).append(event.player_id)
+        return sorted(voters_by_choice.items(), key=lambda e: len(e[1]), reverse=True)
+
+    def get_standings(self) -> List[Tuple[str, List[int]]]:
+        # ranked (choice, voter ids) pairs, most votes first; only re-sorted after a change
+        if self._standings is None:
+            self._standings = sorted(((choice, list(voters)) for choice, voters in self.voters_by_choice.items()),
+                                     key=lambda e: len(e[1]), reverse=True)
+        return self._standings
+
+    def to_dict(self) -> dict:
+        return {"round_number": self.round_number,
+                "is_active_round": self.is_active_round,
+                "votes": [vote.to_dict() for vote in self.votes_by_player.values()],
+                "history": [event.to_list() for event in self.history]}
+
+    @classmethod
+    def from_dict(cls, round_entry: dict) -> 'Round':
+        return cls(votes=[Vote.from_dict(vote_entry) for vote_entry in round_entry.get("votes") or []],
+                   round_number=round_entry.get("round_number"),
+                   is_active_round=round_entry.get("is_active_round"),
+                   history=[VoteEvent.from_list(event_entry) for event_entry in round_entry.get("history") or []])
+
+# settlement types and owner icons are names; embed_builder maps them to the server's emoji
+SETTLEMENT_TYPES = ("bank", "rail", "industry", "trading_post", "hideout")
+
+class Settlement:
+    __slots__ = ("name", "settlement_type", "owner", "owner_icon")
+
+    def __init__(self, name: str, settlement_type: str, owner: str = "Unowned", owner_icon: Optional[str] = None):
+        self.name = name
+        self.settlement_type = settlement_type
+        self.owner = owner
+        self.owner_icon = owner_icon
+
+    def to_dict(self) -> dict:
+        return {"name": self.name,
+                "settlement_type": self.settlement_type,
+                "owner": self.owner,
+                "owner_icon": self.owner_icon}
+
+    @classmethod
+    def from_dict(cls, settlement_entry: dict) -> 'Settlement':
+        return cls(name=settlement_entry.get("name"),
+                   settlement_type=settlement_entry.get("settlement_type"),
+                   owner=settlement_entry.get("owner"),
+                   owner_icon=settlement_entry.get("owner_icon"))
+
+class Region:
+    __slots__ = ("name", "colour", "settlements")
+
+    def __init__(self, name: str, colour: str, settlements: [Settlement]):
+        self.name = name
+        # the name of a discord.Colour factory, e.g. "blue" or "brand_red"
+        self.colour = colour
+        self.settlements = settlements
+
+    def to_dict(self) -> dict:
+        return {"name": self.name,
+                "colour": self.colour,
+                "settlements": [settlement.to_dict() for settlement in self.settlements]}
+
+    @classmethod
+    def from_dict(cls, region_entry: dict) -> 'Region':
+        return cls(name=region_entry.get("name"),
+                   colour=region_entry.get("colour"),
+                   settlements=[Settlement.from_dict(entry) for entry in region_entry.get("settlements") or []])
+
+class JobBoard:
+    __slots__ = ("title", "jobs")
+
+    def __init__(self, title: str, jobs: [str]):
+        self.title = title
+        self.jobs = jobs
+
+    def set_job(self, number: int, description: str):
+        # job numbers start at 1; the number after the last job appends a new one
+        if number == len(self.jobs) + 1:
+            self.jobs.append(description)
+        else:
+            self.jobs[number - 1] = description
+
+    def remove_job(self, number: int):
+        del self.jobs[number - 1]
+
+    def to_dict(self) -> dict:
+        return {"title": self.title,
+                "jobs": self.jobs}
+
+    @classmethod
+    def from_dict(cls, job_board_entry: dict) -> 'JobBoard':
+        return cls(title=job_board_entry.get("title"),
+                   jobs=list(job_board_entry.get("jobs") or []))
+
+PHASES = ("refresh_withdrawals", "start_round", "end_round")
+
+class ScheduledPhase:
+    __slots__ = ("phase", "time_of_day", "every_days", "next_run")
+
+    def __init__(self, phase: str, time_of_day: str, every_days: int, next_run: int):
+        self.phase = phase
+        # "HH:MM" in UTC
+        self.time_of_day = time_of_day
+        self.every_days = every_days
+        # unix timestamp of the next tick; ticks missed while the bot was down are caught up from it
+        self.next_run = next_run
+
+    def to_dict(self) -> dict:
+        return {"phase": self.phase,
+                "time_of_day": self.time_of_day,
+                "every_days": self.every_days,
+                "next_run": self.next_run}
+
+    @classmethod
+    def from_dict(cls, schedule_entry: dict) -> 'ScheduledPhase':
+        return cls(phase=schedule_entry.get("phase"),
+                   time_of_day=schedule_entry.get("time_of_day"),
+                   every_days=schedule_entry.get("every_days", 1),
+                   next_run=schedule_entry.get("next_run"))
+
+class PlayerNameIndex:
+    # living players sorted by lowercased discord name, for autocomplete lookups
+    def __init__(self, players: List[Player], max_cached_queries: int = 512):
+        self.entries: List[Tuple[str, Player]] = sorted(
+            ((player.player_discord_name.lower(), player) for player in players if not player.is_dead),
+            key=lambda e: e[0])
+        self.max_cached_queries = max_cached_queries
+        self._matches: Dict[str, List[Tuple[str, Player]]] = {}
+
+    def _find(self, query: str) -> List[Tuple[str, Player]]:
+        matches = self._matches.get(query)
+        if matches is not None:
+            return matches
+        # every match for "abc" is also a match for "ab", so narrow the shorter query's result when cached
+        candidates = self._matches.get(query[:-1], self.entries)
+        matches = [entry for entry in candidates if query in entry[0]]
+        if len(self._matches) >= self.max_cached_queries:
+            self._matches.clear()
+        self._matches[query] = matches
+        return matches
+
+    def search(self, substr: str, limit: int = 25) -> List[Player]:
+        if not substr:
+            return [player for _, player in self.entries[:limit]]
+        return [player for _, player in self._find(substr.lower())[:limit]]
+
 
 class Game:
-    def __init__(self, is_active: bool, factions: [Faction], players: [Player], rounds: [Round]):
+    def __init__(self, is_active: bool, factions: [Faction], players: [Player], rounds: [Round], journal_seq: int = 0,
+                 posted_embeds: Optional[Dict[str, List[dict]]] = None, regions: Optional[List[Region]] = None,
+                 job_board: Optional[JobBoard] = None, schedule: Optional[List[ScheduledPhase]] = None):
         self.is_active = is_active
         self.factions = factions
         self.players = players
         self.rounds = rounds
+        # sequence number of the last journal entry already reflected in this state
+        self.journal_seq = journal_seq
+        # messages posted by /post-embed, keyed by "<channel id>/<embed set>", each {"message_id": ..., "hash": ...}
+        self.posted_embeds = posted_embeds if posted_embeds is not None else {}
+        self.regions = regions if regions is not None else []
+        self.job_board = job_board
+        self.schedule = schedule if schedule is not None else []
+        # the store version this state was loaded from or last saved as, see SqliteGameStore
+        self.version = 0
+
+        # lookup indexes, kept up to date by the add_* methods below
+        self.factions_by_name: Dict[str, Faction] = {}
+        self.players_by_id: Dict[int, Player] = {}
+        self.rounds_by_number: Dict[int, Round] = {}
+        self.faction_by_player_id: Dict[int, Faction] = {}
+        self.latest_round: Optional[Round] = None
+        self.settlements_by_name: Dict[str, Tuple[Region, Settlement]] = {}
+        self._name_index: Optional[PlayerNameIndex] = None
+        for faction in factions:
+            self._index_faction(faction)
+        for player in players:
+            self.players_by_id[player.player_id] = player
+        for a_round in rounds:
+            self._index_round(a_round)
+        for region in self.regions:
+            self._index_region(region)
+
+    def _index_faction(self, faction: Faction):
+        self.factions_by_name[faction.faction_name] = faction
+        for player_id in faction.player_ids:
+            self.faction_by_player_id[player_id] = faction
+
+    def _index_round(self, a_round: Round):
+        self.rounds_by_number[a_round.round_number] = a_round
+        if self.latest_round is None or a_round.round_number > self.latest_round.round_number:
+            self.latest_round = a_round
+
+    def _index_region(self, region: Region):
+        for settlement in region.settlements:
+            self.settlements_by_name[settlement.name] = (region, settlement)
+
+    def set_regions(self, regions: List[Region]):
+        self.regions = regions
+        self.settlements_by_name = {}
+        for region in regions:
+            self._index_region(region)
+
+    def get_settlement(self, settlement_name: str) -> Tuple[Optional[Region], Optional[Settlement]]:
+        return self.settlements_by_name.get(settlement_name, (None, None))
 
     def get_faction(self, faction_name: str) -> Optional[Faction]:
-        for faction in self.factions:
-            if faction.faction_name == faction_name:
-                return faction
-        return None
+        return self.factions_by_name.get(faction_name)
 
     def add_faction(self, faction: Faction):
         self.factions.append(faction)
+        self._index_faction(faction)
 
     def get_player(self, player_id: int) -> Optional[Player]:
-        for player in self.players:
-            if player.player_id == player_id:
-                return player
-        return None
+        return self.players_by_id.get(player_id)
 
     def add_player(self, player: Player):
         self.players.append(player)
+        self.players_by_id[player.player_id] = player
+        self._name_index = None
+        faction = self.get_faction(player.faction_name)
+        if faction is not None and player.player_id not in self.faction_by_player_id:
+            faction.add_player(player.player_id)
+            self.faction_by_player_id[player.player_id] = faction
 
-    def get_faction_of_player(self, player_id: int) -> Optional[Faction]:
-        for faction in self.factions:
-            if player_id in faction.player_ids:
-                return faction
-        return None
+    def set_player_dead(self, player: Player, is_dead: bool):
+        player.is_dead = is_dead
+        self._name_index = None
 
-    def get_living_player_ids(self) -> List[str]:
-        game_player_ids = []
-        for player in self.players:
-            game_player_ids.append(str(player.player_id))
-        return game_player_ids
+    def get_name_index(self) -> PlayerNameIndex:
+        # only rebuilt after the roster or someone's is_dead flag changes
+        if self._name_index is None:
+            self._name_index = PlayerNameIndex(self.players)
+        return self._name_index
+
+    def get_faction_of_player(self, player_id: int) -> Optional[Faction]:
+        return self.faction_by_player_id.get(player_id)
 
     def add_round(self, a_round: Round):
         self.rounds.append(a_round)
+        self._index_round(a_round)
 
     def get_round(self, round_num: int) -> Optional[Round]:
-        for a_round in self.rounds:
-            if a_round.round_number == round_num:
-                return a_round
-        return None
+        return self.rounds_by_number.get(round_num)
 
     def get_latest_round(self) -> Optional[Round]:
-        latest_round = None
-        previous_round_num = 0
-        for a_round in self.rounds:
-            if a_round.round_number > previous_round_num:
-                previous_round_num = a_round.round_number
-                latest_round = a_round
+        return self.latest_round
+
+    def refresh_withdrawals(self):
+        for player in self.players:
+            if not player.is_incarcerated and not player.is_dead:
+                player.daily_withdraw_available = True
+
+    def start_round(self) -> Optional[Round]:
+        # None while the latest round is still active
+        latest_round = self.get_latest_round()
+        if latest_round is not None and latest_round.is_active_round:
+            return None
+        new_round = Round(votes=[], round_number=1 if latest_round is None else latest_round.round_number + 1,
+                          is_active_round=True)
+        self.add_round(new_round)
+        return new_round
+
+    def end_round(self) -> Optional[Round]:
+        # None when there is no active round to end
+        latest_round = self.get_latest_round()
+        if latest_round is None or not latest_round.is_active_round:
+            return None
+        latest_round.is_active_round = False
         return latest_round
 
+    def get_posted_embeds(self, channel_id: int, embed_set: str) -> List[dict]:
+        return self.posted_embeds.get(f"{channel_id}/{embed_set}", [])
+
+    def set_posted_embeds(self, channel_id: int, embed_set: str, messages: List[dict]):
+        if messages:
+            self.posted_embeds[f"{channel_id}/{embed_set}"] = messages
+        else:
+            self.posted_embeds.pop(f"{channel_id}/{embed_set}", None)
+
+    def forget_posted_embeds(self, channel_id: int) -> bool:
+        keys = [key for key in self.posted_embeds if key.startswith(f"{channel_id}/")]
+        for key in keys:
+            del self.posted_embeds[key]
+        return bool(keys)
+
+    def to_dict(self) -> dict:
+        return {"is_active": self.is_active,
+                "journal_seq": self.journal_seq,
+                "posted_embeds": self.posted_embeds,
+                "regions": [region.to_dict() for region in self.regions],
+                "job_board": None if self.job_board is None else self.job_board.to_dict(),
+                "schedule": [entry.to_dict() for entry in self.schedule],
+                "factions": [faction.to_dict() for faction in self.factions],
+                "players": [player.to_dict() for player in self.players],
+                "rounds": [a_round.to_dict() for a_round in self.rounds]}
+
+    @classmethod
+    def from_dict(cls, json_object: dict) -> 'Game':
+        return cls(is_active=json_object.get("is_active"),
+                   factions=[Faction.from_dict(entry) for entry in json_object.get("factions") or []],
+                   players=[Player.from_dict(entry) for entry in json_object.get("players") or []],
+                   rounds=[Round.from_dict(entry) for entry in json_object.get("rounds") or []],
+                   journal_seq=json_object.get("journal_seq", 0),
+                   posted_embeds=json_object.get("posted_embeds"),
+                   regions=[Region.from_dict(entry) for entry in json_object.get("regions") or []],
+                   job_board=None if json_object.get("job_board") is None
+                   else JobBoard.from_dict(json_object.get("job_board")),
+                   schedule=[ScheduledPhase.from_dict(entry) for entry in json_object.get("schedule") or []])
+
+# "json" is compact production JSON, "pretty" is indented JSON for hand editing, "msgpack" is binary
+GAME_FORMATS = ("json", "pretty", "msgpack")
+
+def dump_game(game: Game, game_format: str = "json") -> bytes:
+    game_dict = game.to_dict()
+    if game_format == "json":
+        if orjson is not None:
+            return orjson.dumps(game_dict)
+        return json.dumps(game_dict, separators=(",", ":"), ensure_ascii=False).encode("utf8")
+    elif game_format == "pretty":
+        return json.dumps(game_dict, indent=2, ensure_ascii=False).encode("utf8")
+    elif game_format == "msgpack":
+        if msgpack is None:
+            raise RuntimeError("The msgpack game format requires the msgpack package to be installed")
+        return msgpack.packb(game_dict, use_bin_type=True)
+    raise ValueError(f'Unknown game format {game_format}')
+
+def load_game(data: bytes) -> Game:
+    # a JSON snapshot always opens with '{', which is never the first byte of a msgpack map
+    if data.lstrip()[:1] == b"{":
+        game_dict = orjson.loads(data) if orjson is not None else json.loads(data)
+    else:
+        if msgpack is None:
+            raise RuntimeError("This game file is in msgpack format, which requires the msgpack package")
+        game_dict = msgpack.unpackb(data, raw=False, strict_map_key=False)
+    return Game.from_dict(game_dict)
+
 def read_json_to_dom(filepath: str) -> Game:
-    with open(filepath, 'r', encoding="utf8") as openfile:
-        json_object = json.load(openfile)
-
-        is_active = json_object.get("is_active")
-        factions = []
-        players = []
-        rounds = []
-        if json_object.get("factions") is not None:
-            for faction_entry in json_object.get("factions"):
-                player_ids = []
-                for player_id in faction_entry.get("player_ids"):
-                    player_ids.append(player_id)
-                faction_name = faction_entry.get("faction_name")
-                assets = faction_entry.get("assets")
-                factions.append(Faction(player_ids=player_ids,
-                                        faction_name=faction_name,
-                                        assets=assets))
-        if json_object.get("players") is not None:
-            for player_entry in json_object.get("players"):
-                player_id = player_entry.get("player_id")
-                player_discord_name = player_entry.get("player_discord_name")
-                faction_name = player_entry.get("faction_name")
-                withdraw_limit = player_entry.get("withdraw_limit")
-                daily_withdraw_available = player_entry.get("daily_withdraw_available")
-                is_incarcerated = player_entry.get("is_incarcerated")
-                is_faction_boss = player_entry.get("is_faction_boss")
-                is_dead = player_entry.get("is_dead")
-                assets = player_entry.get("assets")
-                tension = player_entry.get("tension")
-                players.append(Player(player_id=player_id,
-                                      player_discord_name=player_discord_name,
-                                      faction_name=faction_name,
-                                      assets=assets,
-                                      tension=tension,
-                                      withdraw_limit=withdraw_limit,
-                                      daily_withdraw_available=daily_withdraw_available,
-                                      is_faction_boss=is_faction_boss,
-                                      is_incarcerated=is_incarcerated,
-                                      is_dead=is_dead))
-
-        if json_object.get("rounds") is not None:
-            for round_entry in json_object.get("rounds"):
-                round_num = round_entry.get("round_number")
-                round_is_active = round_entry.get("is_active_round")
-                votes = []
-                if round_entry.get("votes") is not None:
-                    for vote_entry in round_entry.get("votes"):
-                        player_id = vote_entry.get("player_id")
-                        choice = vote_entry.get("choice")
-                        timestamp = vote_entry.get("timestamp")
-                        votes.append(Vote(player_id=player_id,
-                                          choice=choice,
-                                          timestamp=timestamp))
-                rounds.append(Round(round_number=round_num,
-                                    is_active_round=round_is_active,
-                                    votes=votes))
-
-        return Game(is_active, factions, players, rounds)
-
-def write_dom_to_json(game: Game, filepath: str):
-    with open(filepath, 'w', encoding="utf8") as outfile:
-
-        #convert Game to dictionary here
-        game_dict = {"is_active": game.is_active}
-        faction_dicts = []
-        for faction in game.factions:
-            faction_dicts.append({"player_ids": faction.player_ids,
-                                  "faction_name": faction.faction_name,
-                                  "assets": faction.assets
-                                  })
-        game_dict["factions"] = faction_dicts
-        player_dicts = []
-        for player in game.players:
-            player_dicts.append({"player_id": player.player_id,
-                                 "player_discord_name": player.player_discord_name,
-                                 "faction_name": player.faction_name,
-                                 "assets": player.assets,
-                                 "tension": player.tension,
-                                 "withdraw_limit": player.withdraw_limit,
-                                 "daily_withdraw_available": player.daily_withdraw_available,
-                                 "is_faction_boss": player.is_faction_boss,
-                                 "is_incarcerated": player.is_incarcerated,
-                                 "is_dead": player.is_dead
-                                 })
-        game_dict["players"] = player_dicts
-        round_dicts = []
-        for a_round in game.rounds:
-            vote_dicts = []
-            for vote in a_round.votes:
-                vote_dicts.append({"player_id": vote.player_id,
-                                   "choice": vote.choice,
-                                   "timestamp": vote.timestamp})
-            round_dicts.append({"round_number": a_round.round_number,
-                                "is_active_round": a_round.is_active_round,
-                                "votes": vote_dicts})
-        game_dict["rounds"] = round_dicts
-        json.dump(game_dict, outfile, indent=2, ensure_ascii=False)
+    # despite the name, any of the GAME_FORMATS is accepted and detected from the file contents
+    with open(filepath, 'rb') as openfile:
+        return load_game(openfile.read())
+
+def write_dom_to_json(game: Game, filepath: str, game_format: str = "pretty") -> int:
+    # write to a temp file in the same directory, fsync it, then atomically swap it in,
+    # so a crash or a concurrent reader never sees a partially written game file
+    directory = os.path.dirname(os.path.abspath(filepath))
+    fd, temp_path = tempfile.mkstemp(prefix=".game-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            written = outfile.write(dump_game(game, game_format))
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(temp_path, filepath)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    _fsync_directory(directory)
+    return written
+
+def _fsync_directory(directory: str):
+    # persist the rename itself; not supported on every platform
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+# Storage backends. A change key names one piece of state that a save has to persist:
+#   ("game",)  ("player", player_id)  ("faction", faction_name)  ("round", round_number)
+#   ("vote", round_number, player_id)  ("vote_history", round_number)
+# Passing changes=None asks the store to persist the whole game.
+class StaleGameError(Exception):
+    pass
+
+
+class GameStore:
+    def load(self) -> Game:
+        raise NotImplementedError
+
+    def save(self, game: Game, changes: Optional[Set[tuple]] = None, expected_version: Optional[int] = None) -> Optional[int]:
+        # returns the number of bytes written, when the store can tell
+        raise NotImplementedError
+
+    def get_version(self) -> Optional[int]:
+        # None for stores that cannot be shared between processes
+        return None
+
+    def close(self):
+        pass
+
+
+class FileGameStore(GameStore):
+    def __init__(self, filepath: str, game_format: str = "json", other_paths: Tuple[str, ...] = ()):
+        self.filepath = filepath
+        self.game_format = game_format
+        # where the snapshot is kept in the other file formats, so GAME_STORE can be switched between them
+        self.other_paths = other_paths
+
+    def load(self) -> Game:
+        if os.path.exists(self.filepath):
+            return read_json_to_dom(self.filepath)
+        for other_path in self.other_paths:
+            if os.path.exists(other_path):
+                # the format is detected from the contents; the game is rewritten in the configured one right away
+                game = read_json_to_dom(other_path)
+                self.save(game)
+                return game
+        # a newly hosted guild starts with an empty, inactive game that moderators set up
+        game = Game(False, [], [], [])
+        self.save(game)
+        return game
+
+    def save(self, game: Game, changes: Optional[Set[tuple]] = None, expected_version: Optional[int] = None) -> int:
+        # the file is a single document, so every save rewrites all of it
+        written = write_dom_to_json(game, self.filepath, self.game_format)
+        # a snapshot left in another format would be stale, and loaded instead if the format were switched back
+        for other_path in self.other_paths:
+            if os.path.exists(other_path):
+                os.remove(other_path)
+        return written
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS factions (faction_name TEXT PRIMARY KEY, assets INTEGER NOT NULL, player_ids TEXT NOT NULL,
+                                     position INTEGER);
+CREATE TABLE IF NOT EXISTS players (player_id INTEGER PRIMARY KEY, player_discord_name TEXT, faction_name TEXT,
+                                    assets INTEGER, tension INTEGER, withdraw_limit INTEGER,
+                                    daily_withdraw_available INTEGER, is_faction_boss INTEGER,
+                                    is_incarcerated INTEGER, is_dead INTEGER, position INTEGER);
+CREATE TABLE IF NOT EXISTS rounds (round_number INTEGER PRIMARY KEY, is_active_round INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS votes (round_number INTEGER NOT NULL, player_id INTEGER NOT NULL, choice TEXT NOT NULL,
+                                  timestamp INTEGER, position INTEGER, PRIMARY KEY (round_number, player_id));
+CREATE TABLE IF NOT EXISTS vote_events (round_number INTEGER NOT NULL, event_index INTEGER NOT NULL,
+                                        timestamp INTEGER NOT NULL, player_id INTEGER NOT NULL, choice TEXT,
+                                        PRIMARY KEY (round_number, event_index));
+"""
+
+# tables whose rows keep the order of the game's own lists. A row's position is set when it is inserted and kept
+# when it is updated, so it sorts after every row inserted before it, as an appended list item does
+ORDERED_TABLES = ("factions", "players", "votes")
+
+
+class SqliteGameStore(GameStore):
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.connection = sqlite3.connect(filepath)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SQLITE_SCHEMA)
+        self._add_positions()
+
+    def _add_positions(self):
+        # databases created before the position column keep their rowid order; for players that is by id,
+        # as player_id is the rowid
+        with self.connection:
+            for table in ORDERED_TABLES:
+                columns = [row[1] for row in self.connection.execute(f"PRAGMA table_info({table})")]
+                if "position" not in columns:
+                    self.connection.execute(f"ALTER TABLE {table} ADD COLUMN position INTEGER")
+                    self.connection.execute(f"UPDATE {table} SET position = rowid")
+                # every insert reads the largest position, which the index answers without a scan
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_position ON {table} (position)")
+
+    def get_version(self) -> int:
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return 0 if row is None else int(row[0])
+
+    def load(self) -> Game:
+        # a single read transaction, so another process's save cannot land halfway through
+        self.connection.execute("BEGIN")
+        try:
+            game = self._load()
+        finally:
+            self.connection.commit()
+        return game
+
+    def _load(self) -> Game:
+        cursor = self.connection.cursor()
+        meta = dict(cursor.execute("SELECT key, value FROM meta"))
+        factions = [Faction(player_ids=json.loads(player_ids), faction_name=faction_name, assets=assets)
+                    for faction_name, assets, player_ids
+                    in cursor.execute("SELECT faction_name, assets, player_ids FROM factions ORDER BY position")]
+        players = [Player(player_id=row[0],
+                          player_discord_name=row[1],
+                          faction_name=row[2],
+                          assets=row[3],
+                          tension=row[4],
+                          withdraw_limit=row[5],
+                          daily_withdraw_available=bool(row[6]),
+                          is_faction_boss=bool(row[7]),
+                          is_incarcerated=bool(row[8]),
+                          is_dead=bool(row[9]))
+                   for row in cursor.execute("SELECT player_id, player_discord_name, faction_name, assets, tension, "
+                                             "withdraw_limit, daily_withdraw_available, is_faction_boss, "
+                                             "is_incarcerated, is_dead FROM players ORDER BY position")]
+        votes_by_round: Dict[int, List[Vote]] = {}
+        for round_number, player_id, choice, timestamp in cursor.execute(
+                "SELECT round_number, player_id, choice, timestamp FROM votes ORDER BY position"):
+            votes_by_round.setdefault(round_number, []).append(Vote(player_id, choice, timestamp))
+        history_by_round: Dict[int, List[VoteEvent]] = {}
+        for round_number, timestamp, player_id, choice in cursor.execute(
+                "SELECT round_number, timestamp, player_id, choice FROM vote_events ORDER BY round_number, event_index"):
+            history_by_round.setdefault(round_number, []).append(VoteEvent(timestamp, player_id, choice))
+        rounds = [Round(votes=votes_by_round.get(round_number, []),
+                        round_number=round_number,
+                        is_active_round=bool(is_active_round),
+                        history=history_by_round.get(round_number))
+                  for round_number, is_active_round
+                  in cursor.execute("SELECT round_number, is_active_round FROM rounds ORDER BY round_number")]
+        job_board = json.loads(meta.get("job_board", "null"))
+        game = Game(json.loads(meta.get("is_active", "false")), factions, players, rounds,
+                    json.loads(meta.get("journal_seq", "0")),
+                    json.loads(meta.get("posted_embeds", "{}")),
+                    [Region.from_dict(entry) for entry in json.loads(meta.get("regions", "[]"))],
+                    None if job_board is None else JobBoard.from_dict(job_board),
+                    [ScheduledPhase.from_dict(entry) for entry in json.loads(meta.get("schedule", "[]"))])
+        game.version = int(meta.get("version", "0"))
+        return game
+
+    def save(self, game: Game, changes: Optional[Set[tuple]] = None, expected_version: Optional[int] = None):
+        # one transaction per save; with a change set only the affected rows are touched.
+        # Every save bumps the version, and with expected_version the save only goes ahead
+        # if no other process has saved since (compare-and-swap)
+        with self.connection:
+            # take the write lock before reading the version, so the check and the write are atomic
+            self.connection.execute("BEGIN IMMEDIATE")
+            current_version = self.get_version()
+            if expected_version is not None and current_version != expected_version:
+                raise StaleGameError(f'The game was saved at version {current_version}, expected {expected_version}')
+            if changes is None:
+                for table in ("meta", "factions", "players", "rounds", "votes", "vote_events"):
+                    self.connection.execute(f"DELETE FROM {table}")
+                # a list rather than a set, so rows are inserted in the game's own order
+                changes = [("game",)]
+                changes.extend(("faction", faction.faction_name) for faction in game.factions)
+                changes.extend(("player", player.player_id) for player in game.players)
+                for a_round in game.rounds:
+                    changes.append(("round", a_round.round_number))
+                    changes.extend(("vote", a_round.round_number, vote.player_id) for vote in a_round.votes)
+                    changes.append(("vote_history", a_round.round_number))
+                    # the table was emptied, so all of the history goes back in
+                    a_round.unsaved_from = 0
+            for change in changes:
+                self._save_change(game, change)
+            self.connection.execute("INSERT INTO meta (key, value) VALUES ('version', ?) "
+                                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value", (str(current_version + 1),))
+        # only once committed, so a failed save writes the same events again next time
+        for change in changes:
+            if change[0] == "vote_history" and game.get_round(change[1]) is not None:
+                game.get_round(change[1]).unsaved_from = None
+        game.version = current_version + 1
+
+    def _save_change(self, game: Game, change: tuple):
+        kind = change[0]
+        if kind == "game":
+            self.connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?) "
+                                        "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                                        [("is_active", json.dumps(game.is_active)),
+                                         ("journal_seq", json.dumps(game.journal_seq)),
+                                         ("posted_embeds", json.dumps(game.posted_embeds)),
+                                         ("regions", json.dumps([region.to_dict() for region in game.regions])),
+                                         ("job_board", json.dumps(None if game.job_board is None
+                                                                  else game.job_board.to_dict())),
+                                         ("schedule", json.dumps([entry.to_dict() for entry in game.schedule]))])
+        elif kind == "faction":
+            faction = game.get_faction(change[1])
+            if faction is None:
+                self.connection.execute("DELETE FROM factions WHERE faction_name = ?", (change[1],))
+            else:
+                self.connection.execute("INSERT INTO factions (faction_name, assets, player_ids, position) "
+                                        "VALUES (?, ?, ?, (SELECT COALESCE(MAX(position), -1) + 1 FROM factions)) "
+                                        "ON CONFLICT(faction_name) DO UPDATE SET assets = excluded.assets, "
+                                        "player_ids = excluded.player_ids",
+                                        (faction.faction_name, faction.assets, json.dumps(faction.player_ids)))
+        elif kind == "player":
+            player = game.get_player(change[1])
+            if player is None:
+                self.connection.execute("DELETE FROM players WHERE player_id = ?", (change[1],))
+            else:
+                self.connection.execute("INSERT INTO players (player_id, player_discord_name, faction_name, assets, "
+                                        "tension, withdraw_limit, daily_withdraw_available, is_faction_boss, "
+                                        "is_incarcerated, is_dead, position) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                                        "(SELECT COALESCE(MAX(position), -1) + 1 FROM players)) "
+                                        "ON CONFLICT(player_id) DO UPDATE SET "
+                                        "player_discord_name = excluded.player_discord_name, "
+                                        "faction_name = excluded.faction_name, assets = excluded.assets, "
+                                        "tension = excluded.tension, withdraw_limit = excluded.withdraw_limit, "
+                                        "daily_withdraw_available = excluded.daily_withdraw_available, "
+                                        "is_faction_boss = excluded.is_faction_boss, "
+                                        "is_incarcerated = excluded.is_incarcerated, is_dead = excluded.is_dead",
+                                        (player.player_id, player.player_discord_name, player.faction_name,
+                                         player.assets, player.tension, player.withdraw_limit,
+                                         player.daily_withdraw_available, player.is_faction_boss,
+                                         player.is_incarcerated, player.is_dead))
+        elif kind == "round":
+            a_round = game.get_round(change[1])
+            if a_round is None:
+                self.connection.execute("DELETE FROM rounds WHERE round_number = ?", (change[1],))
+                self.connection.execute("DELETE FROM votes WHERE round_number = ?", (change[1],))
+                self.connection.execute("DELETE FROM vote_events WHERE round_number = ?", (change[1],))
+            else:
+                self.connection.execute("INSERT INTO rounds (round_number, is_active_round) VALUES (?, ?) "
+                                        "ON CONFLICT(round_number) DO UPDATE SET "
+                                        "is_active_round = excluded.is_active_round",
+                                        (a_round.round_number, a_round.is_active_round))
+        elif kind == "vote":
+            a_round = game.get_round(change[1])
+            vote = None if a_round is None else a_round.get_player_vote(change[2])
+            if vote is None:
+                self.connection.execute("DELETE FROM votes WHERE round_number = ? AND player_id = ?",
+                                        (change[1], change[2]))
+            else:
+                self.connection.execute("INSERT INTO votes (round_number, player_id, choice, timestamp, position) "
+                                        "VALUES (?, ?, ?, ?, (SELECT COALESCE(MAX(position), -1) + 1 FROM votes)) "
+                                        "ON CONFLICT(round_number, player_id) DO UPDATE SET "
+                                        "choice = excluded.choice, timestamp = excluded.timestamp",
+                                        (change[1], change[2], vote.choice, vote.timestamp))
+        elif kind == "vote_history":
+            # new events are usually appended; one with an earlier timestamp lands before events already
+            # stored, so everything from its index on is written again
+            a_round = game.get_round(change[1])
+            if a_round is None:
+                self.connection.execute("DELETE FROM vote_events WHERE round_number = ?", (change[1],))
+            elif a_round.unsaved_from is not None:
+                self.connection.execute("DELETE FROM vote_events WHERE round_number = ? AND event_index >= ?",
+                                        (change[1], a_round.unsaved_from))
+                self.connection.executemany("INSERT INTO vote_events (round_number, event_index, timestamp, player_id, choice) "
+                                            "VALUES (?, ?, ?, ?, ?)",
+                                            [(change[1], index, event.timestamp, event.player_id, event.choice)
+                                             for index, event in enumerate(a_round.history[a_round.unsaved_from:],
+                                                                           start=a_round.unsaved_from)])
+        else:
+            raise ValueError(f'Unknown change key {change}')
+
+    def close(self):
+        self.connection.close()
+
+
+def open_game_store(path: str, kind: str = "json") -> GameStore:
+    if kind in ("json", "pretty"):
+        return FileGameStore(os.path.join(path, "game.json"), kind, (os.path.join(path, "game.msgpack"),))
+    elif kind == "msgpack":
+        return FileGameStore(os.path.join(path, "game.msgpack"), kind, (os.path.join(path, "game.json"),))
+    elif kind == "sqlite":
+        return SqliteGameStore(os.path.join(path, "game.db"))
+    raise ValueError(f'Unknown game store {kind}')
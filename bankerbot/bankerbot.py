@@ -1,24 +1,29 @@
 # bankerbot.py
-import os
+import asyncio
+import io
+import multiprocessing
 import discord
-from dotenv import load_dotenv
 from discord import app_commands, Member, Guild
-from typing import List, Optional, Literal
+from discord.webhook.async_ import async_context
+from typing import Dict, List, Optional, Literal, Tuple, get_args
 import banker_dom
-from banker_dom import Game, Player, Faction, Round, Vote
+from banker_dom import Game, Player, Faction, Round, Vote, JobBoard, StaleGameError
+import bulk_ops
 import embed_builder
+import logging_manager
+import metrics
+import profiling
 from logging_manager import logger
+from bot_config import BotConfig, load_config
+from game_state import GameStateService
+from ledger import player_account, faction_account
+import guild_registry
+from guild_registry import GameRegistry, GuildConfig, UnknownGuildError, load_guild_configs
+from outbound import OutboundDispatcher, pack_contents
+from phase_scheduler import PhaseScheduler, parse_time_of_day, next_occurrence
+import re
 import time
 
-load_dotenv()
-TOKEN = os.getenv('DISCORD_TOKEN')
-GUILD_ID = int(os.getenv('GUILD_ID'))
-PLAYER_ROLE_ID = int(os.getenv('PLAYER_ROLE_ID'))
-VOTE_CHANNEL = int(os.getenv('VOTE_CHANNEL'))
-MODERATOR_ACTION_CHANNEL = int(os.getenv('MODERATOR_ACTION_CHANNEL'))
-MODERATOR_ROLE_ID = int(os.getenv('MODERATOR_ROLE_ID'))
-BASE_PATH = os.getenv('BASE_PATH')
-
 game_factions = Literal["Van der Linde Gang",
                         "O'Driscoll Boys",
                         "Lemoyne Raiders",
@@ -30,77 +35,264 @@ game_factions = Literal["Van der Linde Gang",
                         "Robber Baron - Gray",
                         "Robber Baron - Fussar"]
 
-embed_choices = embed_builder.build_embeds()
+FACTION_NAMES = get_args(game_factions)
+
+INACTIVE_MESSAGE = 'The bot has been put in an inactive state by the moderator. Please try again later.'
+
+# held while an embed set is synced to a channel, so two refreshes cannot both post a full set of messages
+embed_refresh_locks: Dict[Tuple[int, str], asyncio.Lock] = {}
 
-class BankerBotClient(discord.Client):
-    def __init__(self):
-        super().__init__(intents=discord.Intents.default())
+# (message content, ephemeral) pairs produced while the game is locked and sent once it is released
+Reply = Tuple[str, bool]
+
+class BankerBotClient(discord.AutoShardedClient):
+    def __init__(self, config: BotConfig, shard_ids: Optional[List[int]] = None):
+        # without a shard count discord.py picks one and runs every shard in this process
+        super().__init__(intents=discord.Intents.default(), shard_count=config.shard_count, shard_ids=shard_ids)
+        self.config = config
         self.synced = False
+        self.tree = app_commands.CommandTree(self)
+        self.games = GameRegistry(config, load_guild_configs(config))
+        self.outbound = OutboundDispatcher(batch_window=config.announce_batch_window,
+                                           rate=config.channel_rate,
+                                           per=config.channel_rate_per)
+        self.scheduler = PhaseScheduler(self.games, self.announce_phase, config.phase_tick_interval)
+        self.metrics_server = None
+        self.profiler = profiling.create_profiler(config)
+        # interaction responses and followups go through discord.py's shared webhook adapter rather than self.http
+        metrics.instrument_requests(self.http)
+        metrics.instrument_requests(async_context.get())
+
+    async def setup_hook(self):
+        # games are loaded on their guild's first interaction
+        self.games.start()
+        metrics.registry.gauge("bankerbot_outbound_queue_depth", "Messages waiting in the outbound channel queues",
+                               lambda: {(): sum(self.outbound.queue_depths().values())})
+        metrics.registry.gauge("bankerbot_log_queue_depth", "Log records waiting to be written",
+                               lambda: {(): logging_manager.get_queue_depth()})
+        metrics.registry.gauge("bankerbot_log_records_dropped", "Log records dropped because the log queue was full",
+                               lambda: {(): logging_manager.get_dropped_count()})
+        metrics.registry.gauge("bankerbot_pending_changes", "Game changes not yet saved, by guild",
+                               lambda: {(("guild", str(guild_id)),): state.dirty_count
+                                        for guild_id, state in self.games.states.items()})
+        metrics.registry.gauge("bankerbot_view_cache_lookups", "Cached view lookups since the games were loaded, by result",
+                               lambda: {(("result", "hit"),): sum(state.views.hits for state in self.games.states.values()),
+                                        (("result", "miss"),): sum(state.views.misses for state in self.games.states.values())})
+        if self.config.metrics_port is not None:
+            self.metrics_server = await metrics.start_server(self.config.metrics_host, self.config.metrics_port)
+
+    async def close(self):
+        await self.scheduler.close()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+        await self.outbound.close()
+        await self.games.close()
+        await super().close()
 
     async def on_ready(self):
         await self.wait_until_ready()
-        if not self.synced:
-            await tree.sync(guild=discord.Object(id=GUILD_ID))
+        # with several workers only the one running shard 0 registers the commands
+        if not self.synced and (self.shard_ids is None or 0 in self.shard_ids):
+            for guild_id in self.games.guild_configs:
+                await self.tree.sync(guild=discord.Object(id=guild_id))
             self.synced = True
+        # started once connected, so phases caught up at startup can be announced
+        self.scheduler.start()
         print(f"We have logged in as {self.user}.")
 
+    def announce_phase(self, guild_id: int, message: str):
+        # a partial channel needs no cache, so this works whichever worker runs the guild's shard
+        channel_id = self.games.get_guild_config(guild_id).moderator_action_channel
+        if channel_id is not None:
+            self.outbound.enqueue(self.get_partial_messageable(channel_id), f'Scheduled: {message}', batch=True)
 
-client = BankerBotClient()
-tree = app_commands.CommandTree(client)
 
 async def player_list_autocomplete(interaction: discord.Interaction,
                                    current: str,
                              ) -> List[app_commands.Choice[str]]:
-    game = await get_game(BASE_PATH)
-    players = await get_valid_players(current, game.players)
+    game = get_state(interaction).get()
+    players = game.get_name_index().search(current)
     return [
         app_commands.Choice(name=player.player_discord_name, value=str(player.player_id))
         for player in players
     ]
 
-async def get_valid_players(substr: str, players: List[Player]) -> List[Player]:
-    player_list = []
-    for player in sorted(players, key=lambda e: e.player_discord_name.lower()):
-        if substr and substr.lower() not in player.player_discord_name.lower():
-            continue
-        if not player.is_dead:
-            player_list.append(player)
-    return player_list[:25]
-
-@tree.command(name="toggle-activity",
-              description="Enables/Disables bot commands for players",
-              guild=discord.Object(id=GUILD_ID))
+@app_commands.command(name="toggle-activity",
+              description="Enables/Disables bot commands for players")
 @app_commands.default_permissions(manage_guild=True)
 async def toggle_activity(interaction: discord.Interaction,
                           active: Literal['True', 'False']):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
-
-    game.is_active = True if active == 'True' else False
-
-    await write_game(game, BASE_PATH)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        game.is_active = True if active == 'True' else False
+        write_game(state)
     await interaction.response.send_message(f'Game state has been set to {active}!', ephemeral=True)
 
 
-@tree.command(name="post-embed",
-              description="Posts a pre-computed embed to a channel",
-              guild=discord.Object(id=GUILD_ID))
+@app_commands.command(name="post-embed",
+              description="Posts a pre-computed embed to a channel")
 @app_commands.default_permissions(manage_guild=True)
-@app_commands.choices(embed=embed_choices)
+@app_commands.choices(embed=embed_builder.EMBED_CHOICES)
 async def post_embed(interaction: discord.Interaction,
                      embed: str,
                      channel: discord.TextChannel):
     log_interaction_call(interaction)
-    embed_list = embed_builder.get_embed_dict().get(embed)
-
     await interaction.response.send_message(f"Post embed to channel {channel.name}", ephemeral=True)
 
-    for embed_to_post in embed_list:
-        await channel.send(embed=embed_to_post)
-
-@tree.command(name="clear-messages",
-              description="Clears up to 100 messages out of a discord channel",
-              guild=discord.Object(id=GUILD_ID))
+    sent, edited, unchanged = await refresh_embed_set(get_state(interaction), channel, embed)
+    await interaction.followup.send(f"Sent {sent}, edited {edited} and left {unchanged} "
+                                    f"message(s) unchanged in channel {channel.name}", ephemeral=True)
+
+async def refresh_embed_set(state: GameStateService, channel: discord.TextChannel, embed_set: str) -> Tuple[int, int, int]:
+    # the game is not locked while Discord is waited on, so a second refresh reads the posted messages
+    # only once the first has recorded the ones it sent
+    async with embed_refresh_locks.setdefault((channel.id, embed_set), asyncio.Lock()):
+        async with state.transaction() as game:
+            packed_embeds = embed_builder.pack_embeds(embed_builder.get_embeds(game, embed_set))
+            posted = game.get_posted_embeds(channel.id, embed_set)
+
+        # messages posted earlier for this embed set are edited in place, and only when their content changed
+        messages, sent, edited = await sync_embed_messages(channel, packed_embeds, posted)
+
+        async with state.transaction() as game:
+            game.set_posted_embeds(channel.id, embed_set, messages)
+            state.mark_dirty(("game",))
+    return sent, edited, len(messages) - sent - edited
+
+async def refresh_posted_embeds(interaction: discord.Interaction, embed_set: str):
+    # brings every channel the embed set was posted to up to date after a board change
+    state = get_state(interaction)
+    channel_ids = [int(key.split("/")[0]) for key in state.get().posted_embeds if key.endswith(f"/{embed_set}")]
+    for channel_id in channel_ids:
+        channel = interaction.guild.get_channel(channel_id)
+        if channel is not None:
+            await refresh_embed_set(state, channel, embed_set)
+
+async def sync_embed_messages(channel: discord.TextChannel, packed_embeds: List[List[discord.Embed]],
+                              posted: List[dict]) -> Tuple[List[dict], int, int]:
+    messages = []
+    sent = 0
+    edited = 0
+    for index, embeds in enumerate(packed_embeds):
+        embeds_hash = embed_builder.hash_embeds(embeds)
+        previous = posted[index] if index < len(posted) else None
+        if previous is not None:
+            if previous["hash"] == embeds_hash:
+                messages.append(previous)
+                continue
+            try:
+                await channel.get_partial_message(previous["message_id"]).edit(embeds=embeds)
+                messages.append({"message_id": previous["message_id"], "hash": embeds_hash})
+                edited += 1
+                continue
+            except discord.NotFound:
+                logger.info(f'Posted embed message {previous["message_id"]} no longer exists, sending a new one')
+        message = await channel.send(embeds=embeds)
+        messages.append({"message_id": message.id, "hash": embeds_hash})
+        sent += 1
+
+    # the embed set now fits in fewer messages than before
+    for previous in posted[len(packed_embeds):]:
+        try:
+            await channel.get_partial_message(previous["message_id"]).delete()
+        except discord.NotFound:
+            pass
+    return messages, sent, edited
+
+async def settlement_autocomplete(interaction: discord.Interaction,
+                                  current: str,
+                            ) -> List[app_commands.Choice[str]]:
+    game = get_state(interaction).get()
+    current = current.lower()
+    return [app_commands.Choice(name=name, value=name)
+            for name in game.settlements_by_name if current in name.lower()][:25]
+
+@app_commands.command(name="set-settlement-owner",
+              description="Sets the owner of a settlement on the region control board")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.autocomplete(settlement=settlement_autocomplete)
+@app_commands.choices(owner_icon=embed_builder.OWNER_ICON_CHOICES)
+async def set_settlement_owner(interaction: discord.Interaction,
+                               settlement: str,
+                               owner: str,
+                               owner_icon: Optional[str] = None):
+    log_interaction_call(interaction)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_set_settlement_owner(state, game, settlement, owner, owner_icon)
+    await send_replies(interaction, replies)
+    await refresh_posted_embeds(interaction, "001")
+
+def apply_set_settlement_owner(state: GameStateService, game: Game, settlement: str, owner: str, owner_icon: Optional[str]) -> List[Reply]:
+    region, this_settlement = game.get_settlement(settlement)
+    if this_settlement is None:
+        return [(f'Settlement {settlement} is not on the region control board!', True)]
+
+    this_settlement.owner = owner
+    this_settlement.owner_icon = owner_icon
+    state.record("settlement_owner", settlement=this_settlement.name, owner=owner, owner_icon=owner_icon)
+    return [(f'Set owner of {this_settlement.name} in {region.name} to {owner}!', True)]
+
+@app_commands.command(name="set-job-board",
+              description="Starts a new, empty job board with the given title")
+@app_commands.default_permissions(manage_guild=True)
+async def set_job_board(interaction: discord.Interaction,
+                        title: str):
+    log_interaction_call(interaction)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        game.job_board = JobBoard(title, [])
+        state.record("job_board", title=title)
+    await interaction.response.send_message(f'Started job board {title}!', ephemeral=True)
+    await refresh_posted_embeds(interaction, "002")
+
+@app_commands.command(name="set-job",
+              description="Sets or adds a job on the job board; emoji can be written as {bank}, {rail}, {hideout}, ...")
+@app_commands.default_permissions(manage_guild=True)
+async def set_job(interaction: discord.Interaction,
+                  number: app_commands.Range[int, 1, 25],
+                  description: str):
+    log_interaction_call(interaction)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_set_job(state, game, number, description)
+    await send_replies(interaction, replies)
+    await refresh_posted_embeds(interaction, "002")
+
+def apply_set_job(state: GameStateService, game: Game, number: int, description: str) -> List[Reply]:
+    if game.job_board is None:
+        return [(f'There is no job board yet, start one with /set-job-board!', True)]
+    elif number > len(game.job_board.jobs) + 1:
+        return [(f'The job board has {len(game.job_board.jobs)} job(s), the next job is number {len(game.job_board.jobs) + 1}!', True)]
+
+    game.job_board.set_job(number, description)
+    state.record("set_job", number=number, description=description)
+    return [(f'Set job #{number} on {game.job_board.title}!', True)]
+
+@app_commands.command(name="remove-job",
+              description="Removes a job from the job board, renumbering the jobs after it")
+@app_commands.default_permissions(manage_guild=True)
+async def remove_job(interaction: discord.Interaction,
+                     number: app_commands.Range[int, 1, 25]):
+    log_interaction_call(interaction)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_remove_job(state, game, number)
+    await send_replies(interaction, replies)
+    await refresh_posted_embeds(interaction, "002")
+
+def apply_remove_job(state: GameStateService, game: Game, number: int) -> List[Reply]:
+    if game.job_board is None or number > len(game.job_board.jobs):
+        return [(f'There is no job #{number} on the job board!', True)]
+
+    game.job_board.remove_job(number)
+    state.record("remove_job", number=number)
+    return [(f'Removed job #{number} from {game.job_board.title}!', True)]
+
+@app_commands.command(name="clear-messages",
+              description="Clears up to 100 messages out of a discord channel")
 @app_commands.default_permissions(manage_guild=True)
 async def clear_messages(interaction: discord.Interaction,
                          channel: discord.TextChannel,
@@ -114,16 +306,144 @@ async def clear_messages(interaction: discord.Interaction,
     await interaction.response.send_message(f"Clearing messages from channel {channel.name}")
     await channel.purge(limit=100)
 
-@tree.command(name="add-faction",
-              description="Adds a faction to the game",
-              guild=discord.Object(id=GUILD_ID))
+    # embeds posted in this channel have to be sent again rather than edited
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        if game.forget_posted_embeds(channel.id):
+            state.mark_dirty(("game",))
+
+@app_commands.command(name="export-game",
+              description="Exports the current game state as pretty-printed JSON")
+@app_commands.default_permissions(manage_guild=True)
+async def export_game(interaction: discord.Interaction):
+    log_interaction_call(interaction)
+    game = get_state(interaction).get()
+
+    game_file = discord.File(io.BytesIO(banker_dom.dump_game(game, "pretty")), filename="game.json")
+    await interaction.response.send_message(f'Exported the current game state', file=game_file, ephemeral=True)
+
+# attachments beyond this are rejected rather than downloaded
+MAX_BULK_IMPORT_BYTES = 1_000_000
+
+@app_commands.command(name="bulk-import",
+              description="Adds factions and players and adjusts assets and statuses from a CSV or JSON file, all at once")
+@app_commands.default_permissions(manage_guild=True)
+async def bulk_import(interaction: discord.Interaction,
+                      file: discord.Attachment,
+                      dry_run: Optional[Literal['True', 'False']] = 'False'):
+    log_interaction_call(interaction)
+    if file.size > MAX_BULK_IMPORT_BYTES:
+        await interaction.response.send_message(f'{file.filename} is larger than {MAX_BULK_IMPORT_BYTES} bytes!', ephemeral=True)
+        return
+    try:
+        operations = bulk_ops.parse_operations(await file.read(), file.filename)
+    except bulk_ops.BulkImportError as error:
+        await interaction.response.send_message(f'Could not read {file.filename}: {error}', ephemeral=True)
+        return
+
+    # players may be given by id alone. The bot does not have the members intent, so most members are not cached
+    # and are fetched, which can take longer than Discord waits for the first response
+    unnamed = [operation for operation in operations
+               if operation.op == "add_player" and not operation.player_name and operation.player_id is not None]
+    if unnamed:
+        await interaction.response.defer(ephemeral=True)
+    for operation in unnamed:
+        member = interaction.guild.get_member(operation.player_id)
+        if member is None:
+            try:
+                member = await interaction.guild.fetch_member(operation.player_id)
+            except discord.HTTPException as error:
+                # the row is then reported by validation as missing a player_name
+                logger.info(f'Could not fetch member {operation.player_id} for a bulk import: {error}')
+                continue
+        operation.player_name = member.name
+
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_bulk_operations(state, game, operations, dry_run == 'True')
+    await send_replies(interaction, replies)
+
+@app_commands.command(name="bulk-set-status",
+              description="Sets the dead and/or incarcerated status of several players at once")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(players="Player mentions or ids, separated by spaces or commas")
+async def bulk_set_status(interaction: discord.Interaction,
+                          players: str,
+                          dead: Optional[Literal['True', 'False']] = None,
+                          incarcerated: Optional[Literal['True', 'False']] = None,
+                          dry_run: Optional[Literal['True', 'False']] = 'False'):
+    log_interaction_call(interaction)
+    operations = [bulk_ops.BulkOperation(line, "set_status", player_id=player_id,
+                                         dead=None if dead is None else dead == 'True',
+                                         incarcerated=None if incarcerated is None else incarcerated == 'True')
+                  for line, player_id in enumerate(parse_player_ids(players), start=1)]
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_bulk_operations(state, game, operations, dry_run == 'True')
+    await send_replies(interaction, replies)
+
+@app_commands.command(name="bulk-adjust-assets",
+              description="Adds to or takes from the assets of several players at once, with a reason kept in the ledger")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.describe(players="Player mentions or ids, separated by spaces or commas")
+async def bulk_adjust_assets(interaction: discord.Interaction,
+                             players: str,
+                             amount: app_commands.Range[int, -50, 50],
+                             reason: str,
+                             dry_run: Optional[Literal['True', 'False']] = 'False'):
+    log_interaction_call(interaction)
+    operations = [bulk_ops.BulkOperation(line, "adjust", player_id=player_id, amount=amount, reason=reason)
+                  for line, player_id in enumerate(parse_player_ids(players), start=1)]
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_bulk_operations(state, game, operations, dry_run == 'True')
+    await send_replies(interaction, replies)
+
+def parse_player_ids(players: str) -> List[int]:
+    # <@123>, <@!123> and bare ids all reduce to their digits
+    return [int(player_id) for player_id in re.findall(r'\d+', players)]
+
+def apply_bulk_operations(state: GameStateService, game: Game, operations: List[bulk_ops.BulkOperation],
+                          dry_run: bool) -> List[Reply]:
+    if not operations:
+        return [(f'There were no operations to apply!', True)]
+
+    # everything is tried on a copy first, so a single invalid operation leaves the game untouched
+    preview = bulk_ops.copy_game(game)
+    errors = bulk_ops.apply_operations(preview, operations, FACTION_NAMES)
+    if errors:
+        return [(content, True) for content in
+                pack_contents([f'Rejected all {len(operations)} operation(s), nothing was changed:'] + errors)]
+    diff_lines = bulk_ops.diff_games(game, preview) or ['no changes']
+    if dry_run:
+        return [(content, True) for content in
+                pack_contents([f'Dry run of {len(operations)} operation(s), nothing was changed:'] + diff_lines)]
+
+    for operation in operations:
+        entries = bulk_ops.apply_operation(game, operation)
+        # new accounts open at their initial assets, before any later adjustment reaches the ledger
+        if operation.op in ("add_faction", "add_player") and state.ledger is not None:
+            state.ledger.open_missing_accounts(game)
+        for entry in entries:
+            state.record_unjournaled(entry)
+    # one save for the whole batch
+    write_game(state)
+    return [(content, True) for content in
+            pack_contents([f'Applied {len(operations)} operation(s):'] + diff_lines)]
+
+@app_commands.command(name="add-faction",
+              description="Adds a faction to the game")
 @app_commands.default_permissions(manage_guild=True)
 async def add_faction(interaction: discord.Interaction,
                       faction: game_factions,
                       assets: app_commands.Range[int, 0, 50] = 0):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_add_faction(state, game, faction, assets)
+    await send_replies(interaction, replies)
 
+def apply_add_faction(state: GameStateService, game: Game, faction: str, assets: int) -> List[Reply]:
     existing_faction = game.get_faction(faction)
 
     if existing_faction is None:
@@ -132,16 +452,14 @@ async def add_faction(interaction: discord.Interaction,
                               assets=assets)
         game.add_faction(new_faction)
 
-        await write_game(game, BASE_PATH)
-        await interaction.response.send_message(f'Added faction {faction} to game with initial assets {assets}',
-                                                ephemeral=True)
+        write_game(state)
+        return [(f'Added faction {faction} to game with initial assets {assets}', True)]
     else:
-        await interaction.response.send_message(f'Failed to add faction {faction} to game!', ephemeral=True)
+        return [(f'Failed to add faction {faction} to game!', True)]
 
 
-@tree.command(name="add-player",
-              description="Adds a player to the game",
-              guild=discord.Object(id=GUILD_ID))
+@app_commands.command(name="add-player",
+              description="Adds a player to the game")
 @app_commands.default_permissions(manage_guild=True)
 async def add_player(interaction: discord.Interaction,
                      player: discord.Member,
@@ -150,23 +468,23 @@ async def add_player(interaction: discord.Interaction,
                      faction_boss: Optional[Literal['True', 'False']] = 'False',
                      withdraw_limit: Optional[int] = 2):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_add_player(state, game, player, faction, assets, faction_boss, withdraw_limit)
+    await send_replies(interaction, replies)
 
+def apply_add_player(state: GameStateService, game: Game, player: discord.abc.User, faction: str, assets: int,
+                     faction_boss: str, withdraw_limit: int) -> List[Reply]:
     game_faction = game.get_faction(faction)
     existing_faction = game.get_faction_of_player(player.id)
 
     # Faction needs to exist first
     if game_faction is None:
-        await interaction.response.send_message(
-            f'Faction {faction} has not been defined yet! Please define this faction first!', ephemeral=True)
-        return
+        return [(f'Faction {faction} has not been defined yet! Please define this faction first!', True)]
 
     # Player can only exist in one faction at a time
     if existing_faction is not None:
-        await interaction.response.send_message(
-            f'Player already found in faction {existing_faction.faction_name}! Player can only exist in one faction!',
-            ephemeral=True)
-        return
+        return [(f'Player already found in faction {existing_faction.faction_name}! Player can only exist in one faction!', True)]
 
     if game.get_player(player.id) is None:
         new_player = Player(player_id=player.id,
@@ -177,399 +495,591 @@ async def add_player(interaction: discord.Interaction,
                             withdraw_limit=withdraw_limit,
                             is_faction_boss=True if faction_boss == 'True' else False)
         game.add_player(new_player)
-        game_faction.add_player(player.id)
-        await write_game(game, BASE_PATH)
-        await interaction.response.send_message(f'Added player {player.name} to game!', ephemeral=True)
+        write_game(state)
+        return [(f'Added player {player.name} to game!', True)]
     else:
-        await interaction.response.send_message(f'Failed to add {player.name} to game!', ephemeral=True)
+        return [(f'Failed to add {player.name} to game!', True)]
 
-@tree.command(name="start-round",
-              description="Creates and enables the current round, if possible",
-              guild=discord.Object(id=GUILD_ID))
+@app_commands.command(name="start-round",
+              description="Creates and enables the current round, if possible")
 @app_commands.default_permissions(manage_guild=True)
 async def start_round(interaction: discord.Interaction):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_start_round(state, game)
+    await send_replies(interaction, replies)
 
-    latest_round = game.get_latest_round()
+def apply_start_round(state: GameStateService, game: Game) -> List[Reply]:
+    new_round = game.start_round()
+    if new_round is None:
+        return [(f'There is already an active round; you must end the existing round first before creating another', True)]
 
-    if latest_round is None:
-        new_round = Round(votes=[], round_number=1, is_active_round=True)
-        game.add_round(new_round)
-    elif latest_round.is_active_round:
-        await interaction.response.send_message(f'There is already an active round; you must end the existing round first before creating another', ephemeral=True)
-        return
-    else:
-        new_round = Round(votes=[], round_number=latest_round.round_number + 1, is_active_round=True)
-        game.add_round(new_round)
-
-    await write_game(game, BASE_PATH)
-    await interaction.response.send_message(f'Created round {new_round.round_number}!', ephemeral=True)
+    write_game(state)
+    return [(f'Created round {new_round.round_number}!', True)]
 
 
-@tree.command(name="end-round",
-              description="Ends the current round, if possible",
-              guild=discord.Object(id=GUILD_ID))
+@app_commands.command(name="end-round",
+              description="Ends the current round, if possible")
 @app_commands.default_permissions(manage_guild=True)
 async def end_round(interaction: discord.Interaction):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
-
-    latest_round = game.get_latest_round()
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_end_round(state, game)
+    await send_replies(interaction, replies)
 
+def apply_end_round(state: GameStateService, game: Game) -> List[Reply]:
+    latest_round = game.end_round()
     if latest_round is None:
-        await interaction.response.send_message(f'There is not currently an active round to end!', ephemeral=True)
-        return
+        return [(f'There is not currently an active round to end!', True)]
+
+    write_game(state)
+    return [(f'Ended round {latest_round.round_number}!', True)]
+
+PHASE_CHOICES = [app_commands.Choice(name="Refresh withdrawals", value="refresh_withdrawals"),
+                 app_commands.Choice(name="Start round", value="start_round"),
+                 app_commands.Choice(name="End round", value="end_round")]
+
+@app_commands.command(name="schedule-phase",
+              description="Runs refresh-withdrawals, start-round or end-round automatically at a time of day (UTC)")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.choices(phase=PHASE_CHOICES)
+@app_commands.describe(time_of_day="HH:MM in UTC", every_days="Days between runs")
+async def schedule_phase(interaction: discord.Interaction,
+                         phase: str,
+                         time_of_day: str,
+                         every_days: app_commands.Range[int, 1, 30] = 1):
+    log_interaction_call(interaction)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_schedule_phase(state, game, phase, time_of_day, every_days)
+        interaction.client.scheduler.reschedule(interaction.guild_id, game)
+    await send_replies(interaction, replies)
+
+def apply_schedule_phase(state: GameStateService, game: Game, phase: str, time_of_day: str, every_days: int) -> List[Reply]:
+    normalised_time = parse_time_of_day(time_of_day)
+    if normalised_time is None:
+        return [(f'{time_of_day} is not a time of day, use HH:MM in UTC!', True)]
+
+    next_run = next_occurrence(normalised_time, int(time.time()))
+    for entry in game.schedule:
+        if entry.phase == phase and entry.time_of_day == normalised_time:
+            entry.every_days = every_days
+            entry.next_run = next_run
+            break
     else:
-        latest_round.is_active_round = False
+        game.schedule.append(banker_dom.ScheduledPhase(phase, normalised_time, every_days, next_run))
+    game.schedule.sort(key=lambda entry: entry.next_run)
 
-    await write_game(game, BASE_PATH)
-    await interaction.response.send_message(f'Ended round {latest_round.round_number}!', ephemeral=True)
+    write_game(state)
+    return [(f'Scheduled {phase} at {normalised_time} UTC every {every_days} day(s), next at <t:{next_run}:F>', True)]
+
+@app_commands.command(name="unschedule-phase",
+              description="Removes a scheduled phase")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.choices(phase=PHASE_CHOICES)
+@app_commands.describe(time_of_day="HH:MM in UTC, as it was scheduled")
+async def unschedule_phase(interaction: discord.Interaction,
+                           phase: str,
+                           time_of_day: str):
+    log_interaction_call(interaction)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_unschedule_phase(state, game, phase, time_of_day)
+        interaction.client.scheduler.reschedule(interaction.guild_id, game)
+    await send_replies(interaction, replies)
+
+def apply_unschedule_phase(state: GameStateService, game: Game, phase: str, time_of_day: str) -> List[Reply]:
+    normalised_time = parse_time_of_day(time_of_day)
+    remaining = [entry for entry in game.schedule
+                 if not (entry.phase == phase and entry.time_of_day == normalised_time)]
+    if len(remaining) == len(game.schedule):
+        return [(f'{phase} is not scheduled at {time_of_day}!', True)]
+
+    game.schedule = remaining
+    write_game(state)
+    return [(f'Removed {phase} at {normalised_time} UTC from the schedule', True)]
+
+@app_commands.command(name="view-schedule",
+              description="Lists the scheduled phases and when they next run")
+@app_commands.default_permissions(manage_guild=True)
+async def view_schedule(interaction: discord.Interaction):
+    log_interaction_call(interaction)
+    game = get_state(interaction).get()
+    if not game.schedule:
+        await interaction.response.send_message(f'No phases are scheduled.', ephemeral=True)
+        return
+    schedule_lines = [f'{entry.phase} at {entry.time_of_day} UTC every {entry.every_days} day(s), '
+                      f'next <t:{entry.next_run}:F> (<t:{entry.next_run}:R>)' for entry in game.schedule]
+    await interaction.response.send_message("\n".join(schedule_lines), ephemeral=True)
 
-@tree.command(name="incarcerate-player",
-              description="Toggles a player status of being incarcerated or not.",
-              guild=discord.Object(id=GUILD_ID))
+@app_commands.command(name="incarcerate-player",
+              description="Toggles a player status of being incarcerated or not.")
 @app_commands.default_permissions(manage_guild=True)
 @app_commands.autocomplete(player=player_list_autocomplete)
 async def incarcerate_player(interaction: discord.Interaction,
                              player: str,
                              incarcerated: Literal['True', 'False']):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_incarcerate_player(state, game, player, incarcerated)
+    await send_replies(interaction, replies)
 
+def apply_incarcerate_player(state: GameStateService, game: Game, player: str, incarcerated: str) -> List[Reply]:
     this_player = game.get_player(int(player))
     if this_player is None:
-        await interaction.response.send_message(f'The selected player is not currently defined in this game!',
-                                                ephemeral=True)
+        return [(f'The selected player is not currently defined in this game!', True)]
     else:
         this_player.is_incarcerated = True if incarcerated == 'True' else False
 
-        await write_game(game, BASE_PATH)
-        await interaction.response.send_message(f'Set incarceration status of {this_player.player_discord_name} to {incarcerated}!', ephemeral=True)
+        state.record("incarcerate", player_id=this_player.player_id, incarcerated=this_player.is_incarcerated)
+        return [(f'Set incarceration status of {this_player.player_discord_name} to {incarcerated}!', True)]
 
-@tree.command(name="kill-player",
-              description="Toggles a player status of being dead or not.",
-              guild=discord.Object(id=GUILD_ID))
+@app_commands.command(name="kill-player",
+              description="Toggles a player status of being dead or not.")
 @app_commands.default_permissions(manage_guild=True)
 @app_commands.autocomplete(player=player_list_autocomplete)
 async def kill_player(interaction: discord.Interaction,
                       player: str,
                       dead: Literal['True', 'False']):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_kill_player(state, game, player, dead)
+    await send_replies(interaction, replies)
 
+def apply_kill_player(state: GameStateService, game: Game, player: str, dead: str) -> List[Reply]:
     this_player = game.get_player(int(player))
     if this_player is None:
-        await interaction.response.send_message(f'The selected player is not currently defined in this game!',ephemeral=True)
+        return [(f'The selected player is not currently defined in this game!', True)]
     else:
-        this_player.is_dead = True if dead == 'True' else False
+        game.set_player_dead(this_player, True if dead == 'True' else False)
 
-        await write_game(game, BASE_PATH)
-        await interaction.response.send_message(f'Set alive status of {this_player.player_discord_name} to {dead}!', ephemeral=True)
+        state.record("kill", player_id=this_player.player_id, dead=this_player.is_dead)
+        return [(f'Set alive status of {this_player.player_discord_name} to {dead}!', True)]
 
 
-@tree.command(name="refresh-withdrawals",
-              description="Toggles a player status of being dead or not.",
-              guild=discord.Object(id=GUILD_ID))
+@app_commands.command(name="adjust-assets",
+              description="Adds to or takes from the assets of a player or a faction, with a reason kept in the ledger")
 @app_commands.default_permissions(manage_guild=True)
-async def refresh_withdrawals(interaction: discord.Interaction):
+@app_commands.autocomplete(player=player_list_autocomplete)
+async def adjust_assets(interaction: discord.Interaction,
+                        amount: app_commands.Range[int, -50, 50],
+                        reason: str,
+                        player: Optional[str] = None,
+                        faction: Optional[game_factions] = None):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_adjust_assets(state, game, amount, reason, player, faction)
+    await send_replies(interaction, replies)
+
+def apply_adjust_assets(state: GameStateService, game: Game, amount: int, reason: str, player: Optional[str], faction: Optional[str]) -> List[Reply]:
+    if (player is None) == (faction is None):
+        return [(f'Select exactly one of the arguments player or faction!', True)]
+
+    if player is not None:
+        account = game.get_player(int(player))
+        account_name = None if account is None else account.player_discord_name
+    else:
+        account = game.get_faction(faction)
+        account_name = faction
+    if account is None:
+        return [(f'The selected player or faction is not currently defined in this game!', True)]
+    elif account.assets + amount < 0:
+        return [(f'{account_name} has only {account.assets} assets, cannot take away {-amount}!', True)]
+
+    account.set_assets(account.assets + amount)
+    state.record("adjust", account_type="player" if player is not None else "faction",
+                 account=account.player_id if player is not None else faction, amount=amount, reason=reason)
+    return [(f'Adjusted the assets of {account_name} by {amount} to {account.assets}: {reason}', True)]
+
+@app_commands.command(name="ledger-audit",
+              description="Checks every balance against the ledger, or lists the recent ledger events of one player or faction")
+@app_commands.default_permissions(manage_guild=True)
+@app_commands.autocomplete(player=player_list_autocomplete)
+async def ledger_audit(interaction: discord.Interaction,
+                       player: Optional[str] = None,
+                       faction: Optional[game_factions] = None):
+    log_interaction_call(interaction)
+    state = get_state(interaction)
+    if state.ledger is None:
+        await interaction.response.send_message(f'This game does not keep a ledger!', ephemeral=True)
+        return
 
-    for player in game.players:
-        if not player.is_incarcerated and not player.is_dead:
-            player.daily_withdraw_available = True
+    game = state.get()
+    if player is None and faction is None:
+        mismatches = state.ledger.audit(game)
+        if not mismatches:
+            await interaction.response.send_message(f'All {len(game.players) + len(game.factions)} balances match the '
+                                                    f'ledger ({state.ledger.event_count} events)', ephemeral=True)
+        else:
+            await interaction.response.send_message(f'{len(mismatches)} balance(s) differ from the ledger:\n'
+                                                    + "\n".join(mismatches[:20]), ephemeral=True)
+        return
 
-    await write_game(game, BASE_PATH)
-    await interaction.response.send_message(f'Refreshed the daily withdrawal allowance for all players!', ephemeral=True)
+    account = player_account(int(player)) if player is not None else faction_account(faction)
+    events = state.ledger.history(account)
+    lines = [f'<t:{event["time"]}> {event["type"]} {amount:+d}' + (f' ({event["reason"]})' if "reason" in event else '')
+             for event in events for posting_account, amount in event["postings"] if posting_account == account]
+    await interaction.response.send_message(f'Balance {state.ledger.balances.get(account)}, last {len(lines)} ledger event(s):\n'
+                                            + ("\n".join(lines) or "none"), ephemeral=True)
 
+@app_commands.command(name="bot-stats",
+              description="Shows command latencies, game state I/O, Discord API calls and queue depths")
+@app_commands.default_permissions(manage_guild=True)
+async def bot_stats(interaction: discord.Interaction):
+    log_interaction_call(interaction)
+    stats_messages = pack_contents(format_bot_stats(interaction.client))
+    await interaction.response.send_message(stats_messages[0], ephemeral=True)
+    for stats_message in stats_messages[1:]:
+        await interaction.followup.send(stats_message, ephemeral=True)
+
+def format_bot_stats(client: BankerBotClient) -> List[str]:
+    registry = metrics.registry
+    stats_lines = [f"**Bot stats since <t:{int(registry.started)}>** (latencies are p50 / p99)", "```"]
+    for command_name in registry.label_values("bankerbot_command_seconds", "command"):
+        latencies = registry.merged_histogram("bankerbot_command_seconds", command=command_name)
+        errors = registry.merged_histogram("bankerbot_command_seconds", command=command_name, outcome="error").count
+        cooldowns = registry.counter_total("bankerbot_cooldown_rejections_total", command=command_name)
+        api_calls = registry.counter_total("bankerbot_discord_api_calls_total", command=command_name)
+        stats_lines.append(f"/{command_name}: {latencies.count} call(s), {format_seconds(latencies.quantile(0.5))} / "
+                           f"{format_seconds(latencies.quantile(0.99))}, {errors} error(s), {cooldowns:.0f} cooldown(s), "
+                           f"{api_calls:.0f} API call(s)")
+    autocompletes = registry.merged_histogram("bankerbot_autocomplete_seconds")
+    stats_lines.append(f"autocomplete: {autocompletes.count} call(s), {format_seconds(autocompletes.quantile(0.5))} / "
+                       f"{format_seconds(autocompletes.quantile(0.99))}")
+    loads = registry.merged_histogram("bankerbot_state_load_seconds")
+    saves = registry.merged_histogram("bankerbot_state_save_seconds")
+    stats_lines.append(f"state loads: {loads.count}, {format_seconds(loads.quantile(0.5))} / {format_seconds(loads.quantile(0.99))}")
+    stats_lines.append(f"state saves: {saves.count}, {format_seconds(saves.quantile(0.5))} / {format_seconds(saves.quantile(0.99))}")
+    stats_lines.append("bytes written: " + ", ".join(
+        f"{target} {registry.counter_total('bankerbot_bytes_written_total', target=target):.0f}"
+        for target in ("game", "journal", "ledger")))
+    api_latencies = registry.merged_histogram("bankerbot_discord_api_seconds")
+    stats_lines.append(f"Discord API: {api_latencies.count} call(s), {format_seconds(api_latencies.quantile(0.5))} / "
+                       f"{format_seconds(api_latencies.quantile(0.99))}")
+    stats_lines.append(f"queues: {sum(client.outbound.queue_depths().values())} outbound message(s), "
+                       f"{logging_manager.get_queue_depth()} log record(s), {logging_manager.get_dropped_count()} dropped")
+    stats_lines.append(f"games loaded: {len(client.games.states)}, pending changes: "
+                       f"{sum(state.dirty_count for state in client.games.states.values())}")
+    stats_lines.append(f"cached views: {sum(state.views.hits for state in client.games.states.values())} hit(s), "
+                       f"{sum(state.views.misses for state in client.games.states.values())} miss(es)")
+    stats_lines.append("```")
+    return stats_lines
+
+def format_seconds(seconds: float) -> str:
+    return f"{seconds * 1000:.1f}ms"
+
+@app_commands.command(name="refresh-withdrawals",
+              description="Toggles a player status of being dead or not.")
+@app_commands.default_permissions(manage_guild=True)
+async def refresh_withdrawals(interaction: discord.Interaction):
+    log_interaction_call(interaction)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_refresh_withdrawals(state, game)
+    await send_replies(interaction, replies)
+
+def apply_refresh_withdrawals(state: GameStateService, game: Game) -> List[Reply]:
+    game.refresh_withdrawals()
+    write_game(state)
+    return [(f'Refreshed the daily withdrawal allowance for all players!', True)]
 
-@tree.command(name="deposit",
-              description="Deposit assets from your personal stash to your faction's holdings",
-              guild=discord.Object(id=GUILD_ID))
-@app_commands.checks.cooldown(1, 5, key=lambda i: i.guild_id)
+
+@app_commands.command(name="deposit",
+              description="Deposit assets from your personal stash to your faction's holdings")
+@app_commands.checks.cooldown(1, 5, key=lambda i: i.user.id)
 async def deposit(interaction: discord.Interaction,
                   amount: app_commands.Range[int, 0, 20]):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_deposit(state, game, interaction.user, amount)
+    await send_replies(interaction, replies)
 
+def apply_deposit(state: GameStateService, game: Game, user: discord.abc.User, amount: int) -> List[Reply]:
     if not game.is_active:
-        await interaction.response.send_message(
-            f'The bot has been put in an inactive state by the moderator. Please try again later.', ephemeral=True)
-        return
+        return [(INACTIVE_MESSAGE, True)]
 
-    depositing_player = game.get_player(interaction.user.id)
-    player_faction = game.get_faction_of_player(interaction.user.id)
+    depositing_player = game.get_player(user.id)
+    player_faction = game.get_faction_of_player(user.id)
 
     if depositing_player is None:
-        await interaction.response.send_message(f'Player {interaction.user.name} is not currently defined in this game!', ephemeral=True)
+        return [(f'Player {user.name} is not currently defined in this game!', True)]
     elif player_faction is None:
-        await interaction.response.send_message(f'Player {interaction.user.name} does not have a valid faction!', ephemeral=True)
+        return [(f'Player {user.name} does not have a valid faction!', True)]
     elif depositing_player.is_dead or depositing_player.is_incarcerated:
-        await interaction.response.send_message(f'Incarcerated or dead players cannot deposit assets!', ephemeral=True)
+        return [(f'Incarcerated or dead players cannot deposit assets!', True)]
     else:
         if depositing_player.assets < amount:
-            await interaction.response.send_message(f'Amount {amount} exceeds available assets of {depositing_player.assets}! Cannot deposit that amount!', ephemeral=True)
-            return
+            return [(f'Amount {amount} exceeds available assets of {depositing_player.assets}! Cannot deposit that amount!', True)]
         else:
             depositing_player.set_assets(depositing_player.assets - amount)
             player_faction.set_assets(player_faction.assets + amount)
 
-            await write_game(game, BASE_PATH)
-            await interaction.response.send_message(f'Deposited {amount} assets to {player_faction.faction_name}', ephemeral=True)
-            await interaction.followup.send(f'Current personal assets are {depositing_player.assets}', ephemeral=True)
+            state.record("deposit", player_id=depositing_player.player_id, amount=amount)
+            return [(f'Deposited {amount} assets to {player_faction.faction_name}', True),
+                    (f'Current personal assets are {depositing_player.assets}', True)]
 
-@tree.command(name="withdraw",
-              description="Withdraw assets from your faction's holdings into your personal stash",
-              guild=discord.Object(id=GUILD_ID))
-@app_commands.checks.cooldown(1, 5, key=lambda i: i.guild_id)
+@app_commands.command(name="withdraw",
+              description="Withdraw assets from your faction's holdings into your personal stash")
+@app_commands.checks.cooldown(1, 5, key=lambda i: i.user.id)
 async def withdraw(interaction: discord.Interaction,
                    amount: app_commands.Range[int, 0, 20]):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_withdraw(state, game, interaction.user, amount)
+    await send_replies(interaction, replies)
 
+def apply_withdraw(state: GameStateService, game: Game, user: discord.abc.User, amount: int) -> List[Reply]:
     if not game.is_active:
-        await interaction.response.send_message(
-            f'The bot has been put in an inactive state by the moderator. Please try again later.', ephemeral=True)
-        return
+        return [(INACTIVE_MESSAGE, True)]
 
-    withdrawing_player = game.get_player(interaction.user.id)
-    player_faction = game.get_faction_of_player(interaction.user.id)
+    withdrawing_player = game.get_player(user.id)
+    player_faction = game.get_faction_of_player(user.id)
 
     if withdrawing_player is None:
-        await interaction.response.send_message(f'Player {interaction.user.name} is not currently defined in this game!', ephemeral=True)
+        return [(f'Player {user.name} is not currently defined in this game!', True)]
     elif player_faction is None:
-        await interaction.response.send_message(f'Player {interaction.user.name} does not have a valid faction!', ephemeral=True)
+        return [(f'Player {user.name} does not have a valid faction!', True)]
     elif withdrawing_player.is_dead or withdrawing_player.is_incarcerated:
-        await interaction.response.send_message(f'Incarcerated or dead players cannot withdraw assets!', ephemeral=True)
+        return [(f'Incarcerated or dead players cannot withdraw assets!', True)]
     else:
         if player_faction.assets < amount:
-            await interaction.response.send_message(f'Amount {amount} exceeds available assets! Cannot withdraw that amount!', ephemeral=True)
+            return [(f'Amount {amount} exceeds available assets! Cannot withdraw that amount!', True)]
         elif amount > withdrawing_player.withdraw_limit:
-            await interaction.response.send_message(f'Amount {amount} exceeds withdrawal limit of {withdrawing_player.withdraw_limit}! Cannot Withdraw that amount!', ephemeral=True)
+            return [(f'Amount {amount} exceeds withdrawal limit of {withdrawing_player.withdraw_limit}! Cannot Withdraw that amount!', True)]
         elif not withdrawing_player.daily_withdraw_available:
-            await interaction.response.send_message(f'No remaining withdrawals available for this phase!', ephemeral=True)
+            return [(f'No remaining withdrawals available for this phase!', True)]
         else:
             withdrawing_player.daily_withdraw_available = False
             player_faction.set_assets(player_faction.assets - amount)
             withdrawing_player.set_assets(withdrawing_player.assets + amount)
 
-            await write_game(game, BASE_PATH)
-            await interaction.response.send_message(f'Withdrew {amount} assets from {player_faction.faction_name} holdings!', ephemeral=True)
-            await interaction.followup.send(f'Current personal assets are {withdrawing_player.assets}', ephemeral=True)
+            state.record("withdraw", player_id=withdrawing_player.player_id, amount=amount)
+            return [(f'Withdrew {amount} assets from {player_faction.faction_name} holdings!', True),
+                    (f'Current personal assets are {withdrawing_player.assets}', True)]
 
-@tree.command(name="transfer",
-              description="Transfer assets from your personal stash to another player",
-              guild=discord.Object(id=GUILD_ID))
-@app_commands.checks.cooldown(1, 5, key=lambda i: i.guild_id)
+@app_commands.command(name="transfer",
+              description="Transfer assets from your personal stash to another player")
+@app_commands.checks.cooldown(1, 5, key=lambda i: i.user.id)
 @app_commands.autocomplete(player=player_list_autocomplete)
 async def transfer(interaction: discord.Interaction,
                    player: str,
                    amount: app_commands.Range[int, 0, 20]):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies = apply_transfer(state, game, interaction.user, player, amount)
+    await send_replies(interaction, replies)
 
+def apply_transfer(state: GameStateService, game: Game, user: discord.abc.User, player: str, amount: int) -> List[Reply]:
     if not game.is_active:
-        await interaction.response.send_message(
-            f'The bot has been put in an inactive state by the moderator. Please try again later.', ephemeral=True)
-        return
+        return [(INACTIVE_MESSAGE, True)]
 
-    sending_player = game.get_player(interaction.user.id)
+    sending_player = game.get_player(user.id)
     receiving_player = game.get_player(int(player))
 
     if sending_player is None:
-        await interaction.response.send_message(
-            f'Player {interaction.user.name} is not currently defined in this game!', ephemeral=True)
-        return
+        return [(f'Player {user.name} is not currently defined in this game!', True)]
     elif receiving_player is None:
-        await interaction.response.send_message(f'The selected player is not currently defined in this game!', ephemeral=True)
-        return
+        return [(f'The selected player is not currently defined in this game!', True)]
     elif sending_player.is_dead or sending_player.is_incarcerated:
-        await interaction.response.send_message(f'Incarcerated or dead players cannot send or receive assets!')
-        return
+        return [(f'Incarcerated or dead players cannot send or receive assets!', False)]
     elif receiving_player.is_dead or receiving_player.is_incarcerated:
-        await interaction.response.send_message(f'Incarcerated or dead players cannot send or receive assets!')
-        return
+        return [(f'Incarcerated or dead players cannot send or receive assets!', False)]
     else:
         if sending_player.assets < amount:
-            await interaction.response.send_message(
-                f'Amount {amount} exceeds available assets of {sending_player.assets}! Cannot send that amount!',
-                ephemeral=True)
-            return
+            return [(f'Amount {amount} exceeds available assets of {sending_player.assets}! Cannot send that amount!', True)]
         else:
             sending_player.set_assets(sending_player.assets - amount)
             receiving_player.set_assets(receiving_player.assets + amount)
 
-            await write_game(game, BASE_PATH)
-            await interaction.response.send_message(f'Transferred {amount} assets to {receiving_player.player_discord_name}', ephemeral=True)
-            await interaction.followup.send(f'Current personal assets are {sending_player.assets}', ephemeral=True)
+            state.record("transfer", sender_id=sending_player.player_id, receiver_id=receiving_player.player_id, amount=amount)
+            return [(f'Transferred {amount} assets to {receiving_player.player_discord_name}', True),
+                    (f'Current personal assets are {sending_player.assets}', True)]
 
-@tree.command(name="balance",
-              description="Get the current balance of assets in your personal stash, or your faction's holdings",
-              guild=discord.Object(id=GUILD_ID))
-@app_commands.checks.cooldown(1, 5, key=lambda i: i.guild_id)
+@app_commands.command(name="balance",
+              description="Get the current balance of assets in your personal stash, or your faction's holdings")
+@app_commands.checks.cooldown(1, 5, key=lambda i: i.user.id)
 async def balance(interaction: discord.Interaction,
                   of_type: Literal['Player', 'Faction', 'Tension']):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
+    state = get_state(interaction)
+    game = state.get()
 
     # if not game.is_active:
-    #     await interaction.response.send_message(f'The bot has been put in an inactive state by the moderator. Please try again later.', ephemeral=True)
+    #     await interaction.response.send_message(INACTIVE_MESSAGE, ephemeral=True)
     #     return
 
-    requesting_player = game.get_player(interaction.user.id)
+    # rendered once and kept until a change to the player or their faction is published
+    content = state.views.get(("balance", interaction.user.id, interaction.user.name, of_type),
+                              lambda: render_balance(game, interaction.user, of_type))
+    await interaction.response.send_message(content, ephemeral=True)
 
-    if of_type == "Player":
-        if requesting_player is None or requesting_player.is_dead:
-            await interaction.response.send_message(f'Player {interaction.user.name} was not found in this game!', ephemeral=True)
-        else:
-            await interaction.response.send_message(f'Current personal assets for player {interaction.user.name} is {requesting_player.assets}', ephemeral=True)
+def render_balance(game: Game, user: discord.abc.User, of_type: str) -> Tuple[str, List[tuple]]:
+    requesting_player = game.get_player(user.id)
+    depends_on = [("player", user.id)]
 
+    if requesting_player is None or requesting_player.is_dead:
+        return f'Player {user.name} was not found in this game!', depends_on
+    elif of_type == "Player":
+        return f'Current personal assets for player {user.name} is {requesting_player.assets}', depends_on
     elif of_type == "Tension":
-        if requesting_player is None or requesting_player.is_dead:
-            await interaction.response.send_message(f'Player {interaction.user.name} was not found in this game!', ephemeral=True)
-        else:
-            await interaction.response.send_message(f'Current tension level for player {interaction.user.name} is {requesting_player.tension}', ephemeral=True)
-    else:
-        if requesting_player is None or requesting_player.is_dead:
-            await interaction.response.send_message(f'Player {interaction.user.name} was not found in this game!', ephemeral=True)
-            return
-        elif not requesting_player.is_faction_boss:
-            await interaction.response.send_message(f'Only faction-boss players may view faction asset holdings!', ephemeral=True)
-            return
-
-        requested_faction = game.get_faction_of_player(interaction.user.id)
-        if requested_faction is None:
-            await interaction.response.send_message(f'Could not find faction for player {interaction.user.name}!', ephemeral=True)
-        else:
-            await interaction.response.send_message(f'Current faction holdings for Faction {requested_faction.faction_name} is {requested_faction.assets}', ephemeral=True)
-
-@tree.command(name="day-action",
-              description="Tracks and notifies moderators of day action submissions that have a cost associated with them",
-              guild=discord.Object(id=GUILD_ID))
-@app_commands.checks.cooldown(1, 5, key=lambda i: i.guild_id)
+        return f'Current tension level for player {user.name} is {requesting_player.tension}', depends_on
+    elif not requesting_player.is_faction_boss:
+        return f'Only faction-boss players may view faction asset holdings!', depends_on
+
+    requested_faction = game.get_faction_of_player(user.id)
+    if requested_faction is None:
+        return f'Could not find faction for player {user.name}!', depends_on
+    return (f'Current faction holdings for Faction {requested_faction.faction_name} is {requested_faction.assets}',
+            depends_on + [("faction", requested_faction.faction_name)])
+
+@app_commands.command(name="day-action",
+              description="Tracks and notifies moderators of day action submissions that have a cost associated with them")
+@app_commands.checks.cooldown(1, 5, key=lambda i: i.user.id)
 async def day_action(interaction: discord.Interaction,
                      action: str,
                      cost: app_commands.Range[int, 0, 20]):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies, requesting_player = apply_day_action(state, game, interaction.user, action, cost)
+    await send_replies(interaction, replies)
 
+    if requesting_player is not None:
+        config = get_guild_config(interaction)
+        mod_action_channel = interaction.guild.get_channel(config.moderator_action_channel)
+        interaction.client.outbound.enqueue(mod_action_channel, f'<@&{config.moderator_role_id}>\nPlayer **{requesting_player.player_discord_name}** has submitted an action request of **{action}** and has paid **{cost}** assets')
+
+def apply_day_action(state: GameStateService, game: Game, user: discord.abc.User, action: str, cost: int) -> Tuple[List[Reply], Optional[Player]]:
     if not game.is_active:
-        await interaction.response.send_message(f'The bot has been put in an inactive state by the moderator. Please try again later.', ephemeral=True)
-        return
+        return [(INACTIVE_MESSAGE, True)], None
 
-    requesting_player = game.get_player(interaction.user.id)
+    requesting_player = game.get_player(user.id)
 
     if requesting_player is None:
-        await interaction.response.send_message(f'Player {interaction.user.name} is not currently defined in this game!', ephemeral=True)
-        return
+        return [(f'Player {user.name} is not currently defined in this game!', True)], None
     elif requesting_player.is_dead or requesting_player.is_incarcerated:
-        await interaction.response.send_message(f'Incarcerated or dead players cannot use actions!')
-        return
+        return [(f'Incarcerated or dead players cannot use actions!', False)], None
     else:
         if requesting_player.assets < cost:
-            await interaction.response.send_message(f'Amount {cost} exceeds available assets of {requesting_player.assets}! Cannot perform this action!', ephemeral=True)
-            return
+            return [(f'Amount {cost} exceeds available assets of {requesting_player.assets}! Cannot perform this action!', True)], None
         else:
-            mod_action_channel = interaction.guild.get_channel(MODERATOR_ACTION_CHANNEL)
-
             requesting_player.set_assets(requesting_player.assets - cost)
-            await write_game(game, BASE_PATH)
-            await interaction.response.send_message(f'Submitted request for action {action} at a cost of {cost} assets', ephemeral=True)
-            await mod_action_channel.send(f'<@&{MODERATOR_ROLE_ID}>\nPlayer **{requesting_player.player_discord_name}** has submitted an action request of **{action}** and has paid **{cost}** assets')
-
-@tree.command(name="vote-player",
-              description="Votes for a particular player",
-              guild=discord.Object(id=GUILD_ID))
-@app_commands.checks.cooldown(1, 5, key=lambda i: i.guild_id)
+            state.record("day_action", player_id=requesting_player.player_id, cost=cost)
+            return [(f'Submitted request for action {action} at a cost of {cost} assets', True)], requesting_player
+
+@app_commands.command(name="vote-player",
+              description="Votes for a particular player")
+@app_commands.checks.cooldown(1, 5, key=lambda i: i.user.id)
 @app_commands.autocomplete(player=player_list_autocomplete)
 async def vote_player(interaction: discord.Interaction,
                       player: Optional[str] = None,
                       other: Optional[Literal['No Vote', 'Unvote']] = None):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
-
+    state = get_state(interaction)
+    async with state.transaction() as game:
+        replies, announcement = apply_vote(state, game, interaction.user, player, other)
+    vote_channel = None
+    if announcement is not None:
+        vote_channel = interaction.guild.get_channel(get_guild_config(interaction).vote_channel)
+    if vote_channel is not None:
+        # announcements landing within the batch window share a single channel message; the voter is told
+        # in the same response rather than with a followup of its own
+        interaction.client.outbound.enqueue(vote_channel, announcement, batch=True)
+        content, ephemeral = replies[0]
+        replies[0] = (f'{content} The announcement will be posted in channel #{vote_channel}.', ephemeral)
+    await send_replies(interaction, replies)
+
+    if announcement is not None and vote_channel is None:
+        await interaction.followup.send(f'Sending public vote results now...', ephemeral=True)
+        await interaction.followup.send(announcement, ephemeral=False)
+
+def apply_vote(state: GameStateService, game: Game, user: discord.abc.User, player: Optional[str], other: Optional[str]) -> Tuple[List[Reply], Optional[str]]:
     if not game.is_active:
-        await interaction.response.send_message(f'The bot has been put in an inactive state by the moderator. Please try again later.', ephemeral=True)
-        return
+        return [(INACTIVE_MESSAGE, True)], None
 
     if player is not None and other is not None:
-        await interaction.response.send_message(f'You may select only one of the arguments player or other, you cannot select both. Please resubmit your vote.', ephemeral=True)
-        return
+        return [(f'You may select only one of the arguments player or other, you cannot select both. Please resubmit your vote.', True)], None
 
     latest_round = game.get_latest_round()
     if latest_round is None or not latest_round.is_active_round:
-        await interaction.response.send_message(f'No currently active round found for this game!', ephemeral=True)
-        return
+        return [(f'No currently active round found for this game!', True)], None
 
-    requesting_player = game.get_player(interaction.user.id)
+    requesting_player = game.get_player(user.id)
     if requesting_player is None or requesting_player.is_dead:
-        await interaction.response.send_message(f'Player {interaction.user.name} was not found in this game!', ephemeral=True)
-        return
-
-    if player is not None and player not in game.get_living_player_ids():
-        await interaction.response.send_message(f'Invalid player selection! Please resubmit your vote.', ephemeral=True)
-        return
+        return [(f'Player {user.name} was not found in this game!', True)], None
 
-    voted_player = None if player is None else game.get_player(int(player))
+    # looked up through the player index; the choice is free text when autocomplete is bypassed
+    voted_player = game.get_player(int(player)) if player is not None and player.isdigit() else None
+    if player is not None and voted_player is None:
+        return [(f'Invalid player selection! Please resubmit your vote.', True)], None
 
     if voted_player is not None and voted_player.is_dead:
-        await interaction.response.send_message(f'Player {voted_player.player_discord_name} is dead and cannot be voted!', ephemeral=True)
-        return
+        return [(f'Player {voted_player.player_discord_name} is dead and cannot be voted!', True)], None
 
     if voted_player is None and other is None:
-        await interaction.response.send_message(f'Player {player.name} was not found in this game!', ephemeral=True)
-        return
+        return [(f'You must select a player or another option to vote for! Please resubmit your vote.', True)], None
     else:
         round_current_player_vote = latest_round.get_player_vote(requesting_player.player_id)
+        previous_choice = None if round_current_player_vote is None else round_current_player_vote.choice
+        if voted_player is None:
+            new_choice = None if other == 'Unvote' else other
+        else:
+            new_choice = str(voted_player.player_id)
+        response_value = voted_player.player_discord_name if voted_player is not None else other
+
+        # repeating a vote, or unvoting without one, changes nothing, so nothing is recorded or journaled
+        if new_choice == previous_choice:
+            return [(f'Registered vote for {response_value}!', True)], None
 
         if voted_player is None and other is not None:
             if round_current_player_vote is None and other != 'Unvote':
                 latest_round.add_vote(Vote(requesting_player.player_id, other, round(time.time())))
             else:
                 if other == 'Unvote':
-                    latest_round.remove_vote(round_current_player_vote)
+                    if round_current_player_vote is not None:
+                        latest_round.remove_vote(round_current_player_vote)
                 else:
-                    round_current_player_vote.choice = other
-                    round_current_player_vote.timestamp = round(time.time())
+                    latest_round.change_vote(round_current_player_vote, other, round(time.time()))
         else:
             if round_current_player_vote is None:
                 latest_round.add_vote(Vote(requesting_player.player_id, str(voted_player.player_id), round(time.time())))
             else:
-                round_current_player_vote.choice = str(voted_player.player_id)
-                round_current_player_vote.timestamp = round(time.time())
-
-        await write_game(game, BASE_PATH)
-
-        if voted_player is not None:
-            success_vote_target = voted_player.player_discord_name
+                latest_round.change_vote(round_current_player_vote, str(voted_player.player_id), round(time.time()))
+
+        recorded_vote = latest_round.get_player_vote(requesting_player.player_id)
+        if recorded_vote is None:
+            unvote_timestamp = round(time.time())
+            latest_round.record_vote_event(requesting_player.player_id, None, unvote_timestamp)
+            state.record("unvote", round_number=latest_round.round_number, player_id=requesting_player.player_id,
+                         timestamp=unvote_timestamp)
         else:
-            success_vote_target = other
-        await interaction.response.send_message(f'Registered vote for {success_vote_target}!', ephemeral=True)
+            latest_round.record_vote_event(requesting_player.player_id, recorded_vote.choice, recorded_vote.timestamp)
+            state.record("vote", round_number=latest_round.round_number, player_id=requesting_player.player_id,
+                              choice=recorded_vote.choice, timestamp=recorded_vote.timestamp)
 
-        vote_channel = interaction.guild.get_channel(VOTE_CHANNEL)
-
-        response_value = voted_player.player_discord_name if voted_player is not None else other
+        return ([(f'Registered vote for {response_value}!', True)],
+                f'Player **{requesting_player.player_discord_name}** has submitted a vote for **{response_value}**')
 
-        if vote_channel is not None:
-            await interaction.followup.send(f'Sending public vote announcement in channel #{vote_channel}', ephemeral=True)
-            await vote_channel.send(f'Player **{requesting_player.player_discord_name}** has submitted a vote for **{response_value}**')
-        else:
-            await interaction.followup.send(f'Sending public vote results now...', ephemeral=True)
-            await interaction.followup.send(f'Player **{requesting_player.player_discord_name}** has submitted a vote for **{response_value}**', ephemeral=False)
-
-@tree.command(name="vote-report",
-              description="Generates a report of current voting totals",
-              guild=discord.Object(id=GUILD_ID))
-@app_commands.checks.cooldown(1, 5, key=lambda i: i.guild_id)
+@app_commands.command(name="vote-report",
+              description="Generates a report of current voting totals")
+@app_commands.checks.cooldown(1, 5, key=lambda i: i.user.id)
 async def vote_report(interaction: discord.Interaction,
                       for_round: Optional[app_commands.Range[int, 0, 20]] = None,
-                      with_history: Optional[Literal['Yes', 'No']] = 'No'):
+                      with_history: Optional[Literal['Yes', 'No']] = 'No',
+                      as_of_timestamp: Optional[int] = None):
     log_interaction_call(interaction)
-    game = await get_game(BASE_PATH)
+    game = get_state(interaction).get()
 
     if not game.is_active:
-        await interaction.response.send_message(f'The bot has been put in an inactive state by the moderator. Please try again later.', ephemeral=True)
+        await interaction.response.send_message(INACTIVE_MESSAGE, ephemeral=True)
         return
 
     if for_round is None:
@@ -581,64 +1091,169 @@ async def vote_report(interaction: discord.Interaction,
         await interaction.response.send_message(f'No active or matching round found for this game!', ephemeral=True)
         return
 
-    vote_dict = {}
+    # as_of_timestamp is a unix timestamp, the standings and history are reported as they stood then
+    report_messages = [format_vote_standings(game, report_round, as_of_timestamp)]
+    if with_history == 'Yes':
+        history_lines = format_vote_history(game, report_round, as_of_timestamp)
+        report_messages += pack_contents(history_lines or ['No vote history was recorded for this round.'])
 
-    for vote in report_round.votes:
-        if vote.choice in vote_dict.keys():
-            vote_dict.get(vote.choice).append(vote.player_id)
-        else:
-            vote_dict[vote.choice] = [vote.player_id]
-
-    formatted_votes = f"**Vote Totals for round {report_round.round_number} as of <t:{int(time.time())}>**\n"
-    formatted_votes += "```\n"
-    for key, value in sorted(vote_dict.items(), key=lambda e: len(e[1]), reverse=True):
-        if key == 'No Vote':
-            formatted_votee = key
-        else:
-            formatted_votee = game.get_player(int(key)).player_discord_name
-        formatted_votes += f"{formatted_votee}: {len(value)} vote(s)\n"
-        formatted_votes += f"    Voted By: "
-        for player_id in value:
-            formatted_voter = game.get_player(int(player_id)).player_discord_name
-            formatted_votes += f"{formatted_voter}, "
-        formatted_votes = formatted_votes.rstrip(', ')
-        formatted_votes += "\n"
-    formatted_votes += "```\n"
-
-    vote_channel = interaction.guild.get_channel(VOTE_CHANNEL)
+    vote_channel = interaction.guild.get_channel(get_guild_config(interaction).vote_channel)
 
     if vote_channel is not None:
         await interaction.response.send_message(f'Sending query response in channel ', ephemeral=True)
-        await vote_channel.send(formatted_votes)
+        for report_message in report_messages:
+            interaction.client.outbound.enqueue(vote_channel, report_message)
     else:
         await interaction.response.send_message(f'Sending vote results now...', ephemeral=True)
-        await interaction.followup.send(formatted_votes, ephemeral=False)
+        for report_message in report_messages:
+            await interaction.followup.send(report_message, ephemeral=False)
 
-    #With History to-be-implemented
 
-
-@tree.error
 async def on_app_command_error(interaction: discord.Interaction, error: app_commands.AppCommandError):
     if isinstance(error, app_commands.CommandOnCooldown):
-        await interaction.response.send_message(
-            f"Cooldown is in force, please wait for {round(error.retry_after)} seconds", ephemeral=True)
+        metrics.increment("bankerbot_cooldown_rejections_total", command=interaction.command.name)
+        await send_error(interaction, f"Cooldown is in force, please wait for {round(error.retry_after)} seconds")
+    elif isinstance(error, UnknownGuildError):
+        await send_error(interaction, f"This server is not hosting a game!")
+    elif isinstance(error, app_commands.CommandInvokeError) and isinstance(error.original, StaleGameError):
+        await send_error(interaction, f"The game was changed by someone else at the same time, please try again.")
     else:
         raise error
 
-async def get_game(path: str) -> Game:
-    json_file_path = f'{path}/game.json'
-    logger.info(f'Grabbing game info from {json_file_path}')
-    return banker_dom.read_json_to_dom(json_file_path)
+async def send_error(interaction: discord.Interaction, message: str):
+    # commands such as post-embed answer before their slow part, so a later error has to be a followup
+    if interaction.response.is_done():
+        await interaction.followup.send(message, ephemeral=True)
+    else:
+        await interaction.response.send_message(message, ephemeral=True)
+
+def format_choice(game: Game, choice: str) -> str:
+    if choice == 'No Vote':
+        return choice
+    return game.get_player(int(choice)).player_discord_name
+
+def format_vote_standings(game: Game, report_round: Round, as_of: Optional[int] = None) -> str:
+    if as_of is None:
+        standings = report_round.get_standings()
+    else:
+        standings = report_round.get_standings_at(as_of)
+    formatted_votes = f"**Vote Totals for round {report_round.round_number} as of <t:{int(time.time()) if as_of is None else as_of}>**\n"
+    formatted_votes += "```\n"
+    for key, value in standings:
+        formatted_votee = format_choice(game, key)
+        formatted_votes += f"{formatted_votee}: {len(value)} vote(s)\n"
+        formatted_votes += f"    Voted By: "
+        formatted_votes += ", ".join(game.get_player(int(player_id)).player_discord_name for player_id in value)
+        formatted_votes += "\n"
+    formatted_votes += "```\n"
+    return formatted_votes
+
+def format_vote_history(game: Game, report_round: Round, until: Optional[int] = None) -> List[str]:
+    history_lines = [f"**Vote history for round {report_round.round_number}**"]
+    last_choices = {}
+    for event in report_round.get_history(until):
+        voter = game.get_player(event.player_id).player_discord_name
+        previous_choice = last_choices.get(event.player_id)
+        if event.choice is None:
+            history_lines.append(f"<t:{event.timestamp}:T> **{voter}** removed their vote for **{format_choice(game, previous_choice)}**")
+        elif previous_choice is None:
+            history_lines.append(f"<t:{event.timestamp}:T> **{voter}** voted for **{format_choice(game, event.choice)}**")
+        else:
+            history_lines.append(f"<t:{event.timestamp}:T> **{voter}** changed their vote from "
+                                 f"**{format_choice(game, previous_choice)}** to **{format_choice(game, event.choice)}**")
+        last_choices[event.player_id] = event.choice
+    return history_lines if len(history_lines) > 1 else []
+
+
+def get_state(interaction: discord.Interaction) -> GameStateService:
+    return interaction.client.games.get_state(interaction.guild_id)
 
 
-async def write_game(game: Game, path: str):
-    json_file_path = f'{path}/game.json'
-    logger.info(f'Wrote game data to {json_file_path}')
-    banker_dom.write_dom_to_json(game, json_file_path)
+def get_guild_config(interaction: discord.Interaction) -> GuildConfig:
+    return interaction.client.games.get_guild_config(interaction.guild_id)
+
+
+async def send_replies(interaction: discord.Interaction, replies: List[Reply]):
+    # the first reply answers the interaction, any further ones are sent as followups
+    content, ephemeral = replies[0]
+    if interaction.response.is_done():
+        # the command deferred, so even the first reply is a followup
+        await interaction.followup.send(content, ephemeral=ephemeral)
+    else:
+        await interaction.response.send_message(content, ephemeral=ephemeral)
+    for content, ephemeral in replies[1:]:
+        await interaction.followup.send(content, ephemeral=ephemeral)
+
+
+def write_game(state: GameStateService):
+    # moderator changes are not journaled, so persist them right away
+    state.mark_dirty()
+    state.flush()
+    # players and factions added by a moderator start the ledger at their initial assets
+    if state.ledger is not None:
+        state.ledger.open_missing_accounts(state.game)
 
 
 def log_interaction_call(interaction: discord.Interaction):
     logger.info(
         f'Received command {interaction.command.name} with parameters {interaction.data} initiated by user {interaction.user.name}')
 
-client.run(TOKEN)
+
+COMMANDS = [toggle_activity, post_embed, set_settlement_owner, set_job_board, set_job, remove_job, clear_messages,
+            export_game, bulk_import, bulk_set_status, bulk_adjust_assets, add_faction, add_player, start_round,
+            end_round, schedule_phase, unschedule_phase, view_schedule, incarcerate_player, kill_player, adjust_assets,
+            ledger_audit, bot_stats, refresh_withdrawals, deposit, withdraw, transfer, balance, day_action, vote_player,
+            vote_report]
+
+
+def create_app(config: BotConfig, shard_ids: Optional[List[int]] = None) -> BankerBotClient:
+    client = BankerBotClient(config, shard_ids)
+    for guild_id in client.games.guild_configs:
+        guild = discord.Object(id=guild_id)
+        for command in COMMANDS:
+            # the profiler runs inside the timer, so the recorded latencies include its overhead
+            client.tree.add_command(metrics.instrument_command(profiling.instrument_command(
+                guild_registry.instrument_command(command))), guild=guild)
+    client.tree.error(on_app_command_error)
+    return client
+
+
+def worker_shard_ids(worker: int, workers: int, shard_count: int) -> List[int]:
+    return [shard_id for shard_id in range(shard_count) if shard_id % workers == worker]
+
+
+def run_worker(worker: int):
+    config = load_config()
+    logging_manager.create_logger(config.base_path, config.log_format, config.log_queue_size,
+                                  file_name=f"bankerbot_log.worker{worker}.txt")
+    if config.metrics_port is not None:
+        # each worker serves its own metrics, on consecutive ports
+        config.metrics_port += worker
+    client = create_app(config, worker_shard_ids(worker, config.workers, config.shard_count))
+    client.run(config.token)
+
+
+def main():
+    config = load_config()
+    if config.workers > 1:
+        if config.shard_count is None or config.shard_count < config.workers:
+            raise ValueError('WORKERS > 1 needs SHARD_COUNT set to at least the number of workers')
+        if not config.shared_state:
+            raise ValueError('WORKERS > 1 needs SHARED_STATE, with GAME_STORE=sqlite')
+        # spawned rather than forked, so no worker inherits another's event loop or logging thread
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=run_worker, args=(worker,), name=f"bankerbot-worker{worker}")
+                     for worker in range(config.workers)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        return
+
+    logging_manager.create_logger(config.base_path, config.log_format, config.log_queue_size)
+    client = create_app(config)
+    client.run(config.token)
+
+
+if __name__ == "__main__":
+    main()
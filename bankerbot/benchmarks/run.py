@@ -0,0 +1,211 @@
+#! run.py
+# times the command hot paths against synthetic games; run from the bankerbot directory with
+#   python -m benchmarks.run --players 200 --rounds 20 --output results.json
+#   python -m benchmarks.run --compare results.json --threshold 1.25
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import banker_dom
+from banker_dom import PlayerNameIndex, Round
+from game_state import GameStateService
+from benchmarks.synthetic import make_game, SyntheticUser
+
+
+def summarize(durations: List[float]) -> Dict[str, float]:
+    ordered = sorted(durations)
+    return {"runs": len(ordered),
+            "mean_ms": statistics.fmean(ordered) * 1000,
+            "min_ms": ordered[0] * 1000,
+            "p50_ms": ordered[len(ordered) // 2] * 1000,
+            "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000}
+
+
+def time_calls(func: Callable[[], object], runs: int) -> Dict[str, float]:
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return summarize(durations)
+
+
+def bench_serialization(game, directory: str, runs: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+    formats = [game_format for game_format in banker_dom.GAME_FORMATS
+               if game_format != "msgpack" or banker_dom.msgpack is not None]
+    for game_format in formats:
+        filepath = os.path.join(directory, f"bench.{game_format}")
+        results[f"write_dom_to_json[{game_format}]"] = time_calls(
+            lambda: banker_dom.write_dom_to_json(game, filepath, game_format), runs)
+        results[f"read_json_to_dom[{game_format}]"] = time_calls(lambda: banker_dom.read_json_to_dom(filepath), runs)
+
+    store = banker_dom.SqliteGameStore(os.path.join(directory, "bench.db"))
+    try:
+        store.save(game)
+        living = [player.player_id for player in game.players if not player.is_dead]
+        rng = random.Random(1)
+        results["sqlite_save[transfer rows]"] = time_calls(
+            lambda: store.save(game, {("player", rng.choice(living)), ("player", rng.choice(living)), ("game",)}),
+            runs)
+        results["sqlite_load"] = time_calls(store.load, runs)
+    finally:
+        store.close()
+    return results
+
+
+def bench_autocomplete(game, runs: int) -> Dict[str, Dict[str, float]]:
+    rng = random.Random(2)
+    names = [player.player_discord_name.lower() for player in game.players]
+
+    def random_query() -> str:
+        name = rng.choice(names)
+        start = rng.randrange(len(name) - 3)
+        return name[start:start + rng.randint(1, 3)]
+
+    index = game.get_name_index()
+    return {"autocomplete_index_rebuild": time_calls(lambda: PlayerNameIndex(game.players).search(""), runs),
+            "autocomplete_search": time_calls(lambda: index.search(random_query()), runs * 10)}
+
+
+def bench_votes(game, runs: int) -> Dict[str, Dict[str, float]]:
+    latest_round = game.get_latest_round()
+    votes = latest_round.votes
+    results = {"vote_tally_rebuild": time_calls(
+        lambda: Round(votes=votes, round_number=0, is_active_round=True).get_standings(), runs)}
+    if latest_round.history:
+        rng = random.Random(4)
+        first, last = latest_round.history[0].timestamp, latest_round.history[-1].timestamp
+        results["vote_standings_at"] = time_calls(
+            lambda: latest_round.get_standings_at(rng.randint(first, last)), runs)
+    try:
+        import bankerbot
+    except ImportError:
+        # the report formatter lives with the discord handlers
+        return results
+    results["vote_report_format"] = time_calls(lambda: bankerbot.format_vote_standings(game, latest_round), runs)
+    results["vote_history_format"] = time_calls(lambda: bankerbot.format_vote_history(game, latest_round), runs)
+    return results
+
+
+def bench_commands(game, directory: str, runs: int) -> Dict[str, Dict[str, float]]:
+    import bankerbot
+
+    state_path = os.path.join(directory, "state")
+    os.makedirs(state_path, exist_ok=True)
+    banker_dom.write_dom_to_json(game, os.path.join(state_path, "game.json"), "json")
+    state = GameStateService(state_path, dirty_threshold=10 ** 9)
+    state.load()
+    rng = random.Random(3)
+    living = [player for player in state.game.players if not player.is_dead and not player.is_incarcerated]
+
+    async def transfer(flush: bool):
+        sender = rng.choice([player for player in living if player.assets > 0] or living)
+        receiver = rng.choice(living)
+        async with state.transaction() as locked_game:
+            bankerbot.apply_transfer(state, locked_game,
+                                     SyntheticUser(sender.player_id, sender.player_discord_name),
+                                     str(receiver.player_id), 1)
+        if flush:
+            state.flush()
+
+    async def run_all() -> Dict[str, Dict[str, float]]:
+        results = {}
+        for name, flush in (("transfer_command", False), ("transfer_round_trip[flush]", True)):
+            durations = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                await transfer(flush)
+                durations.append(time.perf_counter() - start)
+            results[name] = summarize(durations)
+        return results
+
+    boss = next((player for player in living if player.is_faction_boss), living[0])
+    boss_user = SyntheticUser(boss.player_id, boss.player_discord_name)
+    results = {"balance_render": time_calls(lambda: bankerbot.render_balance(state.game, boss_user, "Faction"), runs),
+               "balance_view_cached": time_calls(lambda: state.views.get(
+                   ("balance", boss.player_id, boss.player_discord_name, "Faction"),
+                   lambda: bankerbot.render_balance(state.game, boss_user, "Faction")), runs)}
+    try:
+        results.update(asyncio.run(run_all()))
+        return results
+    finally:
+        state.store.close()
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    for name, current in sorted(results["benchmarks"].items()):
+        previous = baseline["benchmarks"].get(name)
+        if previous is None or previous["p50_ms"] <= 0:
+            continue
+        ratio = current["p50_ms"] / previous["p50_ms"]
+        flag = "REGRESSION" if ratio > threshold else ""
+        print(f"{name:40s} {previous['p50_ms']:10.4f} -> {current['p50_ms']:10.4f} ms  x{ratio:5.2f} {flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bankerbot command hot paths")
+    parser.add_argument("--players", type=int, default=30)
+    parser.add_argument("--factions", type=int, default=5)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--votes-per-round", type=int, default=30)
+    parser.add_argument("--revotes-per-round", type=int, default=0)
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    parser.add_argument("--compare", help="a previous results file to check for regressions against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="fail when a p50 latency grows by more than this factor over the baseline")
+    args = parser.parse_args()
+
+    sizes = {"players": args.players, "factions": args.factions, "rounds": args.rounds,
+             "votes_per_round": args.votes_per_round, "revotes_per_round": args.revotes_per_round}
+    game = make_game(seed=args.seed, **sizes)
+
+    benchmarks = {}
+    with tempfile.TemporaryDirectory() as directory:
+        benchmarks.update(bench_serialization(game, directory, args.runs))
+        benchmarks.update(bench_autocomplete(game, args.runs))
+        benchmarks.update(bench_votes(game, args.runs))
+        try:
+            benchmarks.update(bench_commands(game, directory, args.runs))
+        except ImportError as error:
+            print(f"Skipping command benchmarks: {error}", file=sys.stderr)
+
+    results = {"sizes": sizes,
+               "python": platform.python_version(),
+               "orjson": banker_dom.orjson is not None,
+               "benchmarks": benchmarks}
+
+    for name, summary in benchmarks.items():
+        print(f"{name:40s} p50 {summary['p50_ms']:10.4f} ms  p99 {summary['p99_ms']:10.4f} ms")
+
+    if args.output:
+        with open(args.output, 'w', encoding="utf8") as outfile:
+            json.dump(results, outfile, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding="utf8") as infile:
+            baseline = json.load(infile)
+        if baseline.get("sizes") != sizes:
+            print(f"Warning: baseline sizes {baseline.get('sizes')} differ from {sizes}", file=sys.stderr)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed beyond x{args.threshold}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#! synthetic.py
+# generators for synthetic game states of a chosen size
+import random
+from banker_dom import Game, Player, Faction, Round, Vote
+
+
+class SyntheticUser:
+    # stands in for the discord user on an interaction; the apply_* functions only need id and name
+    def __init__(self, user_id: int, name: str):
+        self.id = user_id
+        self.name = name
+
+
+def make_game(players: int = 30, factions: int = 5, rounds: int = 5, votes_per_round: int = 30,
+              revotes_per_round: int = 0, seed: int = 0) -> Game:
+    rng = random.Random(seed)
+    game = Game(True, [], [], [])
+    for faction_index in range(factions):
+        game.add_faction(Faction(player_ids=[], faction_name=f"Faction {faction_index}", assets=rng.randint(0, 50)))
+    for player_index in range(players):
+        game.add_player(Player(player_id=100000 + player_index,
+                               player_discord_name=f"player_{rng.getrandbits(32):08x}",
+                               faction_name=f"Faction {player_index % factions}",
+                               assets=rng.randint(0, 20),
+                               tension=rng.randint(0, 5),
+                               is_faction_boss=player_index < factions,
+                               is_dead=rng.random() < 0.1))
+    player_ids = [player.player_id for player in game.players]
+    for round_number in range(1, rounds + 1):
+        a_round = Round(votes=[], round_number=round_number, is_active_round=round_number == rounds)
+        timestamp = 1700000000 + round_number * 86400
+        for voter_id in rng.sample(player_ids, min(votes_per_round, len(player_ids))):
+            timestamp += rng.randint(1, 60)
+            choice = "No Vote" if rng.random() < 0.05 else str(rng.choice(player_ids))
+            a_round.add_vote(Vote(voter_id, choice, timestamp))
+            a_round.record_vote_event(voter_id, choice, timestamp)
+        for _ in range(revotes_per_round):
+            vote = a_round.get_player_vote(rng.choice(player_ids))
+            if vote is not None:
+                timestamp += rng.randint(1, 60)
+                a_round.change_vote(vote, str(rng.choice(player_ids)), timestamp)
+                a_round.record_vote_event(vote.player_id, vote.choice, timestamp)
+        game.add_round(a_round)
+    return game
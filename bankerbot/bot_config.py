@@ -0,0 +1,92 @@
+#! bot_config.py
+# settings for a bot process, read from the environment (and .env) only when asked for
+import os
+from typing import List, Optional
+from dotenv import load_dotenv
+
+
+class BotConfig:
+    def __init__(self, token: str, guild_id: Optional[int], player_role_id: Optional[int], vote_channel: Optional[int],
+                 moderator_action_channel: Optional[int], moderator_role_id: Optional[int], base_path: str,
+                 flush_interval: float = 5.0, flush_threshold: int = 20, game_store: str = "json",
+                 log_format: str = "text", log_queue_size: int = 10000, announce_batch_window: float = 1.0,
+                 channel_rate: int = 5, channel_rate_per: float = 5.0, guilds_file: Optional[str] = None,
+                 game_idle_timeout: float = 1800.0, shard_count: Optional[int] = None, workers: int = 1,
+                 shared_state: bool = False, ledger_checkpoint_every: int = 500, metrics_port: Optional[int] = None,
+                 metrics_host: str = "127.0.0.1", profile_commands: Optional[List[str]] = None,
+                 profile_threshold_ms: Optional[float] = None, profile_mode: str = "cprofile",
+                 profile_sample_interval_ms: float = 5.0, profile_max_per_hour: int = 10,
+                 phase_tick_interval: float = 30.0):
+        self.token = token
+        self.guild_id = guild_id
+        self.player_role_id = player_role_id
+        self.vote_channel = vote_channel
+        self.moderator_action_channel = moderator_action_channel
+        self.moderator_role_id = moderator_role_id
+        self.base_path = base_path
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.game_store = game_store
+        self.log_format = log_format
+        self.log_queue_size = log_queue_size
+        self.announce_batch_window = announce_batch_window
+        self.channel_rate = channel_rate
+        self.channel_rate_per = channel_rate_per
+        # a JSON registry of the guilds hosted by this process; without it the single guild above is hosted
+        self.guilds_file = guilds_file
+        self.game_idle_timeout = game_idle_timeout
+        # with several workers the shards are split between processes, which then share the sqlite stores
+        self.shard_count = shard_count
+        self.workers = workers
+        self.shared_state = shared_state
+        self.ledger_checkpoint_every = ledger_checkpoint_every
+        # the Prometheus text endpoint is only served when a port is given
+        self.metrics_port = metrics_port
+        self.metrics_host = metrics_host
+        # commands are profiled when named here ("*" for all) or when they run over the threshold
+        self.profile_commands = profile_commands or []
+        self.profile_threshold_ms = profile_threshold_ms
+        self.profile_mode = profile_mode
+        self.profile_sample_interval_ms = profile_sample_interval_ms
+        self.profile_max_per_hour = profile_max_per_hour
+        # seconds between checks for scheduled phases that have come due
+        self.phase_tick_interval = phase_tick_interval
+
+
+def getenv_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return None if value is None else int(value)
+
+
+def load_config() -> BotConfig:
+    load_dotenv()
+    return BotConfig(token=os.getenv('DISCORD_TOKEN'),
+                     guild_id=getenv_int('GUILD_ID'),
+                     player_role_id=getenv_int('PLAYER_ROLE_ID'),
+                     vote_channel=getenv_int('VOTE_CHANNEL'),
+                     moderator_action_channel=getenv_int('MODERATOR_ACTION_CHANNEL'),
+                     moderator_role_id=getenv_int('MODERATOR_ROLE_ID'),
+                     base_path=os.getenv('BASE_PATH'),
+                     flush_interval=float(os.getenv('FLUSH_INTERVAL', '5')),
+                     flush_threshold=int(os.getenv('FLUSH_THRESHOLD', '20')),
+                     game_store=os.getenv('GAME_STORE', 'json'),
+                     log_format=os.getenv('LOG_FORMAT', 'text'),
+                     log_queue_size=int(os.getenv('LOG_QUEUE_SIZE', '10000')),
+                     announce_batch_window=float(os.getenv('ANNOUNCE_BATCH_WINDOW', '1')),
+                     channel_rate=int(os.getenv('CHANNEL_RATE', '5')),
+                     channel_rate_per=float(os.getenv('CHANNEL_RATE_PER', '5')),
+                     guilds_file=os.getenv('GUILDS_FILE'),
+                     game_idle_timeout=float(os.getenv('GAME_IDLE_TIMEOUT', '1800')),
+                     shard_count=getenv_int('SHARD_COUNT'),
+                     workers=int(os.getenv('WORKERS', '1')),
+                     shared_state=os.getenv('SHARED_STATE', 'false').lower() in ('1', 'true', 'yes'),
+                     ledger_checkpoint_every=int(os.getenv('LEDGER_CHECKPOINT_EVERY', '500')),
+                     metrics_port=getenv_int('METRICS_PORT'),
+                     metrics_host=os.getenv('METRICS_HOST', '127.0.0.1'),
+                     profile_commands=[name.strip() for name in os.getenv('PROFILE_COMMANDS', '').split(',') if name.strip()],
+                     profile_threshold_ms=None if os.getenv('PROFILE_THRESHOLD_MS') is None
+                     else float(os.getenv('PROFILE_THRESHOLD_MS')),
+                     profile_mode=os.getenv('PROFILE_MODE', 'cprofile'),
+                     profile_sample_interval_ms=float(os.getenv('PROFILE_SAMPLE_INTERVAL_MS', '5')),
+                     profile_max_per_hour=int(os.getenv('PROFILE_MAX_PER_HOUR', '10')),
+                     phase_tick_interval=float(os.getenv('PHASE_TICK_INTERVAL', '30')))
@@ -0,0 +1,223 @@
+#! bulk_ops.py
+# many moderator changes (factions, players, asset adjustments and statuses) validated together
+# and applied as one transaction, from a CSV or JSON attachment or from the bulk commands
+import csv
+import io
+import json
+from typing import Dict, List, Optional, Sequence
+from banker_dom import Game, Player, Faction
+from journal import apply_entry
+
+OPERATIONS = ("add_faction", "add_player", "adjust", "set_status")
+
+# the same bounds the single-change commands put on their arguments
+MAX_INITIAL_ASSETS = 50
+MAX_ADJUSTMENT = 50
+
+
+class BulkImportError(ValueError):
+    pass
+
+
+class BulkOperation:
+    def __init__(self, line: int, op: str, player_id: Optional[int] = None, player_name: Optional[str] = None,
+                 faction: Optional[str] = None, assets: int = 0, faction_boss: bool = False, withdraw_limit: int = 2,
+                 amount: Optional[int] = None, reason: Optional[str] = None, dead: Optional[bool] = None,
+                 incarcerated: Optional[bool] = None):
+        # line is the row of the file, or the position in the command's list, used in error messages
+        self.line = line
+        self.op = op
+        self.player_id = player_id
+        self.player_name = player_name
+        self.faction = faction
+        self.assets = assets
+        self.faction_boss = faction_boss
+        self.withdraw_limit = withdraw_limit
+        self.amount = amount
+        self.reason = reason
+        self.dead = dead
+        self.incarcerated = incarcerated
+
+
+def parse_bool(value, field: str) -> Optional[bool]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in ("true", "yes", "1"):
+        return True
+    if str(value).strip().lower() in ("false", "no", "0"):
+        return False
+    raise BulkImportError(f'{field} must be true or false, not {value!r}')
+
+
+def parse_int(value, field: str) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise BulkImportError(f'{field} must be a whole number, not {value!r}') from None
+
+
+def parse_operation(line: int, row: Dict[str, object]) -> BulkOperation:
+    op = str(row.get("op") or "").strip()
+    if op not in OPERATIONS:
+        raise BulkImportError(f'Line {line}: op must be one of {", ".join(OPERATIONS)}, not {op!r}')
+    try:
+        assets = parse_int(row.get("assets"), "assets")
+        faction_boss = parse_bool(row.get("faction_boss"), "faction_boss")
+        withdraw_limit = parse_int(row.get("withdraw_limit"), "withdraw_limit")
+        return BulkOperation(line, op,
+                             player_id=parse_int(row.get("player_id"), "player_id"),
+                             player_name=str(row["player_name"]).strip() if row.get("player_name") else None,
+                             faction=str(row["faction"]).strip() if row.get("faction") else None,
+                             assets=0 if assets is None else assets,
+                             faction_boss=bool(faction_boss),
+                             withdraw_limit=2 if withdraw_limit is None else withdraw_limit,
+                             amount=parse_int(row.get("amount"), "amount"),
+                             reason=str(row["reason"]).strip() if row.get("reason") else None,
+                             dead=parse_bool(row.get("dead"), "dead"),
+                             incarcerated=parse_bool(row.get("incarcerated"), "incarcerated"))
+    except BulkImportError as error:
+        raise BulkImportError(f'Line {line}: {error}') from None
+
+
+def parse_operations(data: bytes, filename: str) -> List[BulkOperation]:
+    # JSON is a list of operation objects (or {"operations": [...]}); CSV has one operation per row,
+    # with a header naming the same fields and empty cells for the ones that do not apply
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise BulkImportError('The file is not UTF-8 text') from None
+    if filename.lower().endswith(".json") or text.lstrip()[:1] in ("[", "{"):
+        try:
+            document = json.loads(text)
+        except ValueError as error:
+            raise BulkImportError(f'The file is not valid JSON: {error}') from None
+        rows = document.get("operations") if isinstance(document, dict) else document
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise BulkImportError('A JSON import must be a list of operation objects')
+        return [parse_operation(line, row) for line, row in enumerate(rows, start=1)]
+    # the header is line 1, so the first operation is on line 2
+    return [parse_operation(line, row) for line, row in enumerate(csv.DictReader(io.StringIO(text)), start=2)]
+
+
+def validate_operation(game: Game, operation: BulkOperation, faction_names: Sequence[str]) -> Optional[str]:
+    if operation.op == "add_faction":
+        if operation.faction not in faction_names:
+            return f'{operation.faction!r} is not one of the game\'s factions'
+        if game.get_faction(operation.faction) is not None:
+            return f'Faction {operation.faction} already exists'
+        if not 0 <= operation.assets <= MAX_INITIAL_ASSETS:
+            return f'Initial assets must be between 0 and {MAX_INITIAL_ASSETS}'
+    elif operation.op == "add_player":
+        if operation.player_id is None or not operation.player_name:
+            return f'add_player needs a player_id and a player_name'
+        if game.get_faction(operation.faction) is None:
+            return f'Faction {operation.faction} has not been defined yet'
+        existing_faction = game.get_faction_of_player(operation.player_id)
+        if existing_faction is not None:
+            return f'{operation.player_name} is already in faction {existing_faction.faction_name}'
+        if game.get_player(operation.player_id) is not None:
+            return f'{operation.player_name} is already in the game'
+        if not 0 <= operation.assets <= MAX_INITIAL_ASSETS:
+            return f'Initial assets must be between 0 and {MAX_INITIAL_ASSETS}'
+    elif operation.op == "adjust":
+        if (operation.player_id is None) == (operation.faction is None):
+            return f'adjust needs exactly one of player_id or faction'
+        if operation.amount is None or not -MAX_ADJUSTMENT <= operation.amount <= MAX_ADJUSTMENT:
+            return f'adjust needs an amount between {-MAX_ADJUSTMENT} and {MAX_ADJUSTMENT}'
+        if not operation.reason:
+            return f'adjust needs a reason'
+        account = (game.get_player(operation.player_id) if operation.player_id is not None
+                   else game.get_faction(operation.faction))
+        if account is None:
+            return f'The player or faction is not defined in this game'
+        if account.assets + operation.amount < 0:
+            return f'Only {account.assets} assets, cannot take away {-operation.amount}'
+    elif operation.op == "set_status":
+        if game.get_player(operation.player_id) is None:
+            return f'Player {operation.player_id} is not defined in this game'
+        if operation.dead is None and operation.incarcerated is None:
+            return f'set_status needs dead, incarcerated or both'
+    return None
+
+
+def apply_operation(game: Game, operation: BulkOperation) -> List[dict]:
+    # adjustments and statuses are the same changes the journal already knows how to apply;
+    # their entries are returned for the ledger
+    if operation.op == "add_faction":
+        game.add_faction(Faction(player_ids=[], faction_name=operation.faction, assets=operation.assets))
+        return []
+    elif operation.op == "add_player":
+        game.add_player(Player(player_id=operation.player_id,
+                               player_discord_name=operation.player_name,
+                               faction_name=operation.faction,
+                               assets=operation.assets,
+                               tension=0,
+                               withdraw_limit=operation.withdraw_limit,
+                               is_faction_boss=operation.faction_boss))
+        return []
+    elif operation.op == "adjust" and operation.player_id is not None:
+        entries = [{"op": "adjust", "account_type": "player", "account": operation.player_id,
+                    "amount": operation.amount, "reason": operation.reason}]
+    elif operation.op == "adjust":
+        entries = [{"op": "adjust", "account_type": "faction", "account": operation.faction,
+                    "amount": operation.amount, "reason": operation.reason}]
+    else:
+        entries = []
+        if operation.dead is not None:
+            entries.append({"op": "kill", "player_id": operation.player_id, "dead": operation.dead})
+        if operation.incarcerated is not None:
+            entries.append({"op": "incarcerate", "player_id": operation.player_id, "incarcerated": operation.incarcerated})
+    for entry in entries:
+        apply_entry(game, entry)
+    return entries
+
+
+def apply_operations(game: Game, operations: List[BulkOperation], faction_names: Sequence[str]) -> List[str]:
+    # every operation is validated against the game as the ones before it left it; invalid ones are
+    # skipped so that one pass reports all the problems. Callers apply to a copy first
+    errors = []
+    for operation in operations:
+        error = validate_operation(game, operation, faction_names)
+        if error is not None:
+            errors.append(f'Line {operation.line} ({operation.op}): {error}')
+            continue
+        apply_operation(game, operation)
+    return errors
+
+
+def copy_game(game: Game) -> Game:
+    return Game.from_dict(json.loads(json.dumps(game.to_dict())))
+
+
+def describe_changes(before: dict, after: dict) -> str:
+    changes = []
+    for key, value in after.items():
+        if before.get(key) == value:
+            continue
+        if isinstance(value, list):
+            changes.append(f'{key} {len(before.get(key) or [])} -> {len(value)}')
+        else:
+            changes.append(f'{key} {before.get(key)} -> {value}')
+    return ", ".join(changes)
+
+
+def diff_games(before: Game, after: Game) -> List[str]:
+    diff_lines = []
+    for faction in after.factions:
+        previous = before.get_faction(faction.faction_name)
+        if previous is None:
+            diff_lines.append(f'+ faction {faction.faction_name} (assets {faction.assets})')
+        elif previous.to_dict() != faction.to_dict():
+            diff_lines.append(f'~ faction {faction.faction_name}: {describe_changes(previous.to_dict(), faction.to_dict())}')
+    for player in after.players:
+        previous = before.get_player(player.player_id)
+        if previous is None:
+            diff_lines.append(f'+ player {player.player_discord_name} in {player.faction_name} (assets {player.assets}'
+                              f'{", faction boss" if player.is_faction_boss else ""})')
+        elif previous.to_dict() != player.to_dict():
+            diff_lines.append(f'~ player {player.player_discord_name}: {describe_changes(previous.to_dict(), player.to_dict())}')
+    return diff_lines
@@ -0,0 +1,36 @@
+#! check_import_time.py
+# measures the cumulative import time of a module with -X importtime and checks it against a budget
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict
+
+
+def measure_import_time(module: str) -> Dict[str, int]:
+    # returns the cumulative import time, in microseconds, of every module imported along the way
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True)
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check a module's import time against a budget")
+    parser.add_argument("module", nargs="?", default="bankerbot")
+    parser.add_argument("--budget-ms", type=float, default=1000.0)
+    parser.add_argument("--top", type=int, default=10, help="also list the slowest imports")
+    args = parser.parse_args()
+
+    import_timings = measure_import_time(args.module)
+    total_ms = import_timings[args.module] / 1000
+    for name, cumulative in sorted(import_timings.items(), key=lambda e: e[1], reverse=True)[:args.top]:
+        print(f"{cumulative / 1000:9.1f} ms  {name}")
+    print(f"import {args.module}: {total_ms:.1f} ms (budget {args.budget_ms:.1f} ms)")
+    sys.exit(0 if total_ms <= args.budget_ms else 1)
@@ -1,9 +1,10 @@
 # embed_builder.py
+import hashlib
+import json
 import discord
 from discord import Colour, Embed
-from typing import List, Dict
-
-embed_dict = {}
+from typing import List, Dict, Optional
+from banker_dom import Game, Region, Settlement, JobBoard
 
 bank_emoji = "<:set_type_bank:1083033459339047043>"
 rail_emoji = "<:set_type_rail:1083033466423222313>"
@@ -18,106 +19,173 @@ lawman_teal = "<:lawman_teal:1084157133853044746>"
 lawman_pink = "<:lawman_pink:1084157131651026984>"
 robber_blue = "<:robber_baron_blue:1084157145836163103>"
 robber_bro = "<:robber_baron_brown:1084157148130447372>"
-robber_wht = "<:robber_baron_gold:1084157150479261779>"
+robber_gld = "<:robber_baron_gold:1084157150479261779>"
 robber_grn = "<:robber_baron_green:1084157152895176725>"
 robber_blk = "<:robber_baron_black:1091102729398665296>"
 robber_wht = "<:robber_baron_white:1092485193975214215>"
 
 
-def get_embed_dict() -> Dict[str, List[Embed]]:
-    return embed_dict
-
-def build_embeds() -> List[discord.app_commands.Choice]:
-    embed_choices = []
-
-    embed_choices.append(discord.app_commands.Choice(name="Region Control", value="001"))
-    embed_dict["001"] = [region_control_embed1, region_control_embed2, region_control_embed3, region_control_embed4, region_control_embed5]
-
-    embed_choices.append(discord.app_commands.Choice(name="Job Board", value="002"))
-    embed_dict["002"] = [daily_jobs_embed]
-
-    return embed_choices
-
-# Region Control
-region_control_embed1 = discord.Embed(title="Region: Lemoyne", description="", color=discord.Colour.blue())
-region_control_embed1.add_field(name=f"    {bank_emoji} Saint Denis Bank", value=f"Unowned", inline=False)
-region_control_embed1.add_field(name=f"    {rail_emoji} Rhodes Rail Station", value=f"Unowned", inline=False)
-region_control_embed1.add_field(name=f"    {indu_emoji} Caliga Hall", value=f"Unowned", inline=False)
-region_control_embed1.add_field(name=f"    {trdp_emoji} Lagras Trading Post", value=f"{robber_bro} Robber Baron", inline=False)
-region_control_embed1.add_field(name=f"    {hide_emoji} Clemens Point", value=f"{robber_bro} Robber Baron", inline=False)
-region_control_embed2 = discord.Embed(title="Region: New Hanover", description="", color=discord.Colour.green())
-region_control_embed2.add_field(name=f"    {bank_emoji} Bank of Valentine", value=f"{robber_grn} Robber Baron", inline=False)
-region_control_embed2.add_field(name=f"    {rail_emoji} Emerald Station", value=f"Unowned", inline=False)
-region_control_embed2.add_field(name=f"    {indu_emoji} Heartland Oil Fields", value=f"{robber_blk} Robber Baron", inline=False)
-region_control_embed2.add_field(name=f"    {trdp_emoji} Van Horn Trading Post", value=f"{robber_blk} Robber Baron", inline=False)
-region_control_embed2.add_field(name=f"    {hide_emoji} Horseshoe Overlook", value=f"{outlaw_orng} Outlaw", inline=False)
-region_control_embed3 = discord.Embed(title="Region: Ambarino", description="", color=discord.Colour.yellow())
-region_control_embed3.add_field(name=f"    {bank_emoji} Bank of Colter", value=f"Unowned", inline=False)
-region_control_embed3.add_field(name=f"    {rail_emoji} Bacchus Station", value=f"{robber_wht} Robber Baron", inline=False)
-region_control_embed3.add_field(name=f"    {indu_emoji} Jameson Mining & Coal", value=f"{robber_wht} Robber Baron", inline=False)
-region_control_embed3.add_field(name=f"    {trdp_emoji} Colter Trading Post", value=f"{robber_bro} Robber Baron", inline=False)
-region_control_embed3.add_field(name=f"    {hide_emoji} Ewing Basin", value=f"{outlaw_orng} Outlaw", inline=False)
-region_control_embed4 = discord.Embed(title="Region: West Elizabeth", description="", color=discord.Colour.orange())
-region_control_embed4.add_field(name=f"    {bank_emoji} Blackwater Bank", value=f"{robber_blue} Robber Baron", inline=False)
-region_control_embed4.add_field(name=f"    {rail_emoji} Riggs Station", value=f"{robber_blue} Robber Baron", inline=False)
-region_control_embed4.add_field(name=f"    {indu_emoji} Hobb's Taxidermy", value=f"{robber_blue} Robber Baron", inline=False)
-region_control_embed4.add_field(name=f"    {trdp_emoji} Manzanita Post", value=f"Unowned", inline=False)
-region_control_embed4.add_field(name=f"    {hide_emoji} Chochinay", value=f"{robber_blue} Robber Baron", inline=False)
-region_control_embed5 = discord.Embed(title="Region: New Austin", description="", color=discord.Colour.brand_red())
-region_control_embed5.add_field(name=f"    {bank_emoji} Bank of Armadillo", value=f"{robber_bro} Robber Baron", inline=False)
-region_control_embed5.add_field(name=f"    {rail_emoji} Mercer Rail Station", value=f"{robber_blk} Robber Baron", inline=False)
-region_control_embed5.add_field(name=f"    {indu_emoji} MacFarlane's Ranch", value=f"{robber_bro} Robber Baron", inline=False)
-region_control_embed5.add_field(name=f"    {trdp_emoji} Tumbleweed Trading Post", value=f"Unowned", inline=False)
-region_control_embed5.add_field(name=f"    {hide_emoji} Rathskeller Fork", value=f"{outlaw_yell} Outlaw", inline=False)
-
-# Daily Jobs
-# daily_jobs_embed = discord.Embed(title="Round 1 Job Board", description="", color=discord.Colour.teal())
-# daily_jobs_embed.add_field(name="Job #1", value=f"Build {trdp_emoji} Colter Trading Post", inline=False)
-# daily_jobs_embed.add_field(name="Job #2", value=f"Build {hide_emoji} Chochinay", inline=False)
-# daily_jobs_embed.add_field(name="Job #3", value=f"Heist {indu_emoji} Jameson Mining & Coal", inline=False)
-# daily_jobs_embed.add_field(name="Job #4", value=f"Heist {indu_emoji} Hobb's Taxidermy", inline=False)
-# daily_jobs_embed.add_field(name="Job #5", value=f"Rob 2 players in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #6", value=f"Foil 2 players in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #7", value=f"Goad 2 players in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #8", value=f"Hogtie 2 players in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #9", value=f"Seize {trdp_emoji} Tumbleweed Post", inline=False)
-# daily_jobs_embed.add_field(name="Job #10", value=f"Raze {bank_emoji} Blackwater Bank", inline=False)
-
-# daily_jobs_embed = discord.Embed(title="Round 2 Job Board", description="", color=discord.Colour.teal())
-# daily_jobs_embed.add_field(name="Job #1", value=f"Heist 2 Robber Baron settlements in the same night phase (+2 assets)", inline=False)
-# daily_jobs_embed.add_field(name="Job #2", value=f"Raze 2 Robber Baron settlements in the same night phase (+2 assets)", inline=False)
-# daily_jobs_embed.add_field(name="Job #3", value=f"Seize a Robber Baron settlement (+1 asset)", inline=False)
-# daily_jobs_embed.add_field(name="Job #4", value=f"Build a hideout settlement", inline=False)
-# daily_jobs_embed.add_field(name="Job #5", value=f"Rob 2 players in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #6", value=f"Foil 2 players in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #7", value=f"Cool Off 2 players in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #8", value=f"Hogtie 2 players in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #9", value=f"Terrorize 2 players in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #10", value=f"Successfully jailbreak in this night phase (+1 asset)", inline=False)
-
-# daily_jobs_embed = discord.Embed(title="Round 3 Job Board", description="", color=discord.Colour.teal())
-# daily_jobs_embed.add_field(name="Job #1", value=f"Heist a {bank_emoji} Bank controlled by a Robber Baron (+2 assets)", inline=False)
-# daily_jobs_embed.add_field(name="Job #2", value=f"Collect a bounty during this night phase (+2 assets)", inline=False)
-# daily_jobs_embed.add_field(name="Job #3", value=f"Seize a Robber Baron settlement (+1 asset)", inline=False)
-# daily_jobs_embed.add_field(name="Job #4", value=f"Build a hideout settlement (+1 asset)", inline=False)
-# daily_jobs_embed.add_field(name="Job #7", value=f"Successfully complete an action against any settlement with Extra Manpower (+1 asset)", inline=False)
-# daily_jobs_embed.add_field(name="Job #5", value=f"Rob 2 players in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #6", value=f"Foil 2 Robber Barons in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #8", value=f"Cool Off 2 players in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #9", value=f"Terrorize 2 players in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #10", value=f"Successfully complete 3 or more actions in the same night phase (+2 assets)", inline=False)
-
-# daily_jobs_embed = discord.Embed(title="Round 5 Job Board", description="", color=discord.Colour.teal())
-# daily_jobs_embed.add_field(name="Job #1", value=f"Heist a {bank_emoji} Bank controlled by a Robber Baron (+2 assets)", inline=False)
-# daily_jobs_embed.add_field(name="Job #2", value=f"Rob a Robber Baron (+1 asset)", inline=False)
-# daily_jobs_embed.add_field(name="Job #3", value=f"Seize a {rail_emoji} Rail Station (+2 assets)", inline=False)
-# daily_jobs_embed.add_field(name="Job #4", value=f"Successfully complete an action against any settlement with Extra Manpower (+1 asset)", inline=False)
-# daily_jobs_embed.add_field(name="Job #5", value=f"Heist an {indu_emoji} Industry settlement (+1 asset)", inline=False)
-# daily_jobs_embed.add_field(name="Job #6", value=f"Guard a settlement your faction controls", inline=False)
-# daily_jobs_embed.add_field(name="Job #7", value=f"Rob a Robber Baron (+1 asset)", inline=False)
-# daily_jobs_embed.add_field(name="Job #8", value=f"Successfully complete an illegal action targeting a Lawman player (+2 assets)", inline=False)
-# daily_jobs_embed.add_field(name="Job #9", value=f"Terrorize 2 players in the same night phase", inline=False)
-# daily_jobs_embed.add_field(name="Job #10", value=f"Successfully complete 3 or more actions in the same night phase (+3 assets)", inline=False)
-
-daily_jobs_embed = discord.Embed(title="Round 9 Job Board", description="", color=discord.Colour.teal())
-daily_jobs_embed.add_field(name="Job #1", value=f"Heist two {bank_emoji} Bank or {indu_emoji} Industry settlements in the same night (your faction wins the game)", inline=False)
+EMBED_CHOICES = [discord.app_commands.Choice(name="Region Control", value="001"),
+                 discord.app_commands.Choice(name="Job Board", value="002")]
+
+SETTLEMENT_EMOJI = {"bank": bank_emoji,
+                    "rail": rail_emoji,
+                    "industry": indu_emoji,
+                    "trading_post": trdp_emoji,
+                    "hideout": hide_emoji}
+
+OWNER_ICONS = {"outlaw_red": outlaw_red,
+               "outlaw_orange": outlaw_orng,
+               "outlaw_yellow": outlaw_yell,
+               "outlaw_purple": outlaw_purp,
+               "lawman_teal": lawman_teal,
+               "lawman_pink": lawman_pink,
+               "robber_blue": robber_blue,
+               "robber_brown": robber_bro,
+               "robber_gold": robber_gld,
+               "robber_green": robber_grn,
+               "robber_black": robber_blk,
+               "robber_white": robber_wht}
+
+OWNER_ICON_CHOICES = [discord.app_commands.Choice(name=name, value=name) for name in OWNER_ICONS]
+
+# rendered embeds keyed by a hash of the state they were rendered from,
+# so an update only re-renders the region or board that actually changed
+rendered_embeds: Dict[str, Embed] = {}
+MAX_RENDERED_EMBEDS = 256
+
+
+def get_embeds(game: Game, embed_set: str) -> List[Embed]:
+    if embed_set == "001":
+        return [render_region(region) for region in game.regions]
+    elif embed_set == "002":
+        return [] if game.job_board is None else [render_job_board(game.job_board)]
+    raise ValueError(f'Unknown embed set {embed_set}')
+
+# Discord accepts at most 10 embeds and 6000 characters of embed text in one message
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARACTERS_PER_MESSAGE = 6000
+
+
+def pack_embeds(embeds: List[Embed]) -> List[List[Embed]]:
+    # groups the embeds, in order, into as few messages as the limits allow
+    packed = []
+    current = []
+    characters = 0
+    for embed in embeds:
+        if current and (len(current) == MAX_EMBEDS_PER_MESSAGE
+                        or characters + len(embed) > MAX_EMBED_CHARACTERS_PER_MESSAGE):
+            packed.append(current)
+            current = []
+            characters = 0
+        current.append(embed)
+        characters += len(embed)
+    if current:
+        packed.append(current)
+    return packed
+
+
+def hash_embeds(embeds: List[Embed]) -> str:
+    # a stable fingerprint of a message's embeds, used to skip edits that would change nothing
+    content = json.dumps([embed.to_dict() for embed in embeds], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf8")).hexdigest()
+
+def hash_state(kind: str, state: dict) -> str:
+    content = json.dumps(state, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(f"{kind}:{content}".encode("utf8")).hexdigest()
+
+
+def memoized_render(kind: str, state: dict, render) -> Embed:
+    key = hash_state(kind, state)
+    embed = rendered_embeds.get(key)
+    if embed is None:
+        if len(rendered_embeds) >= MAX_RENDERED_EMBEDS:
+            rendered_embeds.clear()
+        embed = rendered_embeds[key] = render()
+    return embed
+
+
+def replace_emoji_names(text: str) -> str:
+    # job descriptions may name emoji as {bank}, {rail}, {robber_blue} and so on
+    for name, emoji in {**SETTLEMENT_EMOJI, **OWNER_ICONS}.items():
+        text = text.replace(f"{{{name}}}", emoji)
+    return text
+
+
+def render_region(region: Region) -> Embed:
+    def render() -> Embed:
+        region_embed = discord.Embed(title=f"Region: {region.name}", description="",
+                                     color=getattr(Colour, region.colour, Colour.default)())
+        for settlement in region.settlements:
+            owner = settlement.owner
+            if settlement.owner_icon in OWNER_ICONS:
+                owner = f"{OWNER_ICONS[settlement.owner_icon]} {owner}"
+            region_embed.add_field(name=f"    {SETTLEMENT_EMOJI.get(settlement.settlement_type, '')} {settlement.name}",
+                                   value=owner, inline=False)
+        return region_embed
+
+    return memoized_render("region", region.to_dict(), render)
+
+
+def render_job_board(job_board: JobBoard) -> Embed:
+    def render() -> Embed:
+        daily_jobs_embed = discord.Embed(title=job_board.title, description="", color=discord.Colour.teal())
+        for number, job in enumerate(job_board.jobs, start=1):
+            daily_jobs_embed.add_field(name=f"Job #{number}", value=replace_emoji_names(job), inline=False)
+        return daily_jobs_embed
+
+    return memoized_render("job_board", job_board.to_dict(), render)
+
+
+def seed_board(game: Game) -> bool:
+    # games created before regions and jobs were stored get the board as it was last posted
+    seeded = False
+    if not game.regions:
+        game.set_regions(default_regions())
+        seeded = True
+    if game.job_board is None:
+        game.job_board = default_job_board()
+        seeded = True
+    return seeded
+
+
+def settlement(name: str, settlement_type: str, owner_icon: Optional[str] = None, owner: str = "Unowned") -> Settlement:
+    return Settlement(name, settlement_type, owner, owner_icon)
+
+
+def default_regions() -> List[Region]:
+    return [Region("Lemoyne", "blue", [
+                settlement("Saint Denis Bank", "bank"),
+                settlement("Rhodes Rail Station", "rail"),
+                settlement("Caliga Hall", "industry"),
+                settlement("Lagras Trading Post", "trading_post", "robber_brown", "Robber Baron"),
+                settlement("Clemens Point", "hideout", "robber_brown", "Robber Baron")]),
+            Region("New Hanover", "green", [
+                settlement("Bank of Valentine", "bank", "robber_green", "Robber Baron"),
+                settlement("Emerald Station", "rail"),
+                settlement("Heartland Oil Fields", "industry", "robber_black", "Robber Baron"),
+                settlement("Van Horn Trading Post", "trading_post", "robber_black", "Robber Baron"),
+                settlement("Horseshoe Overlook", "hideout", "outlaw_orange", "Outlaw")]),
+            Region("Ambarino", "yellow", [
+                settlement("Bank of Colter", "bank"),
+                settlement("Bacchus Station", "rail", "robber_white", "Robber Baron"),
+                settlement("Jameson Mining & Coal", "industry", "robber_white", "Robber Baron"),
+                settlement("Colter Trading Post", "trading_post", "robber_brown", "Robber Baron"),
+                settlement("Ewing Basin", "hideout", "outlaw_orange", "Outlaw")]),
+            Region("West Elizabeth", "orange", [
+                settlement("Blackwater Bank", "bank", "robber_blue", "Robber Baron"),
+                settlement("Riggs Station", "rail", "robber_blue", "Robber Baron"),
+                settlement("Hobb's Taxidermy", "industry", "robber_blue", "Robber Baron"),
+                settlement("Manzanita Post", "trading_post"),
+                settlement("Chochinay", "hideout", "robber_blue", "Robber Baron")]),
+            Region("New Austin", "brand_red", [
+                settlement("Bank of Armadillo", "bank", "robber_brown", "Robber Baron"),
+                settlement("Mercer Rail Station", "rail", "robber_black", "Robber Baron"),
+                settlement("MacFarlane's Ranch", "industry", "robber_brown", "Robber Baron"),
+                settlement("Tumbleweed Trading Post", "trading_post"),
+                settlement("Rathskeller Fork", "hideout", "outlaw_yellow", "Outlaw")])]
+
+
+def default_job_board() -> JobBoard:
+    return JobBoard("Round 9 Job Board",
+                    ["Heist two {bank} Bank or {industry} Industry settlements in the same night (your faction wins the game)"])
@@ -0,0 +1,61 @@
+#! events.py
+# an in-process bus of game change events, and a cache of rendered views that the events invalidate.
+# The events carry the same change keys the stores save by: ("player", id), ("faction", name), ("round", n)...
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+# None means anything may have changed, as after a reload or a moderator's full save
+Changes = Optional[Set[tuple]]
+
+
+class ChangeBus:
+    def __init__(self):
+        self._subscribers: List[Callable[[Changes], None]] = []
+
+    def subscribe(self, callback: Callable[[Changes], None]) -> Callable[[], None]:
+        # returns a function that unsubscribes again
+        self._subscribers.append(callback)
+        return lambda: self._subscribers.remove(callback)
+
+    def publish(self, changes: Changes):
+        # delivered synchronously, so a subscriber is up to date before the publisher's next await
+        for callback in list(self._subscribers):
+            callback(changes)
+
+
+class ViewCache:
+    def __init__(self, bus: ChangeBus, max_views: int = 4096):
+        self.max_views = max_views
+        self.hits = 0
+        self.misses = 0
+        self.views: Dict[Hashable, str] = {}
+        # the views each change key was rendered from
+        self.dependents: Dict[tuple, Set[Hashable]] = {}
+        bus.subscribe(self.invalidate)
+
+    def get(self, key: Hashable, render: Callable[[], Tuple[str, Iterable[tuple]]]) -> str:
+        # render returns the view and the change keys it was rendered from
+        view = self.views.get(key)
+        if view is not None:
+            self.hits += 1
+            return view
+        self.misses += 1
+        view, depends_on = render()
+        if len(self.views) >= self.max_views:
+            self.clear()
+        self.views[key] = view
+        for change in depends_on:
+            self.dependents.setdefault(change, set()).add(key)
+        return view
+
+    def invalidate(self, changes: Changes):
+        if changes is None:
+            self.clear()
+            return
+        for change in changes:
+            for key in self.dependents.pop(change, ()):
+                self.views.pop(key, None)
+
+    def clear(self):
+        self.views.clear()
+        self.dependents.clear()
+
@@ -0,0 +1,231 @@
+#! game_state.py
+# a long-lived holder for the game state, served from memory and persisted write-behind
+import asyncio
+import contextlib
+import os
+import sqlite3
+import time
+from typing import Optional, AsyncIterator, List, Set
+import banker_dom
+from banker_dom import Game, GameStore, StaleGameError
+from journal import Journal, replay, entry_changes
+from ledger import Ledger
+from events import ChangeBus, ViewCache
+import metrics
+from logging_manager import logger
+
+
+class GameStateService:
+    def __init__(self, path: str, store: Optional[GameStore] = None, flush_interval: float = 5.0,
+                 dirty_threshold: int = 20, shared: bool = False, ledger: Optional[Ledger] = None):
+        self.store = store if store is not None else banker_dom.FileGameStore(os.path.join(path, "game.json"))
+        # a shared store may be written by other processes too: every transaction starts from the latest
+        # saved version and commits with compare-and-swap, instead of being journaled and written behind
+        self.shared = shared
+        if shared and self.store.get_version() is None:
+            raise ValueError(f'{type(self.store).__name__} cannot be shared between processes')
+        self.journal = Journal(os.path.join(path, "game.journal"))
+        self.ledger = ledger
+        # in shared mode asset movements reach the ledger only once their transaction has committed
+        self.pending_ledger_entries: List[dict] = []
+        self.flush_interval = flush_interval
+        self.dirty_threshold = dirty_threshold
+        self.game: Optional[Game] = None
+        self.dirty_count = 0
+        # change keys waiting for the next flush; None means the whole game must be saved
+        self.pending_changes: Optional[Set[tuple]] = set()
+        self._flush_requested = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        # every change to the game is published here, for anything derived from it such as cached views
+        self.changes = ChangeBus()
+        self.views = ViewCache(self.changes)
+
+    def load(self) -> Game:
+        logger.info(f'Loading game info from {type(self.store).__name__}')
+        start = time.perf_counter()
+        self.game = self.store.load()
+        metrics.observe("bankerbot_state_load_seconds", time.perf_counter() - start, store=type(self.store).__name__)
+        self.changes.publish(None)
+        if self.shared:
+            self.dirty_count = 0
+            self.pending_changes = set()
+            self.pending_ledger_entries = []
+            self._load_ledger([])
+            return self.game
+        self.journal.seq = self.game.journal_seq
+        entries = self.journal.read_entries()
+        replayed = replay(self.game, entries)
+        self.dirty_count = replayed
+        self.pending_changes = None if replayed else set()
+        if replayed:
+            logger.info(f'Replayed {replayed} journal entries on top of the stored game')
+        self._load_ledger(entries)
+        return self.game
+
+    def _load_ledger(self, entries: List[dict]):
+        if self.ledger is None or self.ledger.loaded:
+            return
+        applied = self.ledger.load()
+        if self.ledger.event_count == 0:
+            # a new ledger opens every account at its current assets, journaled changes included
+            self.ledger.journal_seq = self.journal.seq
+        caught_up = self.ledger.catch_up(self.game, entries)
+        self.ledger.open_missing_accounts(self.game)
+        logger.info(f'Loaded ledger with {self.ledger.event_count} events ({applied} since the last checkpoint, '
+                    f'{caught_up} from the journal)')
+
+    def get(self) -> Game:
+        if self.game is None:
+            return self.load()
+        if self.shared and not self._lock.locked():
+            self._refresh()
+        return self.game
+
+    def _refresh(self):
+        # picks up saves made by other processes; a version check is a single indexed read
+        if self.store.get_version() != self.game.version:
+            self.load()
+
+    @contextlib.asynccontextmanager
+    async def transaction(self) -> AsyncIterator[Game]:
+        # mutations run one at a time; reads go through get() and never wait on this lock
+        async with self._lock:
+            if not self.shared:
+                yield self.get()
+                return
+            if self.game is None:
+                self.load()
+            else:
+                self._refresh()
+            try:
+                yield self.game
+            except BaseException:
+                # whatever was half-applied is discarded along with the cached game
+                if self.dirty_count:
+                    self.load()
+                raise
+            self.flush()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def mark_dirty(self, *changes: tuple):
+        # with no change keys the next flush saves the whole game
+        if not changes:
+            self.pending_changes = None
+        elif self.pending_changes is not None:
+            self.pending_changes.update(changes)
+        self.changes.publish(set(changes) if changes else None)
+        self.dirty_count += 1
+        if self.dirty_count >= self.dirty_threshold:
+            self._flush_requested.set()
+
+    def record(self, op: str, **fields):
+        if self.shared:
+            # committed by the surrounding transaction, so there is nothing to replay
+            entry = {"op": op, **fields}
+            self.pending_ledger_entries.append(entry)
+            self.mark_dirty(*entry_changes(self.game, entry))
+            return
+        # journal the mutation durably now; the full snapshot is rewritten later
+        entry = self.journal.append(op, **fields)
+        if self.ledger is not None:
+            self.ledger.record_entry(self.game, entry)
+        self.mark_dirty(*entry_changes(self.get(), entry))
+
+    def record_unjournaled(self, entry: dict):
+        # for changes the caller saves right away, such as bulk imports: the ledger still
+        # sees the asset movements, but there is nothing to replay
+        if self.shared:
+            self.pending_ledger_entries.append(entry)
+        elif self.ledger is not None:
+            self.ledger.record_entry(self.game, entry)
+        self.mark_dirty(*entry_changes(self.game, entry))
+
+    def flush(self):
+        if self.game is None or self.dirty_count == 0:
+            return
+        pending = self.dirty_count
+        changes = self.pending_changes
+        if changes is not None:
+            changes.add(("game",))
+        if self.shared:
+            try:
+                self._save(changes, expected_version=self.game.version)
+            except StaleGameError:
+                # another process got there first: drop this change and start over from its save
+                logger.info(f'Discarded {pending} change(s) made against a stale game')
+                self.load()
+                raise
+            self.dirty_count = 0
+            self.pending_changes = set()
+            if self.ledger is not None:
+                for entry in self.pending_ledger_entries:
+                    self.ledger.record_entry(self.game, entry)
+            self.pending_ledger_entries = []
+            return
+        self.game.journal_seq = self.journal.seq
+        self._save(changes)
+        if self.ledger is not None:
+            # the journal is about to be truncated, so the ledger must not lag behind it
+            self.ledger.sync()
+        # entries up to journal_seq now live in the snapshot and are skipped on replay,
+        # so a crash before this truncate is harmless
+        self.journal.truncate()
+        self.dirty_count = 0
+        self.pending_changes = set()
+        logger.info(f'Wrote game data to {type(self.store).__name__} ({pending} pending change(s))')
+
+    def _save(self, changes: Optional[Set[tuple]], expected_version: Optional[int] = None):
+        store_name = type(self.store).__name__
+        start = time.perf_counter()
+        written = self.store.save(self.game, changes, expected_version=expected_version)
+        metrics.observe("bankerbot_state_save_seconds", time.perf_counter() - start,
+                        store=store_name, mode="full" if changes is None else "partial")
+        if written is not None:
+            metrics.increment("bankerbot_bytes_written_total", written, target="game")
+
+    def start(self):
+        if self._flush_task is None and not self.shared:
+            self._flush_task = asyncio.create_task(self._write_behind())
+
+    async def _write_behind(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                self.flush()
+            except (OSError, sqlite3.Error) as error:
+                # keep the changes marked dirty so the next pass retries the write
+                logger.error(f'Failed to write game data to {type(self.store).__name__}: {error}')
+            except Exception:
+                # anything else, from serialising the game or syncing the ledger, must not end write-behind:
+                # the changes stay dirty and the journal untruncated until a pass succeeds
+                logger.exception(f'Unexpected error writing game data to {type(self.store).__name__}')
+
+    def close_now(self):
+        # for callers that cannot await, such as idle eviction; the flush itself never yields
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self.flush()
+        self.store.close()
+        if self.ledger is not None:
+            self.ledger.close()
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        self.flush()
+        self.store.close()
+        if self.ledger is not None:
+            self.ledger.close()
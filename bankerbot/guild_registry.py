@@ -0,0 +1,152 @@
+#! guild_registry.py
+# the games hosted by one bot process, one per guild, each loaded on first use and evicted once idle
+import asyncio
+import contextlib
+import functools
+import json
+import os
+import time
+from typing import Dict, List, Optional
+from discord import app_commands
+import banker_dom
+import embed_builder
+from bot_config import BotConfig
+from game_state import GameStateService
+from ledger import Ledger
+from logging_manager import logger
+
+
+class UnknownGuildError(app_commands.AppCommandError):
+    pass
+
+
+class GuildConfig:
+    def __init__(self, guild_id: int, player_role_id: int, vote_channel: int, moderator_action_channel: int,
+                 moderator_role_id: int, game_path: str, game_store: str = "json"):
+        self.guild_id = guild_id
+        self.player_role_id = player_role_id
+        self.vote_channel = vote_channel
+        self.moderator_action_channel = moderator_action_channel
+        self.moderator_role_id = moderator_role_id
+        self.game_path = game_path
+        self.game_store = game_store
+
+    @classmethod
+    def from_dict(cls, guild_entry: dict, base_path: str, default_store: str) -> 'GuildConfig':
+        guild_id = int(guild_entry.get("guild_id"))
+        return cls(guild_id=guild_id,
+                   player_role_id=int(guild_entry.get("player_role_id")),
+                   vote_channel=int(guild_entry.get("vote_channel")),
+                   moderator_action_channel=int(guild_entry.get("moderator_action_channel")),
+                   moderator_role_id=int(guild_entry.get("moderator_role_id")),
+                   game_path=guild_entry.get("game_path") or os.path.join(base_path, str(guild_id)),
+                   game_store=guild_entry.get("game_store", default_store))
+
+
+def load_guild_configs(config: BotConfig) -> Dict[int, GuildConfig]:
+    if config.guilds_file is None:
+        # a single game configured from the environment and stored directly in BASE_PATH
+        return {config.guild_id: GuildConfig(config.guild_id, config.player_role_id, config.vote_channel,
+                                             config.moderator_action_channel, config.moderator_role_id,
+                                             config.base_path, config.game_store)}
+    with open(config.guilds_file, 'r', encoding="utf8") as infile:
+        guild_entries = json.load(infile).get("guilds") or []
+    guild_configs = [GuildConfig.from_dict(entry, config.base_path, config.game_store) for entry in guild_entries]
+    return {guild_config.guild_id: guild_config for guild_config in guild_configs}
+
+
+class GameRegistry:
+    def __init__(self, config: BotConfig, guild_configs: Dict[int, GuildConfig]):
+        self.config = config
+        self.guild_configs = guild_configs
+        self.states: Dict[int, GameStateService] = {}
+        self.last_used: Dict[int, float] = {}
+        # commands running against each game; a command may hold on to its state across awaits outside a transaction
+        self.in_use: Dict[int, int] = {}
+        self._evict_task: Optional[asyncio.Task] = None
+
+    def get_guild_config(self, guild_id: Optional[int]) -> GuildConfig:
+        guild_config = self.guild_configs.get(guild_id)
+        if guild_config is None:
+            raise UnknownGuildError(f'Guild {guild_id} is not hosting a game')
+        return guild_config
+
+    def get_state(self, guild_id: Optional[int]) -> GameStateService:
+        state = self.states.get(guild_id)
+        if state is None:
+            state = self.states[guild_id] = self._open(self.get_guild_config(guild_id))
+        self.last_used[guild_id] = time.monotonic()
+        return state
+
+    @contextlib.contextmanager
+    def use(self, guild_id: Optional[int]):
+        self.in_use[guild_id] = self.in_use.get(guild_id, 0) + 1
+        try:
+            yield
+        finally:
+            self.in_use[guild_id] -= 1
+            if not self.in_use[guild_id]:
+                del self.in_use[guild_id]
+
+    def _open(self, guild_config: GuildConfig) -> GameStateService:
+        os.makedirs(guild_config.game_path, exist_ok=True)
+        state = GameStateService(guild_config.game_path,
+                                 store=banker_dom.open_game_store(guild_config.game_path, guild_config.game_store),
+                                 flush_interval=self.config.flush_interval,
+                                 dirty_threshold=self.config.flush_threshold,
+                                 shared=self.config.shared_state,
+                                 ledger=Ledger(guild_config.game_path, self.config.ledger_checkpoint_every))
+        state.load()
+        if embed_builder.seed_board(state.get()):
+            state.mark_dirty(("game",))
+            state.flush()
+        state.start()
+        logger.info(f'Loaded game for guild {guild_config.guild_id} from {guild_config.game_path}')
+        return state
+
+    def start(self):
+        if self._evict_task is None and self.config.game_idle_timeout > 0:
+            self._evict_task = asyncio.create_task(self._evict_loop())
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(min(self.config.game_idle_timeout / 2, 60))
+            self.evict_idle()
+
+    def evict_idle(self) -> List[int]:
+        # a game whose lock is held, or that a running command still uses, stays loaded until the next pass
+        now = time.monotonic()
+        evicted = []
+        for guild_id, state in list(self.states.items()):
+            if (now - self.last_used[guild_id] >= self.config.game_idle_timeout and not state.locked()
+                    and not self.in_use.get(guild_id)):
+                del self.states[guild_id]
+                del self.last_used[guild_id]
+                state.close_now()
+                evicted.append(guild_id)
+                logger.info(f'Evicted idle game for guild {guild_id}')
+        return evicted
+
+    async def close(self):
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            self._evict_task = None
+        for state in self.states.values():
+            await state.close()
+        self.states.clear()
+
+
+def instrument_command(command):
+    # marks the guild's game in use while the callback runs, so idle eviction cannot close it under the command
+    if getattr(command, "_bankerbot_pinned", False):
+        return command
+    callback = command._callback
+
+    @functools.wraps(callback)
+    async def pinned_callback(interaction, *args, **kwargs):
+        with interaction.client.games.use(interaction.guild_id):
+            return await callback(interaction, *args, **kwargs)
+
+    command._callback = pinned_callback
+    command._bankerbot_pinned = True
+    return command
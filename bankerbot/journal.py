@@ -0,0 +1,144 @@
+#! journal.py
+# an append-only log of game mutations, replayed on top of the last stored snapshot
+import json
+import os
+import time
+from typing import List, Set
+from banker_dom import Game, Vote, JobBoard
+import metrics
+
+
+class Journal:
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.seq = 0
+
+    def read_entries(self) -> List[dict]:
+        entries = []
+        if not os.path.exists(self.filepath):
+            return entries
+        valid_length = 0
+        with open(self.filepath, 'rb') as infile:
+            for line in infile:
+                # a crash mid-append leaves a partial final line; everything before it is intact
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                entries.append(entry)
+                valid_length += len(line)
+        if valid_length != os.path.getsize(self.filepath):
+            with open(self.filepath, 'r+b') as outfile:
+                outfile.truncate(valid_length)
+        if entries:
+            self.seq = max(self.seq, entries[-1]["seq"])
+        return entries
+
+    def append(self, op: str, **fields) -> dict:
+        self.seq += 1
+        entry = {"seq": self.seq, "op": op, "time": round(time.time()), **fields}
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf8")
+        with open(self.filepath, 'ab') as outfile:
+            outfile.write(line)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        metrics.increment("bankerbot_bytes_written_total", len(line), target="journal")
+        return entry
+
+    def truncate(self):
+        with open(self.filepath, 'w', encoding="utf8") as outfile:
+            outfile.flush()
+            os.fsync(outfile.fileno())
+
+
+def replay(game: Game, entries: List[dict]) -> int:
+    applied = 0
+    for entry in entries:
+        if entry["seq"] <= game.journal_seq:
+            continue
+        apply_entry(game, entry)
+        game.journal_seq = entry["seq"]
+        applied += 1
+    return applied
+
+
+def apply_entry(game: Game, entry: dict):
+    op = entry["op"]
+    if op == "deposit":
+        player = game.get_player(entry["player_id"])
+        faction = game.get_faction_of_player(entry["player_id"])
+        player.set_assets(player.assets - entry["amount"])
+        faction.set_assets(faction.assets + entry["amount"])
+    elif op == "withdraw":
+        player = game.get_player(entry["player_id"])
+        faction = game.get_faction_of_player(entry["player_id"])
+        player.daily_withdraw_available = False
+        faction.set_assets(faction.assets - entry["amount"])
+        player.set_assets(player.assets + entry["amount"])
+    elif op == "transfer":
+        sender = game.get_player(entry["sender_id"])
+        receiver = game.get_player(entry["receiver_id"])
+        sender.set_assets(sender.assets - entry["amount"])
+        receiver.set_assets(receiver.assets + entry["amount"])
+    elif op == "day_action":
+        player = game.get_player(entry["player_id"])
+        player.set_assets(player.assets - entry["cost"])
+    elif op == "vote":
+        a_round = game.get_round(entry["round_number"])
+        existing_vote = a_round.get_player_vote(entry["player_id"])
+        if existing_vote is None:
+            a_round.add_vote(Vote(entry["player_id"], entry["choice"], entry["timestamp"]))
+        else:
+            a_round.change_vote(existing_vote, entry["choice"], entry["timestamp"])
+        a_round.record_vote_event(entry["player_id"], entry["choice"], entry["timestamp"])
+    elif op == "unvote":
+        a_round = game.get_round(entry["round_number"])
+        existing_vote = a_round.get_player_vote(entry["player_id"])
+        if existing_vote is not None:
+            a_round.remove_vote(existing_vote)
+        # entries journaled before unvotes carried a timestamp fall back to the time they were written
+        a_round.record_vote_event(entry["player_id"], None, entry.get("timestamp", entry["time"]))
+    elif op == "kill":
+        game.set_player_dead(game.get_player(entry["player_id"]), entry["dead"])
+    elif op == "incarcerate":
+        game.get_player(entry["player_id"]).is_incarcerated = entry["incarcerated"]
+    elif op == "adjust":
+        if entry["account_type"] == "player":
+            account = game.get_player(entry["account"])
+        else:
+            account = game.get_faction(entry["account"])
+        account.set_assets(account.assets + entry["amount"])
+    elif op == "settlement_owner":
+        _, settlement = game.get_settlement(entry["settlement"])
+        settlement.owner = entry["owner"]
+        settlement.owner_icon = entry["owner_icon"]
+    elif op == "job_board":
+        game.job_board = JobBoard(entry["title"], [])
+    elif op == "set_job":
+        game.job_board.set_job(entry["number"], entry["description"])
+    elif op == "remove_job":
+        game.job_board.remove_job(entry["number"])
+    else:
+        raise ValueError(f'Unknown journal operation {op}')
+
+
+def entry_changes(game: Game, entry: dict) -> Set[tuple]:
+    # the store change keys touched by a journal entry, see banker_dom.GameStore
+    op = entry["op"]
+    if op in ("deposit", "withdraw"):
+        faction = game.get_faction_of_player(entry["player_id"])
+        return {("player", entry["player_id"]), ("faction", faction.faction_name)}
+    elif op == "transfer":
+        return {("player", entry["sender_id"]), ("player", entry["receiver_id"])}
+    elif op in ("day_action", "kill", "incarcerate"):
+        return {("player", entry["player_id"])}
+    elif op == "adjust":
+        return {(entry["account_type"], entry["account"])}
+    elif op in ("vote", "unvote"):
+        return {("vote", entry["round_number"], entry["player_id"]), ("vote_history", entry["round_number"])}
+    elif op in ("settlement_owner", "job_board", "set_job", "remove_job"):
+        # the board is stored with the game-level fields
+        return {("game",)}
+    raise ValueError(f'Unknown journal operation {op}')
@@ -0,0 +1,198 @@
+#! ledger.py
+# an append-only record of every asset movement, with balances materialized from it.
+# Unlike the journal it is never truncated; checkpoints keep rebuilding the balances cheap
+import json
+import os
+import tempfile
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from banker_dom import Game
+import metrics
+
+# (account, change in assets) pairs; every event's postings describe one movement
+Posting = Tuple[str, int]
+
+EVENT_TYPES = ("opening", "deposit", "withdraw", "transfer", "action_cost", "adjustment")
+
+
+def player_account(player_id: int) -> str:
+    return f"player:{player_id}"
+
+
+def faction_account(faction_name: str) -> str:
+    return f"faction:{faction_name}"
+
+
+class Ledger:
+    def __init__(self, path: str, checkpoint_every: int = 500):
+        self.filepath = os.path.join(path, "ledger.jsonl")
+        self.checkpoint_path = os.path.join(path, "ledger.checkpoint.json")
+        self.checkpoint_every = checkpoint_every
+        self.balances: Dict[str, int] = {}
+        self.event_count = 0
+        # the last journal entry already in the ledger, so replayed entries are not posted twice
+        self.journal_seq = 0
+        self.loaded = False
+        self._since_checkpoint = 0
+        # bytes of the ledger file already applied to the balances
+        self._offset = 0
+        self._file = None
+
+    def load(self) -> int:
+        # starts from the last checkpoint and applies only the events written after it
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, 'r', encoding="utf8") as infile:
+                checkpoint = json.load(infile)
+            self._offset = checkpoint["offset"]
+            self.balances = checkpoint["balances"]
+            self.event_count = checkpoint["event_count"]
+            self.journal_seq = checkpoint["journal_seq"]
+
+        applied = self.refresh()
+        # as with the journal, a crash mid-append can only leave a partial final line
+        if os.path.exists(self.filepath) and os.path.getsize(self.filepath) != self._offset:
+            with open(self.filepath, 'r+b') as outfile:
+                outfile.truncate(self._offset)
+
+        self._file = open(self.filepath, 'a', encoding="utf8")
+        self._since_checkpoint = applied
+        self.loaded = True
+        return applied
+
+    def refresh(self) -> int:
+        # applies complete events past what has been read so far, including any other process appended
+        if not os.path.exists(self.filepath):
+            return 0
+        applied = 0
+        with open(self.filepath, 'rb') as infile:
+            infile.seek(self._offset)
+            for line in infile:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    break
+                self._apply(event)
+                self._offset += len(line)
+                applied += 1
+        return applied
+
+    def _apply(self, event: dict):
+        for account, amount in event["postings"]:
+            self.balances[account] = self.balances.get(account, 0) + amount
+        self.event_count += 1
+        if event.get("journal_seq") is not None:
+            self.journal_seq = max(self.journal_seq, event["journal_seq"])
+
+    def append(self, event_type: str, postings: List[Posting], journal_seq: Optional[int] = None, **details) -> dict:
+        # written through to the OS right away, and fsynced by sync() before the journal is truncated
+        event = {"time": round(time.time()), "type": event_type, "postings": postings,
+                 "journal_seq": journal_seq, **details}
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        self._file.write(line)
+        self._file.flush()
+        metrics.increment("bankerbot_bytes_written_total", len(line.encode("utf8")), target="ledger")
+        # read back rather than applied directly, so events appended by other processes sharing
+        # the file are picked up in file order
+        self.refresh()
+        self._since_checkpoint += 1
+        if self._since_checkpoint >= self.checkpoint_every:
+            self.checkpoint()
+        return event
+
+    def record_entry(self, game: Game, entry: dict) -> Optional[dict]:
+        # posts the asset movement of a journal entry; entries that move no assets are ignored
+        seq = entry.get("seq")
+        if seq is not None and seq <= self.journal_seq:
+            return None
+        op = entry["op"]
+        if op == "deposit":
+            faction = game.get_faction_of_player(entry["player_id"])
+            postings = [(player_account(entry["player_id"]), -entry["amount"]),
+                        (faction_account(faction.faction_name), entry["amount"])]
+            return self.append("deposit", postings, seq)
+        elif op == "withdraw":
+            faction = game.get_faction_of_player(entry["player_id"])
+            postings = [(faction_account(faction.faction_name), -entry["amount"]),
+                        (player_account(entry["player_id"]), entry["amount"])]
+            return self.append("withdraw", postings, seq)
+        elif op == "transfer":
+            postings = [(player_account(entry["sender_id"]), -entry["amount"]),
+                        (player_account(entry["receiver_id"]), entry["amount"])]
+            return self.append("transfer", postings, seq)
+        elif op == "day_action":
+            return self.append("action_cost", [(player_account(entry["player_id"]), -entry["cost"])], seq)
+        elif op == "adjust":
+            account = (player_account(entry["account"]) if entry["account_type"] == "player"
+                       else faction_account(entry["account"]))
+            return self.append("adjustment", [(account, entry["amount"])], seq, reason=entry["reason"])
+        return None
+
+    def catch_up(self, game: Game, entries: List[dict]) -> int:
+        return sum(1 for entry in entries if self.record_entry(game, entry) is not None)
+
+    def open_missing_accounts(self, game: Game) -> Optional[dict]:
+        # players and factions the ledger has not seen yet start from their current assets
+        postings = [(player_account(player.player_id), player.assets) for player in game.players
+                    if player_account(player.player_id) not in self.balances]
+        postings += [(faction_account(faction.faction_name), faction.assets) for faction in game.factions
+                     if faction_account(faction.faction_name) not in self.balances]
+        if not postings:
+            return None
+        return self.append("opening", postings)
+
+    def audit(self, game: Game) -> List[str]:
+        self.refresh()
+        mismatches = []
+        for player in game.players:
+            balance = self.balances.get(player_account(player.player_id))
+            if balance != player.assets:
+                mismatches.append(f'{player.player_discord_name}: ledger {balance}, game {player.assets}')
+        for faction in game.factions:
+            balance = self.balances.get(faction_account(faction.faction_name))
+            if balance != faction.assets:
+                mismatches.append(f'{faction.faction_name}: ledger {balance}, game {faction.assets}')
+        return mismatches
+
+    def history(self, account: str, limit: int = 10) -> List[dict]:
+        # a full scan, meant for the occasional dispute rather than the command hot path
+        events = deque(maxlen=limit)
+        with open(self.filepath, 'r', encoding="utf8") as infile:
+            for line in infile:
+                event = json.loads(line)
+                if any(posting_account == account for posting_account, _ in event["postings"]):
+                    events.append(event)
+        return list(events)
+
+    def sync(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def checkpoint(self):
+        self.sync()
+        checkpoint = {"offset": self._offset,
+                      "event_count": self.event_count,
+                      "journal_seq": self.journal_seq,
+                      "balances": self.balances}
+        directory = os.path.dirname(os.path.abspath(self.checkpoint_path))
+        fd, temp_path = tempfile.mkstemp(prefix=".ledger-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding="utf8") as outfile:
+                json.dump(checkpoint, outfile, ensure_ascii=False)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            os.replace(temp_path, self.checkpoint_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._since_checkpoint = 0
+
+    def close(self):
+        if self._file is not None:
+            self.checkpoint()
+            self._file.close()
+            self._file = None
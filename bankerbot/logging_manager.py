@@ -2,17 +2,46 @@
 # a class for managing logging across modules
 
 import os
+import json
+import atexit
+import queue
 import logging
-from logging.handlers import TimedRotatingFileHandler
-from dotenv import load_dotenv
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
+from typing import Optional
 
-load_dotenv()
-BASE_PATH = os.getenv('BASE_PATH')
 
-def create_logger(path):
+class DroppingQueueHandler(QueueHandler):
+    # never blocks the caller: when the listener falls behind, records are counted and dropped
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"time": self.formatTime(record, self.datefmt),
+                 "level": record.levelname,
+                 "message": record.getMessage()}
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+queue_handler: Optional[DroppingQueueHandler] = None
+listener: Optional[QueueListener] = None
+
+
+def create_logger(path, log_format: str = 'text', queue_size: int = 10000, file_name: str = "bankerbot_log.txt"):
+    global queue_handler, listener
     created_logger = logging.getLogger('bankerbot_logger')
 
-    file_path = os.path.join(path, "bankerbot_log.txt")
+    file_path = os.path.join(path, file_name)
 
     handler = TimedRotatingFileHandler(file_path,
                                        when="d",
@@ -20,18 +49,45 @@ def create_logger(path):
                                        backupCount=15)
     fmt = '[%(asctime)s] [%(levelname)s] - %(message)s'
     formatter = logging.Formatter(fmt=fmt, datefmt='%Y%m%d %H:%M:%S')
-    handler.setFormatter(formatter)
+    if log_format == 'json':
+        handler.setFormatter(JsonLinesFormatter(datefmt='%Y%m%d %H:%M:%S'))
+    else:
+        handler.setFormatter(formatter)
     handler.setLevel(logging.INFO)
 
     console = logging.StreamHandler()
     console.setFormatter(formatter)
     console.setLevel(logging.INFO)
 
-    created_logger.addHandler(handler)
-    created_logger.addHandler(console)
+    # the file and console writes (including rollover) happen on the listener's thread,
+    # so logging from the event loop only costs a queue put
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    listener = QueueListener(queue_handler.queue, handler, console, respect_handler_level=True)
+    listener.start()
+    atexit.register(stop_logging)
+
+    created_logger.addHandler(queue_handler)
     created_logger.setLevel(logging.INFO)
 
     return created_logger
 
 
-logger = create_logger(BASE_PATH)
+def stop_logging():
+    # drains any queued records before returning
+    global listener
+    if listener is not None:
+        listener.stop()
+        listener = None
+
+
+def get_dropped_count() -> int:
+    return 0 if queue_handler is None else queue_handler.dropped
+
+
+def get_queue_depth() -> int:
+    return 0 if queue_handler is None else queue_handler.queue.qsize()
+
+
+# handlers are only attached once create_logger is called from the bot's entry point,
+# so importing this module never opens the log file
+logger = logging.getLogger('bankerbot_logger')
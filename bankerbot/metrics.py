@@ -0,0 +1,241 @@
+#! metrics.py
+# in-process counters and latency histograms for commands, game state I/O and Discord API calls,
+# exposed as Prometheus text on a local port and summarised by /bot-stats
+import asyncio
+import bisect
+import contextvars
+import functools
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from logging_manager import logger
+
+# seconds; the last bucket is implicitly +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# the command whose callback is running, so Discord API calls made on its behalf are attributed to it.
+# Tasks copy the context they were created in, so background workers reset it for themselves
+current_command: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_command", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        # interpolated within the bucket the rank falls in, as Prometheus' histogram_quantile does
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.started = time.time()
+        self.descriptions: Dict[str, Tuple[str, str]] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        # gauges are read when the metrics are rendered rather than kept up to date
+        self.gauges: Dict[str, Callable[[], Dict[Labels, float]]] = {}
+
+    def describe(self, name: str, kind: str, description: str):
+        self.descriptions[name] = (kind, description)
+
+    def increment(self, name: str, amount: float = 1, **labels: str):
+        series = self.counters.setdefault(name, {})
+        key = label_key(labels)
+        series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: str):
+        series = self.histograms.setdefault(name, {})
+        key = label_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def gauge(self, name: str, description: str, collect: Callable[[], Dict[Labels, float]]):
+        self.describe(name, "gauge", description)
+        self.gauges[name] = collect
+
+    def counter_total(self, name: str, **labels: str) -> float:
+        # the sum over every series whose labels include the given ones
+        wanted = set(label_key(labels))
+        return sum(value for key, value in self.counters.get(name, {}).items() if wanted <= set(key))
+
+    def merged_histogram(self, name: str, **labels: str) -> Histogram:
+        wanted = set(label_key(labels))
+        merged = Histogram()
+        for key, histogram in self.histograms.get(name, {}).items():
+            if wanted <= set(key):
+                merged.counts = [a + b for a, b in zip(merged.counts, histogram.counts)]
+                merged.count += histogram.count
+                merged.sum += histogram.sum
+        return merged
+
+    def label_values(self, name: str, label: str) -> List[str]:
+        series = {**self.counters.get(name, {}), **self.histograms.get(name, {})}
+        return sorted({dict(key)[label] for key in series if label in dict(key)})
+
+    def render(self) -> str:
+        lines = []
+        for name in sorted({*self.counters, *self.histograms, *self.gauges}):
+            kind, description = self.descriptions.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            if name in self.gauges:
+                try:
+                    gauge_values = self.gauges[name]()
+                except Exception as error:
+                    logger.error(f'Failed to collect gauge {name}: {error}')
+                    gauge_values = {}
+                for key, value in sorted(gauge_values.items()):
+                    lines.append(f"{name}{format_labels(key)} {value}")
+            for key, value in sorted(self.counters.get(name, {}).items()):
+                lines.append(f"{name}{format_labels(key)} {value}")
+            for key, histogram in sorted(self.histograms.get(name, {}).items()):
+                cumulative = 0
+                for bound, bucket_count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(key)} {histogram.sum}")
+                lines.append(f"{name}_count{format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def label_key(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key: Labels) -> str:
+    if not key:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in key)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(key, escaped)) + "}"
+
+
+registry = MetricsRegistry()
+registry.describe("bankerbot_command_seconds", "histogram", "Time spent in command callbacks")
+registry.describe("bankerbot_autocomplete_seconds", "histogram", "Time spent in autocomplete callbacks")
+registry.describe("bankerbot_cooldown_rejections_total", "counter", "Commands rejected by a cooldown")
+registry.describe("bankerbot_state_load_seconds", "histogram", "Time spent loading a game from its store")
+registry.describe("bankerbot_state_save_seconds", "histogram", "Time spent saving a game to its store")
+registry.describe("bankerbot_bytes_written_total", "counter", "Bytes written to game files, the journal and the ledger")
+registry.describe("bankerbot_discord_api_calls_total", "counter", "Discord API requests, by the command that made them")
+registry.describe("bankerbot_outbound_send_failures_total", "counter", "Queued messages that could not be sent")
+registry.describe("bankerbot_discord_api_seconds", "histogram", "Time spent waiting on Discord API requests")
+
+
+def increment(name: str, amount: float = 1, **labels: str):
+    registry.increment(name, amount, **labels)
+
+
+def observe(name: str, value: float, **labels: str):
+    registry.observe(name, value, **labels)
+
+
+def instrument_command(command):
+    # swaps the callback of an app command, and of its autocompletes, for timed wrappers.
+    # The parameters were already read off the original signature, so discord.py is none the wiser
+    if getattr(command, "_bankerbot_timed", False):
+        return command
+    callback = command._callback
+
+    @functools.wraps(callback)
+    async def timed_callback(*args, **kwargs):
+        token = current_command.set(command.name)
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await callback(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            observe("bankerbot_command_seconds", time.perf_counter() - start, command=command.name, outcome=outcome)
+            current_command.reset(token)
+
+    command._callback = timed_callback
+    for parameter in command._params.values():
+        if parameter.autocomplete is not None:
+            parameter.autocomplete = timed_autocomplete(command.name, parameter.name, parameter.autocomplete)
+    command._bankerbot_timed = True
+    return command
+
+
+def timed_autocomplete(command_name: str, parameter_name: str, autocomplete):
+    # functools.wraps carries over the binding flag discord.py set on the original
+    @functools.wraps(autocomplete)
+    async def timed(*args):
+        token = current_command.set(command_name)
+        start = time.perf_counter()
+        try:
+            return await autocomplete(*args)
+        finally:
+            observe("bankerbot_autocomplete_seconds", time.perf_counter() - start,
+                    command=command_name, parameter=parameter_name)
+            current_command.reset(token)
+
+    return timed
+
+
+def instrument_requests(requester):
+    # counts and times the requests of a discord.py HTTPClient or webhook adapter; both take the route first
+    if getattr(requester, "_bankerbot_instrumented", False):
+        return
+    request = requester.request
+
+    async def timed_request(route, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await request(route, *args, **kwargs)
+        finally:
+            observe("bankerbot_discord_api_seconds", time.perf_counter() - start,
+                    method=route.method, route=route.path)
+            increment("bankerbot_discord_api_calls_total", command=current_command.get() or "none",
+                      method=route.method, route=route.path)
+
+    requester.request = timed_request
+    requester._bankerbot_instrumented = True
+
+
+async def handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while (header := await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] in (b"/", b"/metrics"):
+            status, body = "200 OK", registry.render().encode("utf8")
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host: str, port: int) -> asyncio.AbstractServer:
+    server = await asyncio.start_server(handle_scrape, host, port)
+    logger.info(f'Serving metrics on http://{host}:{port}/metrics')
+    return server
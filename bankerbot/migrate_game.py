@@ -0,0 +1,30 @@
+#! migrate_game.py
+# imports an existing game.json (plus any pending game.journal entries) into a SQLite game store
+import argparse
+import os
+import banker_dom
+from journal import Journal, replay
+
+
+def migrate(json_path: str, db_path: str) -> banker_dom.Game:
+    game = banker_dom.read_json_to_dom(json_path)
+    journal_path = os.path.join(os.path.dirname(os.path.abspath(json_path)), "game.journal")
+    replay(game, Journal(journal_path).read_entries())
+
+    store = banker_dom.SqliteGameStore(db_path)
+    try:
+        store.save(game)
+    finally:
+        store.close()
+    return game
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a bankerbot game.json into a SQLite game store")
+    parser.add_argument("json_path", help="path to the existing game.json")
+    parser.add_argument("db_path", help="path of the game.db to create or overwrite")
+    args = parser.parse_args()
+
+    migrated_game = migrate(args.json_path, args.db_path)
+    print(f"Imported {len(migrated_game.players)} players, {len(migrated_game.factions)} factions "
+          f"and {len(migrated_game.rounds)} rounds into {args.db_path}")
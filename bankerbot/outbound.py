@@ -0,0 +1,138 @@
+#! outbound.py
+# per-channel queues for messages the bot posts on its own (announcements, moderator pings, embeds),
+# so command handlers can enqueue them and answer their interaction without waiting on Discord
+import asyncio
+import time
+from typing import Dict, List, Optional
+import discord
+from logging_manager import logger
+import metrics
+
+MAX_MESSAGE_LENGTH = 2000
+
+
+class RateLimitBucket:
+    # a token bucket matching Discord's per-channel message limit (5 messages every 5 seconds by default)
+    def __init__(self, rate: int = 5, per: float = 5.0):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def acquire_delay(self) -> float:
+        # takes a token and returns 0, or returns how long to wait until one is available
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) * self.per / self.rate
+
+
+class OutboundMessage:
+    def __init__(self, content: Optional[str], batchable: bool, kwargs: dict):
+        self.content = content
+        self.batchable = batchable
+        self.kwargs = kwargs
+
+
+def pack_contents(contents: List[str], limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    # joins announcements line by line into as few messages as fit within Discord's length limit
+    packed = []
+    current = ""
+    for content in contents:
+        if current and len(current) + 1 + len(content) > limit:
+            packed.append(current)
+            current = ""
+        current = f"{current}\n{content}" if current else content
+    if current:
+        packed.append(current)
+    return packed
+
+
+class OutboundDispatcher:
+    def __init__(self, batch_window: float = 1.0, rate: int = 5, per: float = 5.0):
+        self.batch_window = batch_window
+        self.rate = rate
+        self.per = per
+        self.sent_count = 0
+        self.batched_count = 0
+        self._queues: Dict[int, asyncio.Queue] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._buckets: Dict[int, RateLimitBucket] = {}
+
+    def enqueue(self, channel: discord.abc.Messageable, content: Optional[str] = None, batch: bool = False,
+                **kwargs):
+        # batch=True lets plain-text announcements that arrive within batch_window share one message
+        channel_queue = self._queues.get(channel.id)
+        if channel_queue is None:
+            channel_queue = self._queues[channel.id] = asyncio.Queue()
+            self._buckets[channel.id] = RateLimitBucket(self.rate, self.per)
+            self._workers[channel.id] = asyncio.create_task(self._run_channel(channel, channel_queue))
+        elif self._workers[channel.id].done():
+            # a worker that died would leave its queue to grow forever, so a new one takes over the backlog
+            logger.error(f'Outbound worker for channel {channel.id} had stopped, restarting it')
+            self._workers[channel.id] = asyncio.create_task(self._run_channel(channel, channel_queue))
+        channel_queue.put_nowait(OutboundMessage(content, batch and not kwargs, kwargs))
+
+    def queue_depths(self) -> Dict[int, int]:
+        return {channel_id: channel_queue.qsize() for channel_id, channel_queue in self._queues.items()}
+
+    async def _run_channel(self, channel: discord.abc.Messageable, channel_queue: asyncio.Queue):
+        # the worker outlives the command that started it, so its sends are counted as the dispatcher's own
+        metrics.current_command.set("outbound")
+        bucket = self._buckets[channel.id]
+        carried: Optional[OutboundMessage] = None
+        while True:
+            message = carried if carried is not None else await channel_queue.get()
+            carried = None
+            batch = [message]
+            if message.batchable:
+                deadline = time.monotonic() + self.batch_window
+                while (remaining := deadline - time.monotonic()) > 0:
+                    try:
+                        next_message = await asyncio.wait_for(channel_queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    if not next_message.batchable:
+                        # keep ordering: post what has been batched so far, then this one
+                        carried = next_message
+                        break
+                    batch.append(next_message)
+
+            if message.batchable:
+                self.batched_count += len(batch)
+                outgoing = [OutboundMessage(content, True, {}) for content in pack_contents([m.content for m in batch])]
+            else:
+                outgoing = batch
+            for outbound_message in outgoing:
+                await self._send(channel, bucket, outbound_message)
+            for _ in batch:
+                channel_queue.task_done()
+
+    async def _send(self, channel: discord.abc.Messageable, bucket: RateLimitBucket, message: OutboundMessage):
+        while (delay := bucket.acquire_delay()) > 0:
+            await asyncio.sleep(delay)
+        try:
+            await channel.send(message.content, **message.kwargs)
+            self.sent_count += 1
+        except discord.HTTPException as error:
+            metrics.increment("bankerbot_outbound_send_failures_total", error=type(error).__name__)
+            logger.error(f'Failed to send queued message to channel {channel.id}: {error}')
+        except Exception as error:
+            # anything else would end the worker and strand the rest of the channel's queue
+            metrics.increment("bankerbot_outbound_send_failures_total", error=type(error).__name__)
+            logger.exception(f'Unexpected error sending queued message to channel {channel.id}: {error}')
+
+    async def close(self, timeout: float = 10.0):
+        # give queued messages a chance to go out before shutting the workers down
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues.values())), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f'Dropped {sum(self.queue_depths().values())} queued outbound message(s) on shutdown')
+        for worker in self._workers.values():
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
+        self._queues.clear()
@@ -0,0 +1,177 @@
+#! phase_scheduler.py
+# runs the withdrawal refresh and round transitions at the times moderators schedule, instead of waiting
+# for someone to type the command. The schedule is stored with each game, so missed ticks are caught up
+import asyncio
+import calendar
+import json
+import os
+import re
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+from banker_dom import Game, ScheduledPhase, StaleGameError
+from logging_manager import logger
+
+DAY_SECONDS = 86400
+
+# when a game next has a phase due, kept next to the game so startup can tell which games to load
+NEXT_DUE_FILE = "next_phase.json"
+
+TIME_OF_DAY_PATTERN = re.compile(r'^([01]?\d|2[0-3]):([0-5]\d)$')
+
+
+def parse_time_of_day(time_of_day: str) -> Optional[str]:
+    # normalised to "HH:MM", or None when it is not a valid time
+    match = TIME_OF_DAY_PATTERN.match(time_of_day.strip())
+    if match is None:
+        return None
+    return f"{int(match.group(1)):02d}:{match.group(2)}"
+
+
+def next_occurrence(time_of_day: str, after: int) -> int:
+    # the first time after the given timestamp that the UTC clock reads time_of_day
+    hours, minutes = (int(part) for part in time_of_day.split(":"))
+    day = time.gmtime(after)
+    candidate = calendar.timegm((day.tm_year, day.tm_mon, day.tm_mday, hours, minutes, 0))
+    return candidate if candidate > after else candidate + DAY_SECONDS
+
+
+def latest_missed_tick(entry: ScheduledPhase, now: int) -> int:
+    period = entry.every_days * DAY_SECONDS
+    return entry.next_run + (now - entry.next_run) // period * period
+
+
+def next_tick_after(entry: ScheduledPhase, now: int) -> int:
+    return latest_missed_tick(entry, now) + entry.every_days * DAY_SECONDS
+
+
+def run_phase(game: Game, phase: str) -> str:
+    if phase == "refresh_withdrawals":
+        game.refresh_withdrawals()
+        return f'Refreshed the daily withdrawal allowance for all players'
+    elif phase == "start_round":
+        new_round = game.start_round()
+        if new_round is None:
+            return f'Did not start a new round, round {game.get_latest_round().round_number} is still active'
+        return f'Started round {new_round.round_number}'
+    elif phase == "end_round":
+        ended_round = game.end_round()
+        if ended_round is None:
+            return f'Did not end a round, there is no active round'
+        return f'Ended round {ended_round.round_number}'
+    raise ValueError(f'Unknown phase {phase}')
+
+
+def apply_due_phases(game: Game, now: int) -> List[str]:
+    # a phase that missed several ticks runs once, not once per tick. Due phases run in the order of their
+    # latest missed ticks, so an end_round at 23:00 still comes before a start_round at 00:00
+    due = sorted((entry for entry in game.schedule if entry.next_run <= now),
+                 key=lambda entry: latest_missed_tick(entry, now))
+    messages = []
+    for entry in due:
+        messages.append(run_phase(game, entry.phase))
+        entry.next_run = next_tick_after(entry, now)
+    game.schedule.sort(key=lambda entry: entry.next_run)
+    return messages
+
+
+def next_due(game: Game) -> Optional[int]:
+    return min((entry.next_run for entry in game.schedule), default=None)
+
+
+def read_next_due(game_path: str) -> Optional[int]:
+    # raises FileNotFoundError for a game whose schedule has not been checked since the file was introduced
+    with open(os.path.join(game_path, NEXT_DUE_FILE), 'r', encoding="utf8") as infile:
+        return json.load(infile)["next_due"]
+
+
+def write_next_due(game_path: str, due: Optional[int]):
+    fd, temp_path = tempfile.mkstemp(prefix=".next_phase-", suffix=".tmp", dir=game_path)
+    try:
+        with os.fdopen(fd, 'w', encoding="utf8") as outfile:
+            json.dump({"next_due": due}, outfile)
+        os.replace(temp_path, os.path.join(game_path, NEXT_DUE_FILE))
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class PhaseScheduler:
+    def __init__(self, registry, announce: Callable[[int, str], None], tick_interval: float = 30.0):
+        self.registry = registry
+        # called with the guild id and a message for each phase that ran
+        self.announce = announce
+        self.tick_interval = tick_interval
+        # when each game next has a phase due, so idle games are only loaded again when one is
+        self.next_due: Dict[int, Optional[int]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def reschedule(self, guild_id: int, game: Game):
+        # called after the game is saved, so the stored time is never later than the game's own schedule
+        due = self.next_due[guild_id] = next_due(game)
+        try:
+            write_next_due(self.registry.get_guild_config(guild_id).game_path, due)
+        except OSError as error:
+            logger.error(f'Failed to store the next scheduled phase for guild {guild_id}: {error}')
+
+    async def _run(self):
+        # at startup only the stored due times are read, so games stay unloaded until a phase is due.
+        # The first check catches up ticks missed while the bot was down
+        for guild_id, guild_config in list(self.registry.guild_configs.items()):
+            try:
+                self.next_due[guild_id] = read_next_due(guild_config.game_path)
+            except FileNotFoundError:
+                # checked once by loading the game, which stores its due time for the next startup
+                await self.run_guarded(guild_id)
+            except (OSError, ValueError, KeyError, TypeError) as error:
+                logger.error(f'Failed to read the next scheduled phase for guild {guild_id}, loading the game: {error}')
+                await self.run_guarded(guild_id)
+        while True:
+            now = time.time()
+            for guild_id, due in list(self.next_due.items()):
+                if due is not None and due <= now:
+                    await self.run_guarded(guild_id)
+            await asyncio.sleep(self.tick_interval)
+
+    async def run_guarded(self, guild_id: int):
+        # one game's bad state must not end the task that schedules every other game's phases
+        try:
+            await self.run_due(guild_id)
+        except Exception:
+            logger.exception(f'Scheduled phases for guild {guild_id} failed, retrying on the next tick')
+
+    async def run_due(self, guild_id: int) -> List[str]:
+        # all the phases due for a game are applied in one transaction, with a single save
+        try:
+            state = self.registry.get_state(guild_id)
+            async with state.transaction() as game:
+                messages = apply_due_phases(game, int(time.time()))
+                if messages:
+                    state.mark_dirty()
+                    state.flush()
+                self.reschedule(guild_id, game)
+        except StaleGameError:
+            # another process changed the game first; its save is picked up on the next tick
+            logger.info(f'Scheduled phases for guild {guild_id} lost a race, retrying on the next tick')
+            return []
+        except (OSError, ValueError) as error:
+            logger.error(f'Failed to run scheduled phases for guild {guild_id}: {error}')
+            return []
+        for message in messages:
+            logger.info(f'Scheduled phase for guild {guild_id}: {message}')
+            self.announce(guild_id, message)
+        return messages
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,152 @@
+#! profiling.py
+# opt-in profiles of single command invocations, chosen by command name or by latency,
+# dumped to BASE_PATH/profiles as pstats and as collapsed stacks for flamegraph tools
+import cProfile
+import functools
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import List, Optional
+from logging_manager import logger
+from outbound import RateLimitBucket
+
+PROFILE_MODES = ("cprofile", "sampling")
+
+
+def collapse_stack(frame) -> str:
+    # root first, in the "a;b;c" form flamegraph.pl and speedscope read
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class StackSampler(threading.Thread):
+    # samples the event loop thread's stack from the side, so the profiled code pays almost nothing.
+    # Time the loop spends waiting on Discord shows up as samples in the selector
+    def __init__(self, thread_id: int, interval: float):
+        super().__init__(name="bankerbot-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[collapse_stack(frame)] += 1
+
+    def stop(self) -> Counter:
+        self._stopped.set()
+        self.join()
+        return self.samples
+
+
+class ProfileSession:
+    def __init__(self, mode: str, sample_interval: float):
+        self.sampler = StackSampler(threading.get_ident(), sample_interval)
+        self.profile = cProfile.Profile() if mode == "cprofile" else None
+
+    def start(self):
+        self.sampler.start()
+        if self.profile is not None:
+            try:
+                self.profile.enable()
+            except ValueError:
+                # another profiler, such as a debugger's, is already installed
+                self.profile = None
+
+    def stop(self) -> Counter:
+        if self.profile is not None:
+            self.profile.disable()
+        return self.sampler.stop()
+
+
+class CommandProfiler:
+    def __init__(self, path: str, commands: List[str], threshold: Optional[float] = None, mode: str = "cprofile",
+                 sample_interval: float = 0.005, max_per_hour: int = 10):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f'Unknown profile mode {mode}, expected one of {", ".join(PROFILE_MODES)}')
+        self.path = os.path.join(path, "profiles")
+        self.commands = set(commands)
+        # seconds; invocations at least this slow are dumped whatever their command
+        self.threshold = threshold
+        self.mode = mode
+        self.sample_interval = sample_interval
+        self.bucket = RateLimitBucket(max_per_hour, 3600.0)
+        self.dumped_count = 0
+        self.skipped_count = 0
+        self._active: Optional[ProfileSession] = None
+
+    def wants(self, command_name: str) -> bool:
+        return self.threshold is not None or "*" in self.commands or command_name in self.commands
+
+    async def run(self, command_name: str, call):
+        # commands interleave on the event loop, so only one invocation is profiled at a time;
+        # anything else running meanwhile still shows up in its profile
+        if self._active is not None or not self.wants(command_name):
+            return await call()
+        session = self._active = ProfileSession(self.mode, self.sample_interval)
+        session.start()
+        start = time.perf_counter()
+        try:
+            return await call()
+        finally:
+            elapsed = time.perf_counter() - start
+            samples = session.stop()
+            self._active = None
+            selected = "*" in self.commands or command_name in self.commands
+            if selected or elapsed >= self.threshold:
+                if self.bucket.acquire_delay() == 0:
+                    self._dump(command_name, elapsed, session, samples)
+                else:
+                    self.skipped_count += 1
+
+    def _dump(self, command_name: str, elapsed: float, session: ProfileSession, samples: Counter):
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            base_name = os.path.join(self.path, f"{time.strftime('%Y%m%d-%H%M%S')}-"
+                                                f"{re.sub(r'[^A-Za-z0-9_-]', '_', command_name)}-{elapsed * 1000:.0f}ms")
+            if session.profile is not None:
+                session.profile.dump_stats(f"{base_name}.pstats")
+            with open(f"{base_name}.collapsed", 'w', encoding="utf8") as outfile:
+                for stack, count in samples.most_common():
+                    outfile.write(f"{stack} {count}\n")
+        except OSError as error:
+            logger.error(f'Failed to write the profile of {command_name}: {error}')
+            return
+        self.dumped_count += 1
+        logger.info(f'Profiled {command_name} ({elapsed * 1000:.0f}ms, {sum(samples.values())} samples) to {base_name}')
+
+
+def create_profiler(config) -> Optional[CommandProfiler]:
+    if not config.profile_commands and config.profile_threshold_ms is None:
+        return None
+    return CommandProfiler(config.base_path, config.profile_commands,
+                           None if config.profile_threshold_ms is None else config.profile_threshold_ms / 1000,
+                           config.profile_mode, config.profile_sample_interval_ms / 1000,
+                           config.profile_max_per_hour)
+
+
+def instrument_command(command):
+    # runs the callback under the client's profiler, if it has one
+    if getattr(command, "_bankerbot_profiled", False):
+        return command
+    callback = command._callback
+
+    @functools.wraps(callback)
+    async def profiled_callback(interaction, *args, **kwargs):
+        profiler = getattr(interaction.client, "profiler", None)
+        if profiler is None:
+            return await callback(interaction, *args, **kwargs)
+        return await profiler.run(command.name, lambda: callback(interaction, *args, **kwargs))
+
+    command._callback = profiled_callback
+    command._bankerbot_profiled = True
+    return command
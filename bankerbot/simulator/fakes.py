@@ -0,0 +1,106 @@
+#! fakes.py
+# offline stand-ins for the discord objects the command handlers touch
+import asyncio
+from typing import List, Optional, Dict
+
+
+class SentMessage:
+    def __init__(self, content: Optional[str], ephemeral: bool, kwargs: dict):
+        self.content = content
+        self.ephemeral = ephemeral
+        self.kwargs = kwargs
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str):
+        self.id = user_id
+        self.name = name
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, name: str, api_latency: float = 0.0):
+        self.id = channel_id
+        self.name = name
+        self.api_latency = api_latency
+        self.messages: List[SentMessage] = []
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, content: Optional[str] = None, **kwargs):
+        await asyncio.sleep(self.api_latency)
+        self.messages.append(SentMessage(content, False, kwargs))
+
+    async def purge(self, limit: int = 100):
+        await asyncio.sleep(self.api_latency)
+        del self.messages[-limit:]
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, channels: List[FakeChannel]):
+        self.id = guild_id
+        self.channels: Dict[int, FakeChannel] = {channel.id: channel for channel in channels}
+
+    def get_channel(self, channel_id: int) -> Optional[FakeChannel]:
+        return self.channels.get(channel_id)
+
+
+class FakeResponse:
+    def __init__(self, interaction: 'FakeInteraction'):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, *, ephemeral: bool = False, **kwargs):
+        if self._done:
+            raise RuntimeError("This interaction has already been responded to before")
+        self._done = True
+        await asyncio.sleep(self.interaction.api_latency)
+
+    async def send_message(self, content: Optional[str] = None, *, ephemeral: bool = False, **kwargs):
+        if self._done:
+            raise RuntimeError("This interaction has already been responded to before")
+        self._done = True
+        await asyncio.sleep(self.interaction.api_latency)
+        self.interaction.sent.append(SentMessage(content, ephemeral, kwargs))
+
+
+class FakeFollowup:
+    def __init__(self, interaction: 'FakeInteraction'):
+        self.interaction = interaction
+
+    async def send(self, content: Optional[str] = None, *, ephemeral: bool = False, **kwargs):
+        if not self.interaction.response.is_done():
+            raise RuntimeError("Followups require the interaction to have been responded to")
+        await asyncio.sleep(self.interaction.api_latency)
+        self.interaction.sent.append(SentMessage(content, ephemeral, kwargs))
+
+
+class FakeCommand:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class FakeClient:
+    # carries what the handlers read off interaction.client
+    def __init__(self, config, games, outbound):
+        self.config = config
+        self.games = games
+        self.outbound = outbound
+
+
+class FakeInteraction:
+    def __init__(self, client: FakeClient, guild: FakeGuild, user: FakeUser, command_name: str,
+                 data: Optional[dict] = None, api_latency: float = 0.0):
+        self.client = client
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = user
+        self.command = FakeCommand(command_name)
+        self.data = data or {}
+        self.api_latency = api_latency
+        self.sent: List[SentMessage] = []
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
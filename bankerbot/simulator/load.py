@@ -0,0 +1,198 @@
+#! load.py
+# drives the real command handlers with fake interactions from many concurrent simulated players;
+# run from the bankerbot directory with
+#   python -m simulator.load --players 300 --commands-per-player 20 --api-latency 0.05
+# handlers are invoked through their callbacks, so app command checks such as cooldowns are not applied
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import banker_dom
+import bankerbot
+from banker_dom import Game
+from bot_config import BotConfig
+from game_state import GameStateService
+from guild_registry import GameRegistry, load_guild_configs
+from outbound import OutboundDispatcher
+from benchmarks.run import summarize
+from benchmarks.synthetic import make_game
+from simulator.fakes import FakeChannel, FakeClient, FakeGuild, FakeInteraction, FakeUser
+
+GUILD_ID = 1
+VOTE_CHANNEL = 10
+MODERATOR_ACTION_CHANNEL = 11
+
+COMMAND_WEIGHTS = {"balance": 30, "autocomplete": 20, "vote-player": 15, "transfer": 10, "deposit": 8,
+                   "withdraw": 8, "day-action": 4, "vote-report": 5}
+
+
+def total_assets(game: Game) -> int:
+    return sum(player.assets for player in game.players) + sum(faction.assets for faction in game.factions)
+
+
+class Simulation:
+    def __init__(self, directory: str, players: int, factions: int, api_latency: float, seed: int):
+        self.rng = random.Random(seed)
+        game = make_game(players=players, factions=factions, rounds=1, votes_per_round=0, seed=seed)
+        banker_dom.write_dom_to_json(game, os.path.join(directory, "game.json"), "json")
+
+        config = BotConfig(token=None, guild_id=GUILD_ID, player_role_id=2, vote_channel=VOTE_CHANNEL,
+                           moderator_action_channel=MODERATOR_ACTION_CHANNEL, moderator_role_id=3,
+                           base_path=directory, flush_interval=0.5, flush_threshold=200, game_idle_timeout=0)
+        # the game itself is loaded by the first simulated command, as in the bot
+        self.games = GameRegistry(config, load_guild_configs(config))
+        self.state: Optional[GameStateService] = None
+        # the fake channels have no rate limit of their own, so only the batching is exercised here
+        self.client = FakeClient(config, self.games, OutboundDispatcher(batch_window=0.5, rate=1000, per=1.0))
+        self.guild = FakeGuild(GUILD_ID, [FakeChannel(VOTE_CHANNEL, "votes", api_latency),
+                                          FakeChannel(MODERATOR_ACTION_CHANNEL, "mod-actions", api_latency)])
+        self.api_latency = api_latency
+        self.users = [FakeUser(player.player_id, player.player_discord_name) for player in game.players]
+        self.initial_assets = total_assets(game)
+        self.spent_on_actions = 0
+        self.latencies: Dict[str, List[float]] = {name: [] for name in COMMAND_WEIGHTS}
+        self.violations: List[str] = []
+
+    def interaction(self, user: FakeUser, command_name: str, data: dict) -> FakeInteraction:
+        return FakeInteraction(self.client, self.guild, user, command_name, data, self.api_latency)
+
+    async def run_command(self, user: FakeUser):
+        command_name = self.rng.choices(list(COMMAND_WEIGHTS), weights=list(COMMAND_WEIGHTS.values()))[0]
+        target = self.rng.choice(self.users)
+        amount = self.rng.randint(0, 3)
+        if command_name == "autocomplete":
+            interaction = self.interaction(user, "transfer", {})
+            call = bankerbot.player_list_autocomplete(interaction, target.name[:self.rng.randint(0, 4)])
+        elif command_name == "balance":
+            of_type = self.rng.choice(["Player", "Faction", "Tension"])
+            interaction = self.interaction(user, command_name, {"of_type": of_type})
+            call = bankerbot.balance.callback(interaction, of_type)
+        elif command_name == "vote-player":
+            interaction = self.interaction(user, command_name, {"player": str(target.id)})
+            if self.rng.random() < 0.1:
+                call = bankerbot.vote_player.callback(interaction, None, self.rng.choice(["No Vote", "Unvote"]))
+            else:
+                call = bankerbot.vote_player.callback(interaction, str(target.id), None)
+        elif command_name == "transfer":
+            interaction = self.interaction(user, command_name, {"player": str(target.id), "amount": amount})
+            call = bankerbot.transfer.callback(interaction, str(target.id), amount)
+        elif command_name == "deposit":
+            interaction = self.interaction(user, command_name, {"amount": amount})
+            call = bankerbot.deposit.callback(interaction, amount)
+        elif command_name == "withdraw":
+            interaction = self.interaction(user, command_name, {"amount": amount})
+            call = bankerbot.withdraw.callback(interaction, amount)
+        elif command_name == "day-action":
+            interaction = self.interaction(user, command_name, {"action": "Rob", "cost": amount})
+            call = bankerbot.day_action.callback(interaction, "Rob", amount)
+        else:
+            interaction = self.interaction(user, command_name, {})
+            call = bankerbot.vote_report.callback(interaction, None, 'No')
+
+        start = time.perf_counter()
+        try:
+            result = await call
+        except Exception as error:
+            self.violations.append(f'{command_name} by {user.name} raised {error!r}')
+            return
+        self.latencies[command_name].append(time.perf_counter() - start)
+
+        if command_name == "autocomplete":
+            if len(result) > 25:
+                self.violations.append(f'autocomplete returned {len(result)} choices')
+        elif not interaction.response.is_done():
+            self.violations.append(f'{command_name} by {user.name} never responded')
+        elif command_name == "day-action" and interaction.sent[0].content.startswith('Submitted request'):
+            self.spent_on_actions += amount
+
+    async def player_loop(self, user: FakeUser, commands: int, think_time: float):
+        for _ in range(commands):
+            await self.run_command(user)
+            if think_time:
+                await asyncio.sleep(self.rng.uniform(0, think_time))
+
+    def check_invariants(self):
+        game = self.state.get()
+        expected = self.initial_assets - self.spent_on_actions
+        if total_assets(game) != expected:
+            self.violations.append(f'total assets {total_assets(game)} != expected {expected}')
+        for player in game.players:
+            if player.assets < 0:
+                self.violations.append(f'player {player.player_discord_name} has negative assets {player.assets}')
+        for faction in game.factions:
+            if faction.assets < 0:
+                self.violations.append(f'faction {faction.faction_name} has negative assets {faction.assets}')
+        for a_round in game.rounds:
+            tallied = sum(len(voters) for _, voters in a_round.get_standings())
+            if tallied != len(a_round.votes):
+                self.violations.append(f'round {a_round.round_number} tallies {tallied} votes but holds {len(a_round.votes)}')
+
+        if self.state.ledger is not None:
+            for mismatch in self.state.ledger.audit(game):
+                self.violations.append(f'ledger differs from the game for {mismatch}')
+
+        # whatever was persisted must round-trip to exactly the in-memory state
+        self.state.flush()
+        stored = self.state.store.load()
+        if stored.to_dict() != game.to_dict():
+            self.violations.append('persisted game differs from the in-memory game')
+
+    async def run(self, commands_per_player: int, think_time: float) -> dict:
+        start = time.perf_counter()
+        await asyncio.gather(*(self.player_loop(user, commands_per_player, think_time) for user in self.users))
+        elapsed = time.perf_counter() - start
+        await self.client.outbound.close()
+        self.state = self.games.get_state(GUILD_ID)
+        self.check_invariants()
+        await self.games.close()
+
+        completed = sum(len(durations) for durations in self.latencies.values())
+        return {"players": len(self.users),
+                "commands": completed,
+                "elapsed_s": elapsed,
+                "throughput_per_s": completed / elapsed if elapsed else 0.0,
+                "channel_messages": {channel.name: len(channel.messages) for channel in self.guild.channels.values()},
+                "queued_announcements": self.client.outbound.batched_count,
+                "latency": {name: summarize(durations) for name, durations in self.latencies.items() if durations},
+                "violations": self.violations}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test of the bankerbot command handlers")
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--factions", type=int, default=5)
+    parser.add_argument("--commands-per-player", type=int, default=20)
+    parser.add_argument("--api-latency", type=float, default=0.02,
+                        help="simulated seconds per discord API call")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="maximum random pause between a player's commands")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON to this path")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        simulation = Simulation(directory, args.players, args.factions, args.api_latency, args.seed)
+        report = asyncio.run(simulation.run(args.commands_per_player, args.think_time))
+
+    print(f"{report['commands']} commands from {report['players']} players in {report['elapsed_s']:.2f}s "
+          f"({report['throughput_per_s']:.1f}/s)")
+    print(f"{report['queued_announcements']} vote announcements posted as channel messages {report['channel_messages']}")
+    for name, summary in report["latency"].items():
+        print(f"{name:15s} n={summary['runs']:6d}  p50 {summary['p50_ms']:9.3f} ms  p99 {summary['p99_ms']:9.3f} ms")
+    for violation in report["violations"]:
+        print(f"VIOLATION: {violation}")
+
+    if args.output:
+        with open(args.output, 'w', encoding="utf8") as outfile:
+            json.dump(report, outfile, indent=2)
+    sys.exit(1 if report["violations"] else 0)
+
+
+if __name__ == "__main__":
+    main()